@@ -1,20 +1,21 @@
 import os
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
 from flask_restx import Api
 from dotenv import load_dotenv
+from app.security.token_cache import CachingJWTManager
+from app.database.pool import engine_options_from_env, pool_snapshot
+from app.database.routing import RoutingSQLAlchemy, init_replica_routing, replica_binds, replica_keys
+from app.database.sqlite import configure_sqlite, is_production_profile
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize extensions
-db = SQLAlchemy()
-migrate = Migrate()
-jwt = JWTManager()
-api = Api(
+db = RoutingSQLAlchemy()
+jwt = CachingJWTManager()
+# Named so that it is not shadowed by the ``app.api`` package once that is imported
+restx_api = Api(
     title="Document Template API",
     version="1.0.0",
     description="API for Document Template Management System",
@@ -32,6 +33,11 @@ api = Api(
 
 def create_app(test_config=None):
     """Create and configure the Flask application"""
+    # Imported here because the sharding module needs ``db`` from this module
+    from app.database.sharding import init_sharding, shard_binds, shard_keys, tenants_cli
+    from app.database.schema import create_schema, schema_cli
+    from app.database.change_log import changes_cli
+    
     app = Flask(__name__)
     
     # Configure the application
@@ -41,6 +47,97 @@ def create_app(test_config=None):
         app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///doctemplate.db')
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
         app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-dev-key')
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env()
+        
+        # Tables are created by `flask schema create`, not by every worker on boot
+        app.config['AUTO_CREATE_SCHEMA'] = os.environ.get('AUTO_CREATE_SCHEMA', 'false').lower() in ('true', '1', 't')
+        
+        # Read replicas for GET requests (comma separated URLs)
+        app.config['SQLALCHEMY_BINDS'] = replica_binds(os.environ.get('DATABASE_REPLICA_URLS'))
+        app.config['DATABASE_REPLICA_STICKY_SECONDS'] = float(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+        
+        # Tenant shards for documents (name=url, comma separated)
+        app.config['SQLALCHEMY_BINDS'].update(shard_binds(os.environ.get('TENANT_SHARD_URLS')))
+        app.config['TENANT_SHARD_REFRESH_SECONDS'] = float(os.environ.get('TENANT_SHARD_REFRESH_SECONDS', 5))
+        
+        # SQLite tuning for multi-worker deployments (SQLITE_PROFILE=production)
+        app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'default')
+        app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+        app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+        app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024))
+        app.config['SQLITE_WRITE_RETRIES'] = int(os.environ.get('SQLITE_WRITE_RETRIES', 5))
+        
+        # Password hashing pool (PASSWORD_HASH_WORKERS=0 hashes on the request thread)
+        app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+        app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+        app.config['PASSWORD_HASH_QUEUE_DEPTH'] = int(os.environ.get('PASSWORD_HASH_QUEUE_DEPTH', 8))
+        app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+        
+        # How often each worker pulls new token revocations
+        app.config['JWT_REVOCATION_REFRESH_SECONDS'] = float(os.environ.get('JWT_REVOCATION_REFRESH_SECONDS', 5))
+        
+        # Verified tokens kept per worker (0 disables the cache)
+        app.config['JWT_DECODE_CACHE_SIZE'] = int(os.environ.get('JWT_DECODE_CACHE_SIZE', 1024))
+        
+        # How long a stored Idempotency-Key response is replayed
+        app.config['IDEMPOTENCY_KEY_TTL_SECONDS'] = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', 86400))
+        # An unfinished first request older than this is taken to have died with its worker
+        app.config['IDEMPOTENCY_CLAIM_SECONDS'] = int(os.environ.get('IDEMPOTENCY_CLAIM_SECONDS', 120))
+        
+        # Serve Prometheus metrics on /metrics (keep it off unless only the scraper can reach it)
+        app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'false').lower() in ('true', '1', 't')
+        
+        # Sampled request profiling (admins can also send X-Profile)
+        app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', 'false').lower() in ('true', '1', 't')
+        app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+        app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 2))
+        app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+        app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 50))
+        
+        # Per-request query stats (negative SLOW_QUERY_MS disables EXPLAIN logging)
+        app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+        app.config['REQUEST_LOG'] = os.environ.get('REQUEST_LOG', 'false').lower() in ('true', '1', 't')
+        
+        # Response compression (br and zstd need the optional brotli/zstandard packages)
+        app.config['COMPRESSION_ENABLED'] = os.environ.get('COMPRESSION_ENABLED', 'true').lower() in ('true', '1', 't')
+        app.config['COMPRESSION_ENCODINGS'] = os.environ.get('COMPRESSION_ENCODINGS', 'br,zstd,gzip').split(',')
+        app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+        app.config['COMPRESSION_CACHE_BYTES'] = int(os.environ.get('COMPRESSION_CACHE_BYTES', 32 * 1024 * 1024))
+        
+        # Threads per ASGI worker for the routes passed through to Flask
+        app.config['ASGI_THREADS'] = int(os.environ.get('ASGI_THREADS', 16))
+        
+        # Station event streams (STATION_EVENTS_FILE shares events between workers)
+        app.config['STATION_EVENTS_FILE'] = os.environ.get('STATION_EVENTS_FILE')
+        app.config['STATION_EVENTS_BUFFER'] = int(os.environ.get('STATION_EVENTS_BUFFER', 1000))
+        app.config['STATION_EVENTS_HEARTBEAT_SECONDS'] = float(os.environ.get('STATION_EVENTS_HEARTBEAT_SECONDS', 15))
+        app.config['STATION_EVENTS_MAX_SECONDS'] = float(os.environ.get('STATION_EVENTS_MAX_SECONDS', 300))
+        app.config['STATION_EVENTS_MAX_BYTES'] = int(os.environ.get('STATION_EVENTS_MAX_BYTES', 64 * 1024 * 1024))
+        # Streams per worker; each holds a thread, so keep it below GUNICORN_THREADS / ASGI_THREADS
+        app.config['STATION_EVENTS_MAX_STREAMS'] = int(os.environ.get('STATION_EVENTS_MAX_STREAMS', 8))
+        
+        # How often each worker checks the change log for flow, step and station edits made elsewhere
+        app.config['FLOW_GRAPH_REFRESH_SECONDS'] = float(os.environ.get('FLOW_GRAPH_REFRESH_SECONDS', 5))
+        
+        # Background jobs (JOBS_DIR defaults to <instance>/jobs)
+        app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR')
+        app.config['JOBS_MAX_ATTEMPTS'] = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+        app.config['JOBS_RETRY_BACKOFF_SECONDS'] = float(os.environ.get('JOBS_RETRY_BACKOFF_SECONDS', 5))
+        app.config['JOBS_LEASE_SECONDS'] = float(os.environ.get('JOBS_LEASE_SECONDS', 300))
+        app.config['JOBS_POLL_SECONDS'] = float(os.environ.get('JOBS_POLL_SECONDS', 1))
+        
+        # Document rendering (RENDER_CACHE_DIR defaults to <instance>/renders; 0 processes renders inline)
+        app.config['RENDER_PDF_RENDERER'] = os.environ.get('RENDER_PDF_RENDERER')
+        # TrueType files for the built-in renderer; needed for Thai text
+        app.config['RENDER_PDF_FONT'] = os.environ.get('RENDER_PDF_FONT')
+        app.config['RENDER_PDF_BOLD_FONT'] = os.environ.get('RENDER_PDF_BOLD_FONT')
+        app.config['RENDER_PROCESSES'] = int(os.environ.get('RENDER_PROCESSES', 2))
+        app.config['RENDER_TIMEOUT_SECONDS'] = float(os.environ.get('RENDER_TIMEOUT_SECONDS', 30))
+        app.config['RENDER_CACHE_DIR'] = os.environ.get('RENDER_CACHE_DIR')
+        app.config['RENDER_CACHE_MAX_BYTES'] = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+        
+        # Reading station analytics older than this queues a background refresh (or run `flask analytics refresh` from cron)
+        app.config['ANALYTICS_REFRESH_SECONDS'] = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 60))
     else:
         # Load test config
         app.config.from_mapping(test_config)
@@ -53,24 +150,84 @@ def create_app(test_config=None):
     
     # Initialize extensions with app
     db.init_app(app)
-    migrate.init_app(app, db)
+    # Flask-Migrate imports Alembic, which is slow; only the `flask db` commands need it
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    init_replica_routing(app)
+    init_sharding(app)
     CORS(app)
     jwt.init_app(app)
     
+    from app.security.claims import register_token_callbacks
+    register_token_callbacks(jwt)
+    
+    from app.observability.profiling import init_profiling
+    from app.observability.query_stats import init_query_stats
+    from app.observability.metrics import init_metrics
+    init_profiling(app)
+    init_query_stats(app)
+    init_metrics(app)
+    
+    from app.middleware.compression import init_compression
+    init_compression(app)
+    
+    from app.api.v1.utils.station_events import init_station_events
+    init_station_events(app)
+    
+    from app.rendering.service import init_rendering
+    init_rendering(app)
+    
+    from app.api.v1.utils.fieldsets import init_fieldsets
+    init_fieldsets(app)
+    
     # Register API blueprints
     from app.api.v1 import bp as api_v1_bp
     app.register_blueprint(api_v1_bp)
     
     # Initialize API documentation
-    api.init_app(app)
+    restx_api.init_app(app)
+    
+    # Register CLI commands
+    from app.security.passwords import passwords_cli
+    app.cli.add_command(passwords_cli)
+    app.cli.add_command(tenants_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(changes_cli)
+    
+    from app.observability.loadtest import loadtest_cli
+    app.cli.add_command(loadtest_cli)
+    
+    from app.jobs.queue import jobs_cli
+    app.cli.add_command(jobs_cli)
+    
+    from app.rendering.service import render_cli
+    app.cli.add_command(render_cli)
+    
+    from app.database.station_dwell import analytics_cli
+    app.cli.add_command(analytics_cli)
     
-    # Create database tables
     with app.app_context():
-        db.create_all()
+        if is_production_profile(app.config):
+            for bind in [None] + replica_keys(app) + shard_keys(app):
+                configure_sqlite(db.get_engine(app, bind), app.config)
+    
+    # Test configs create their tables on startup unless they opt out
+    if app.config.get('AUTO_CREATE_SCHEMA', True):
+        create_schema(app)
     
     @app.route('/health')
     def health_check():
         """Health check endpoint"""
         return {"status": "healthy", "version": "1.0.0"}
     
+    from app.security.claims import role_required
+    
+    @app.route('/metrics/pool')
+    @role_required('admin')
+    def pool_metrics():
+        """Connection pool statistics for this worker, named by bind (URLs name hosts and users)"""
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or {})
+        return pool_snapshot({bind or 'primary': db.get_engine(app, bind) for bind in binds})
+    
     return app
@@ -1,4 +1,5 @@
 from app import db
+from app.database.sqlite import serialized_commit
 from datetime import datetime
 import uuid
 
@@ -13,10 +14,8 @@ class Base(db.Model):
     
     def save(self):
         """Save the model instance to the database"""
-        db.session.add(self)
-        db.session.commit()
+        serialized_commit(db.session, lambda: db.session.add(self), self)
     
     def delete(self):
         """Delete the model instance from the database"""
-        db.session.delete(self)
-        db.session.commit()
+        serialized_commit(db.session, lambda: db.session.delete(self), self)
@@ -2,7 +2,7 @@ from app import db
 from app.api.v1.models.base import Base
 from datetime import datetime
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.security.passwords import hash_password, verify_password, needs_rehash
 
 class User(Base):
     """User model for authentication and authorization"""
@@ -13,17 +13,22 @@ class User(Base):
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), default='user')  # user, admin
     is_active = db.Column(db.Boolean, default=True)
+    tenant_id = db.Column(db.String(64), nullable=True)  # Organization, sent as the 'tenant' claim
     
     def __repr__(self):
         return f'<User {self.username}>'
     
     def set_password(self, password):
         """Hash the password for storage"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
         """Check if the password matches the hash"""
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Check if the stored hash uses an outdated hashing method"""
+        return needs_rehash(self.password_hash)
 
 
 class Template(Base):
@@ -45,10 +50,9 @@ class Template(Base):
         return f'<Template {self.name}>'
     
     def get_editable_fields(self):
-        """Get the list of editable fields"""
-        if self.editable_fields:
-            return json.loads(self.editable_fields)
-        return []
+        """Get the list of editable fields (a fresh copy on every call)"""
+        from app.api.v1.utils.template_fields import template_fields
+        return template_fields(self).definitions()
     
     def set_editable_fields(self, fields):
         """Set the list of editable fields"""
@@ -65,13 +69,82 @@ class Document(Base):
     status = db.Column(db.String(20), default='draft')  # draft, submitted, approved, rejected
     current_station_id = db.Column(db.Integer, db.ForeignKey('stations.id'), nullable=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    tenant_id = db.Column(db.String(64), nullable=True)  # Organization; selects the shard
+    
+    __table_args__ = (
+        db.Index('ix_documents_tenant_updated', 'tenant_id', 'updated_at'),
+    )
     
     # Relationships
     document_history = db.relationship('DocumentHistory', backref='document', lazy=True)
     creator = db.relationship('User', backref='created_documents', foreign_keys=[created_by])
+    # One extra query per batch of documents instead of one per document
+    fields = db.relationship('DocumentField', backref='document', lazy='selectin', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Document {self.name}>'
+    
+    def get_field_values(self):
+        """Get the filled editable fields as a dict"""
+        return {field.name: field.value for field in self.fields}
+    
+    def set_field_values(self, values):
+        """Store typed field values, given as ``{name: (type, value)}``; None removes a field"""
+        existing = {field.name: field for field in self.fields}
+        for name, (value_type, value) in values.items():
+            field = existing.get(name)
+            if value is None:
+                if field is not None:
+                    self.fields.remove(field)
+                continue
+            if field is None:
+                field = DocumentField(name=name)
+                self.fields.append(field)
+            field.tenant_id = self.tenant_id
+            field.set_value(value_type, value)
+        if values:
+            # Field rows are separate; bump the document so the change log and ETags see the edit
+            self.updated_at = datetime.utcnow()
+
+
+class DocumentField(Base):
+    """One filled editable field of a document, typed so it can be indexed and compared"""
+    __tablename__ = 'document_fields'
+    
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    value_type = db.Column(db.String(20), nullable=False)  # text, number, date, boolean
+    # Exactly one of these is set, according to value_type (booleans are numbers 0/1)
+    text_value = db.Column(db.Text, nullable=True)
+    number_value = db.Column(db.Float, nullable=True)
+    date_value = db.Column(db.Date, nullable=True)
+    tenant_id = db.Column(db.String(64), nullable=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('document_id', 'name', name='uq_document_fields_document_name'),
+        db.Index('ix_document_fields_name_number', 'name', 'number_value'),
+        db.Index('ix_document_fields_name_date', 'name', 'date_value'),
+        db.Index('ix_document_fields_name_text', 'name', 'text_value'),
+    )
+    
+    def __repr__(self):
+        return f'<DocumentField {self.name}={self.value!r}>'
+    
+    @property
+    def value(self):
+        if self.value_type == 'number':
+            return int(self.number_value) if self.number_value.is_integer() else self.number_value
+        if self.value_type == 'boolean':
+            return bool(self.number_value)
+        if self.value_type == 'date':
+            return self.date_value.isoformat()
+        return self.text_value
+    
+    def set_value(self, value_type, value):
+        self.value_type = value_type
+        self.text_value = value if value_type == 'text' else None
+        self.number_value = float(value) if value_type in ('number', 'boolean') else None
+        self.date_value = value if value_type == 'date' else None
 
 
 class Station(Base):
@@ -132,6 +205,11 @@ class DocumentHistory(Base):
     description = db.Column(db.Text, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     station_id = db.Column(db.Integer, db.ForeignKey('stations.id'), nullable=True)
+    tenant_id = db.Column(db.String(64), nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_document_history_document_created', 'document_id', 'created_at'),
+    )
     
     # Relationships
     user = db.relationship('User', backref='document_history_entries')
@@ -139,3 +217,173 @@ class DocumentHistory(Base):
     
     def __repr__(self):
         return f'<DocumentHistory {self.action} at {self.created_at}>'
+
+
+class RevokedToken(Base):
+    """Revoked access token, kept until the token would have expired"""
+    __tablename__ = 'revoked_tokens'
+    
+    jti = db.Column(db.String(36), unique=True, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<RevokedToken {self.jti}>'
+
+
+class TenantShard(Base):
+    """Which shard database holds a tenant's documents"""
+    __tablename__ = 'tenant_shards'
+    
+    tenant_id = db.Column(db.String(64), unique=True, nullable=False)
+    shard = db.Column(db.String(64), nullable=False, default='primary')
+    state = db.Column(db.String(20), nullable=False, default='active')  # active, moving
+    
+    def __repr__(self):
+        return f'<TenantShard {self.tenant_id} on {self.shard}>'
+
+
+class IdempotencyKey(db.Model):
+    """Stored response for a client-supplied Idempotency-Key (kept compact, no Base columns)"""
+    __tablename__ = 'idempotency_keys'
+    
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of caller, method, path and key
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)  # None while the first request runs
+    mimetype = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    response_headers = db.Column(db.Text, nullable=True)  # Stored as JSON: the headers a replay repeats
+    claimed_at = db.Column(db.DateTime, nullable=True)  # When the request that owns the key started
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key[:12]}>'
+
+
+class ChangeLog(db.Model):
+    """One insert, update or delete of a tracked row, numbered in commit order (compact, no Base columns)"""
+    __tablename__ = 'change_log'
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # document, template, station, flow, flow_step
+    entity_id = db.Column(db.String(36), nullable=False)  # public_id of the changed row
+    op = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    tenant_id = db.Column(db.String(64), nullable=True)
+    data = db.Column(db.Text, nullable=True)  # JSON of the row after the change; None for deletes
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_change_log_entity', 'entity', 'entity_id', 'seq'),
+        # Never reuse a seq after compaction deleted the newest rows
+        {'sqlite_autoincrement': True},
+    )
+    
+    def __repr__(self):
+        return f'<ChangeLog {self.seq} {self.op} {self.entity}>'
+
+
+class ChangeLogCounter(db.Model):
+    """Last change log seq handed out; one row per database, locked by writers until they commit"""
+    __tablename__ = 'change_log_counter'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ChangeLogCounter {self.value}>'
+
+
+class StationDwellRollup(db.Model):
+    """Histogram of finished station visits: how many lasted about 2**(bucket/4) seconds (compact, no Base columns)"""
+    __tablename__ = 'station_dwell_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.String(64), nullable=True)
+    station_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    
+    __table_args__ = (
+        db.Index('ix_station_dwell_rollups_tenant_station', 'tenant_id', 'station_id', 'bucket'),
+    )
+    
+    def __repr__(self):
+        return f'<StationDwellRollup {self.station_id}:{self.bucket} x{self.count}>'
+
+
+class StationVisit(db.Model):
+    """Station a document is in now and since when; closed into the rollup when it moves on"""
+    __tablename__ = 'station_visits'
+    
+    document_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    station_id = db.Column(db.Integer, nullable=False)
+    entered_at = db.Column(db.DateTime, nullable=False)
+    tenant_id = db.Column(db.String(64), nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_station_visits_tenant_station', 'tenant_id', 'station_id'),
+    )
+    
+    def __repr__(self):
+        return f'<StationVisit {self.document_id} at {self.station_id}>'
+
+
+class AnalyticsState(db.Model):
+    """How far a rollup has read ``document_history`` on this database"""
+    __tablename__ = 'analytics_state'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    last_history_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, nullable=True)
+    refresh_queued_at = db.Column(db.DateTime, nullable=True)  # Last time a read queued a refresh
+    
+    def __repr__(self):
+        return f'<AnalyticsState {self.name} at {self.last_history_id}>'
+
+
+class AnalyticsGap(db.Model):
+    """A history id a rollup passed over while it was not visible, kept in case its transaction commits late"""
+    __tablename__ = 'analytics_gaps'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    history_id = db.Column(db.Integer, primary_key=True)
+    noted_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<AnalyticsGap {self.name} {self.history_id}>'
+
+
+class Job(Base):
+    """Background job queued by an API call and run by `flask jobs worker`"""
+    __tablename__ = 'jobs'
+    
+    kind = db.Column(db.String(50), nullable=False)  # registered handler name, e.g. documents.export
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    params = db.Column(db.Text, nullable=True)  # Stored as JSON
+    result = db.Column(db.Text, nullable=True)  # Stored as JSON
+    error = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0.0 to 1.0
+    progress_message = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # retry backoff
+    locked_by = db.Column(db.String(100), nullable=True)  # worker running the job
+    locked_until = db.Column(db.DateTime, nullable=True)  # lease; expired leases are requeued
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    tenant_id = db.Column(db.String(64), nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+    
+    def __repr__(self):
+        return f'<Job {self.kind} {self.status}>'
+    
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+    
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
@@ -0,0 +1,97 @@
+from flask import jsonify, current_app
+from flask_jwt_extended import jwt_required
+from app.api.v1 import bp
+from app.api.v1.models.models import Flow, FlowStep, Station
+from app.database.sharding import current_tenant, shard_engine, shard_map
+from app.database.station_dwell import (DEFAULT_REFRESH_SECONDS, last_refreshed, queue_refresh_if_stale,
+                                        station_histograms, summarize)
+from app.api.v1.utils.swagger import swag_from
+
+def _merge(histograms):
+    """Add up ``[(bucket, count, total_seconds)]`` lists bucket by bucket"""
+    merged = {}
+    for buckets in histograms:
+        for bucket, count, total in buckets:
+            previous = merged.get(bucket, (0, 0.0))
+            merged[bucket] = (previous[0] + count, previous[1] + total)
+    return [(bucket, count, total) for bucket, (count, total) in merged.items()]
+
+@bp.route('/analytics/stations', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Analytics'],
+    'summary': 'Time-in-station statistics',
+    'description': 'Finished visits, mean and p50/p90 dwell time per station, plus the documents at each '
+                   'station now. Each flow entry adds up the statistics of the stations the flow uses; history '
+                   'does not record which flow a document followed, so a station shared by several flows '
+                   'counts in each of them. Read from rollups of the document history as of refreshed_at; stale '
+                   'rollups are refreshed by a background job. Percentiles are approximate (within about 10%).',
+    'security': [{'Bearer': []}],
+    'responses': {
+        '200': {
+            'description': 'Dwell time statistics',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'stations': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object'
+                        }
+                    },
+                    'flows': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object'
+                        }
+                    },
+                    'refreshed_at': {
+                        'type': 'string'
+                    }
+                }
+            }
+        }
+    }
+})
+def get_station_analytics():
+    """Get dwell time statistics for the caller's organization"""
+    tenant = current_tenant()
+    engine = shard_engine(shard_map.lookup(tenant)[0])
+    max_age = current_app.config.get('ANALYTICS_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    queue_refresh_if_stale(engine, max_age)
+    refreshed_at = last_refreshed(engine)
+    histograms, current = station_histograms(engine, tenant)
+    
+    stations = []
+    for station in Station.query.order_by(Station.id).all():
+        summary = summarize(histograms.get(station.id, []))
+        stations.append({
+            'public_id': station.public_id,
+            'name': station.name,
+            'type': station.type,
+            'in_station': current.get(station.id, 0),
+            **summary
+        })
+    
+    # History does not say which flow a document followed, so a flow gets the union of its stations
+    flow_stations = {}
+    for flow_id, from_id, to_id in FlowStep.query.with_entities(
+            FlowStep.flow_id, FlowStep.from_station_id, FlowStep.to_station_id):
+        flow_stations.setdefault(flow_id, set()).update((from_id, to_id))
+    flows = []
+    for flow in Flow.query.order_by(Flow.id).all():
+        station_ids = flow_stations.get(flow.id, set())
+        summary = summarize(_merge(histograms.get(station_id, []) for station_id in station_ids))
+        flows.append({
+            'public_id': flow.public_id,
+            'name': flow.name,
+            'stations': len(station_ids),
+            'in_flow': sum(current.get(station_id, 0) for station_id in station_ids),
+            **summary
+        })
+    
+    return jsonify({
+        'stations': stations,
+        'flows': flows,
+        'refreshed_at': refreshed_at.isoformat() if refreshed_at else None
+    }), 200
@@ -1,16 +1,24 @@
 from flask import request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 from app.api.v1 import bp
 from app import db
 from app.api.v1.models.models import User
 from app.api.v1.schemas.schemas import UserSchema, LoginSchema
+from app.security.passwords import PasswordHasherBusy
+from app.security.claims import current_claims, revoke_token
 from marshmallow import ValidationError
-from datetime import timedelta
-from flasgger import swag_from
+from datetime import datetime, timedelta
+from app.api.v1.utils.swagger import swag_from
 
 user_schema = UserSchema()
 login_schema = LoginSchema()
 
+
+def hasher_busy_response():
+    """Response for when the password hashing pool is saturated"""
+    return jsonify({"error": "Server busy, please retry"}), 503, {'Retry-After': '1'}
+
+
 @bp.route('/auth/register', methods=['POST'])
 @swag_from({
     'tags': ['Authentication'],
@@ -57,6 +65,9 @@ login_schema = LoginSchema()
         },
         '400': {
             'description': 'Validation error or user already exists'
+        },
+        '503': {
+            'description': 'Password hashing pool is busy'
         }
     }
 })
@@ -81,7 +92,10 @@ def register():
         email=data['email'],
         role='user'
     )
-    user.set_password(data['password'])
+    try:
+        user.set_password(data['password'])
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     
     # Save user to database
     user.save()
@@ -134,6 +148,9 @@ def register():
         },
         '401': {
             'description': 'Invalid credentials'
+        },
+        '503': {
+            'description': 'Password hashing pool is busy'
         }
     }
 })
@@ -147,17 +164,31 @@ def login():
     
     # Check credentials
     user = User.query.filter_by(username=data['username']).first()
-    if not user or not user.check_password(data['password']):
-        return jsonify({"error": "Invalid credentials"}), 401
+    try:
+        if not user or not user.check_password(data['password']):
+            return jsonify({"error": "Invalid credentials"}), 401
+    except PasswordHasherBusy:
+        return hasher_busy_response()
     
     if not user.is_active:
         return jsonify({"error": "Account is inactive"}), 401
     
+    # Move the stored hash onto the configured method while we have the password
+    if user.password_needs_rehash():
+        try:
+            user.set_password(data['password'])
+            user.save()
+        except PasswordHasherBusy:
+            pass
+    
     # Create access token
     token_data = {
         "sub": user.public_id,
+        "id": user.id,
         "username": user.username,
-        "role": user.role
+        "email": user.email,
+        "role": user.role,
+        "tenant": user.tenant_id
     }
     access_token = create_access_token(
         identity=token_data, 
@@ -190,11 +221,45 @@ def login():
     }
 })
 def get_user_profile():
-    """Get current user profile"""
-    identity = get_jwt_identity()
-    user = User.query.filter_by(public_id=identity['sub']).first()
+    """Get current user profile from the token claims"""
+    claims = current_claims()
     
-    if not user:
-        return jsonify({"error": "User not found"}), 404
+    return jsonify({
+        "id": claims.get('id'),
+        "public_id": claims['sub'],
+        "username": claims['username'],
+        "email": claims.get('email'),
+        "role": claims['role']
+    }), 200
+
+
+@bp.route('/auth/logout', methods=['POST'])
+@jwt_required()
+@swag_from({
+    'tags': ['Authentication'],
+    'summary': 'Logout',
+    'description': 'Revoke the current access token on all workers',
+    'security': [{'Bearer': []}],
+    'responses': {
+        '200': {
+            'description': 'Token revoked',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'message': {
+                        'type': 'string'
+                    }
+                }
+            }
+        },
+        '401': {
+            'description': 'Not authenticated'
+        }
+    }
+})
+def logout():
+    """Revoke the current access token"""
+    token = get_jwt()
+    revoke_token(token['jti'], datetime.utcfromtimestamp(token['exp']))
     
-    return jsonify(user_schema.dump(user)), 200
+    return jsonify({"message": "Logged out successfully"}), 200
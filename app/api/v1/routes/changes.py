@@ -0,0 +1,75 @@
+from flask import request, jsonify, current_app
+from app.api.v1 import bp
+from app.security.claims import role_required
+from app.database.change_log import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, change_sources, format_cursor,
+                                     parse_cursor, read_changes)
+from app.api.v1.utils.swagger import swag_from
+
+@bp.route('/changes', methods=['GET'])
+@role_required('admin')
+@swag_from({
+    'tags': ['Changes'],
+    'summary': 'Read the change log',
+    'description': 'Inserts, updates and deletes of documents, templates, stations, flows and flow steps, '
+                   'oldest first. Pass the returned next cursor as after to continue. Changes are numbered '
+                   'in commit order, so a change never appears behind a cursor already returned.',
+    'security': [{'Bearer': []}],
+    'parameters': [
+        {
+            'name': 'after',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Cursor from the previous page (omit to start from the beginning)'
+        },
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'description': f'Changes per page (default {DEFAULT_PAGE_SIZE}, at most {MAX_PAGE_SIZE})'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'A page of changes',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'changes': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object'
+                        }
+                    },
+                    'next': {
+                        'type': 'string'
+                    },
+                    'has_more': {
+                        'type': 'boolean'
+                    }
+                }
+            }
+        },
+        '400': {
+            'description': 'Invalid cursor'
+        },
+        '403': {
+            'description': 'Admin role required'
+        }
+    }
+})
+def get_changes():
+    """Get a page of the change log"""
+    sources = change_sources(current_app)
+    try:
+        positions = parse_cursor(request.args.get('after'), sources)
+    except InvalidCursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    changes, positions, has_more = read_changes(current_app, positions, limit)
+    
+    return jsonify({
+        'changes': changes,
+        'next': format_cursor(positions),
+        'has_more': has_more
+    }), 200
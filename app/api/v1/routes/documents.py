@@ -1,16 +1,27 @@
-from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import request, jsonify, current_app, send_file
+from flask_jwt_extended import jwt_required
 from app.api.v1 import bp
 from app import db
-from app.api.v1.models.models import Document, Template, User, DocumentHistory, Station
-from app.api.v1.schemas.schemas import DocumentSchema, DocumentHistorySchema
+from app.api.v1.models.models import Document, Template, DocumentHistory, Station
+from app.security.claims import current_user_id
+from app.database.sharding import current_tenant
+from app.api.v1.schemas.schemas import DocumentSchema, DocumentHistorySchema, DocumentExportSchema, BulkTransitionSchema
+from app.api.v1.utils.idempotency import idempotent
+from app.api.v1.utils.station_events import document_events, publish_events
+from app.api.v1.utils.document_fields import InvalidFieldFilter, field_filters, validate_field_values
+from app.api.v1.utils.fieldsets import fieldset
+from app.api.v1.routes.jobs import job_response
+from app.jobs.handlers import EXPORT_DOCUMENTS, BULK_TRANSITION
+from app.jobs.queue import enqueue
+from app.rendering.pdf import UnsupportedText
+from app.rendering.service import RenderTimeout, render_document
 from marshmallow import ValidationError
-from flasgger import swag_from
+from app.api.v1.utils.swagger import swag_from
 
 document_schema = DocumentSchema()
-documents_schema = DocumentSchema(many=True)
 history_schema = DocumentHistorySchema()
-history_list_schema = DocumentHistorySchema(many=True)
+export_schema = DocumentExportSchema()
+bulk_transition_schema = BulkTransitionSchema()
 
 @bp.route('/documents', methods=['GET'])
 @jwt_required()
@@ -38,6 +49,13 @@ history_list_schema = DocumentHistorySchema(many=True)
             'in': 'query',
             'type': 'string',
             'description': 'Filter documents by current station public ID'
+        },
+        {
+            'name': 'field.<name>__<op>',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Filter by an editable field value, e.g. field.amount__gt=10000 '
+                           '(op: eq, ne, gt, gte, lt, lte, in; omit __<op> for eq)'
         }
     ],
     'responses': {
@@ -54,7 +72,8 @@ history_list_schema = DocumentHistorySchema(many=True)
 })
 def get_documents():
     """Get all documents"""
-    query = Document.query
+    view = fieldset('document')
+    query = Document.query.filter_by(tenant_id=current_tenant())
     
     # Apply filters
     status = request.args.get('status')
@@ -73,10 +92,15 @@ def get_documents():
         if station:
             query = query.filter_by(current_station_id=station.id)
     
+    try:
+        query = query.filter(*field_filters(request.args))
+    except InvalidFieldFilter as err:
+        return jsonify({"error": str(err)}), 400
+    
     # Get results ordered by last update
-    documents = query.order_by(Document.updated_at.desc()).all()
+    documents = query.options(*view.options).order_by(Document.updated_at.desc()).all()
     
-    return jsonify(documents_schema.dump(documents)), 200
+    return jsonify(view.many.dump(documents)), 200
 
 
 @bp.route('/documents/<string:public_id>', methods=['GET'])
@@ -109,16 +133,18 @@ def get_documents():
 })
 def get_document(public_id):
     """Get a specific document"""
-    document = Document.query.filter_by(public_id=public_id).first()
+    view = fieldset('document')
+    document = Document.query.options(*view.options).filter_by(public_id=public_id, tenant_id=current_tenant()).first()
     
     if not document:
         return jsonify({"error": "Document not found"}), 404
     
-    return jsonify(document_schema.dump(document)), 200
+    return jsonify(view.schema.dump(document)), 200
 
 
 @bp.route('/documents', methods=['POST'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Documents'],
     'summary': 'Create a document',
@@ -151,6 +177,11 @@ def get_document(public_id):
                     'current_station_id': {
                         'type': 'integer',
                         'example': 1
+                    },
+                    'fields': {
+                        'type': 'object',
+                        'description': "Values of the template's editable fields",
+                        'example': {'amount': 12500, 'due_date': '2024-07-31'}
                     }
                 },
                 'required': ['name', 'content', 'template_id']
@@ -174,6 +205,7 @@ def get_document(public_id):
 })
 def create_document():
     """Create a new document"""
+    view = fieldset('document')
     try:
         # Validate request data
         data = document_schema.load(request.json)
@@ -185,9 +217,15 @@ def create_document():
     if not template:
         return jsonify({"error": "Template not found"}), 404
     
-    # Get current user
-    identity = get_jwt_identity()
-    user = User.query.filter_by(public_id=identity['sub']).first()
+    try:
+        # Required fields are only enforced for clients that send fields at all
+        field_values = validate_field_values(template, data.get('field_values'),
+                                             partial='field_values' not in data)
+    except ValidationError as err:
+        return jsonify({"error": "Validation error", "messages": err.messages}), 400
+    
+    # Get current user from the token claims
+    user_id = current_user_id()
     
     # Create document
     document = Document(
@@ -196,8 +234,10 @@ def create_document():
         template_id=data['template_id'],
         status=data.get('status', 'draft'),
         current_station_id=data.get('current_station_id'),
-        created_by=user.id if user else None
+        created_by=user_id,
+        tenant_id=current_tenant()
     )
+    document.set_field_values(field_values)
     
     # Save document to database
     document.save()
@@ -207,18 +247,22 @@ def create_document():
         document_id=document.id,
         action='created',
         description='Document created',
-        user_id=user.id if user else None,
-        station_id=document.current_station_id
+        user_id=user_id,
+        station_id=document.current_station_id,
+        tenant_id=document.tenant_id
     )
     
     # Save history to database
     history.save()
     
-    return jsonify(document_schema.dump(document)), 201
+    publish_events(document_events(document, 'created'))
+    
+    return jsonify(view.schema.dump(document)), 201
 
 
 @bp.route('/documents/<string:public_id>', methods=['PUT'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Documents'],
     'summary': 'Update a document',
@@ -250,6 +294,10 @@ def create_document():
                     },
                     'current_station_id': {
                         'type': 'integer'
+                    },
+                    'fields': {
+                        'type': 'object',
+                        'description': 'Field values to set (null removes an optional field)'
                     }
                 }
             }
@@ -272,7 +320,8 @@ def create_document():
 })
 def update_document(public_id):
     """Update an existing document"""
-    document = Document.query.filter_by(public_id=public_id).first()
+    view = fieldset('document')
+    document = Document.query.filter_by(public_id=public_id, tenant_id=current_tenant()).first()
     
     if not document:
         return jsonify({"error": "Document not found"}), 404
@@ -280,12 +329,13 @@ def update_document(public_id):
     try:
         # Validate request data (partial=True to allow partial updates)
         data = document_schema.load(request.json, partial=True)
+        if 'field_values' in data:
+            field_values = validate_field_values(document.template, data['field_values'], partial=True)
     except ValidationError as err:
         return jsonify({"error": "Validation error", "messages": err.messages}), 400
     
-    # Get current user
-    identity = get_jwt_identity()
-    user = User.query.filter_by(public_id=identity['sub']).first()
+    # Get current user from the token claims
+    user_id = current_user_id()
     
     # Track if station changed
     old_station_id = document.current_station_id
@@ -303,6 +353,9 @@ def update_document(public_id):
     if 'current_station_id' in data:
         document.current_station_id = data['current_station_id']
     
+    if 'field_values' in data:
+        document.set_field_values(field_values)
+    
     # Save changes to database
     db.session.commit()
     
@@ -327,14 +380,17 @@ def update_document(public_id):
         document_id=document.id,
         action=action,
         description=description,
-        user_id=user.id if user else None,
-        station_id=document.current_station_id
+        user_id=user_id,
+        station_id=document.current_station_id,
+        tenant_id=document.tenant_id
     )
     
     # Save history to database
     history.save()
     
-    return jsonify(document_schema.dump(document)), 200
+    publish_events(document_events(document, 'updated', previous_station_id=old_station_id))
+    
+    return jsonify(view.schema.dump(document)), 200
 
 
 @bp.route('/documents/<string:public_id>', methods=['DELETE'])
@@ -372,16 +428,20 @@ def update_document(public_id):
 })
 def delete_document(public_id):
     """Delete a document"""
-    document = Document.query.filter_by(public_id=public_id).first()
+    document = Document.query.filter_by(public_id=public_id, tenant_id=current_tenant()).first()
     
     if not document:
         return jsonify({"error": "Document not found"}), 404
     
+    # Station events need the document's fields, which are gone after the delete
+    events = document_events(document, 'deleted')
+    
     # Delete document history first (due to foreign key constraint)
     DocumentHistory.query.filter_by(document_id=document.id).delete()
     
     # Delete document
     document.delete()
+    publish_events(events)
     
     return jsonify({"message": "Document deleted successfully"}), 200
 
@@ -419,12 +479,218 @@ def delete_document(public_id):
 })
 def get_document_history(public_id):
     """Get the history of a document"""
-    document = Document.query.filter_by(public_id=public_id).first()
+    document = Document.query.filter_by(public_id=public_id, tenant_id=current_tenant()).first()
     
     if not document:
         return jsonify({"error": "Document not found"}), 404
     
     # Get document history ordered by creation date
-    history = DocumentHistory.query.filter_by(document_id=document.id).order_by(DocumentHistory.created_at.desc()).all()
+    view = fieldset('history')
+    history = DocumentHistory.query.options(*view.options).filter_by(document_id=document.id) \
+        .order_by(DocumentHistory.created_at.desc()).all()
+    
+    return jsonify(view.many.dump(history)), 200
+
+
+@bp.route('/documents/<string:public_id>/render.pdf', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Render a document as PDF',
+    'description': 'PDF of the document; unchanged documents are served from the render cache',
+    'security': [{'Bearer': []}],
+    'produces': ['application/pdf'],
+    'parameters': [
+        {
+            'name': 'public_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Public ID of the document'
+        },
+        {
+            'name': 'download',
+            'in': 'query',
+            'type': 'boolean',
+            'description': 'Send as an attachment instead of inline'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'The PDF file'
+        },
+        '304': {
+            'description': 'Not modified since the rendering the client already has'
+        },
+        '404': {
+            'description': 'Document not found'
+        },
+        '503': {
+            'description': 'Rendering timed out'
+        },
+        '501': {
+            'description': 'The document has characters the configured PDF fonts cannot print'
+        }
+    }
+})
+def render_document_pdf(public_id):
+    """Render a document as PDF"""
+    document = Document.query.filter_by(public_id=public_id, tenant_id=current_tenant()).first()
+    
+    if not document:
+        return jsonify({"error": "Document not found"}), 404
+    
+    try:
+        path, key = render_document(current_app, document)
+    except RenderTimeout:
+        return jsonify({"error": "Rendering timed out, try again later"}), 503
+    except UnsupportedText as err:
+        return jsonify({"error": str(err)}), 501
+    
+    # A path (not a file object) lets the server hand the file to sendfile
+    response = send_file(path, mimetype='application/pdf', etag=key, conditional=True,
+                         as_attachment=request.args.get('download', '').lower() in ('true', '1'),
+                         download_name=f'{document.name}.pdf')
+    # Same URL, new content after an edit: clients must revalidate (cheap 304 via the ETag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/documents/export', methods=['POST'])
+@jwt_required()
+@idempotent
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Export documents',
+    'description': 'Queue an export of the matching documents as NDJSON; poll the returned job for the file',
+    'security': [{'Bearer': []}],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {
+                        'type': 'string',
+                        'enum': ['draft', 'submitted', 'approved', 'rejected']
+                    },
+                    'template_id': {
+                        'type': 'string',
+                        'description': 'Public ID of the template'
+                    },
+                    'station_id': {
+                        'type': 'string',
+                        'description': 'Public ID of the station'
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        '202': {
+            'description': 'Export job queued',
+            'schema': {
+                'type': 'object'
+            }
+        },
+        '400': {
+            'description': 'Validation error'
+        },
+        '404': {
+            'description': 'Template or station not found'
+        }
+    }
+})
+def export_documents():
+    """Queue a document export job"""
+    try:
+        # Validate request data
+        data = export_schema.load(request.get_json(silent=True) or {})
+    except ValidationError as err:
+        return jsonify({"error": "Validation error", "messages": err.messages}), 400
+    
+    # Resolve public ids now, so the job filters on plain columns
+    params = {'status': data.get('status')}
+    if data.get('template_id'):
+        template = Template.query.filter_by(public_id=data['template_id']).first()
+        if not template:
+            return jsonify({"error": "Template not found"}), 404
+        params['template_id'] = template.id
+    if data.get('station_id'):
+        station = Station.query.filter_by(public_id=data['station_id']).first()
+        if not station:
+            return jsonify({"error": "Station not found"}), 404
+        params['station_id'] = station.id
+    
+    job = enqueue(EXPORT_DOCUMENTS, params, created_by=current_user_id(), tenant_id=current_tenant())
+    
+    return job_response(job, 202)
+
+
+@bp.route('/documents/bulk-transition', methods=['POST'])
+@jwt_required()
+@idempotent
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Move or re-status many documents',
+    'description': 'Queue a job that applies a station and/or status change to many documents',
+    'security': [{'Bearer': []}],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['document_ids'],
+                'properties': {
+                    'document_ids': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'string'
+                        },
+                        'description': 'Public IDs of the documents'
+                    },
+                    'current_station_id': {
+                        'type': 'integer'
+                    },
+                    'status': {
+                        'type': 'string',
+                        'enum': ['draft', 'submitted', 'approved', 'rejected']
+                    }
+                }
+            }
+        }
+    ],
+    'responses': {
+        '202': {
+            'description': 'Bulk transition job queued',
+            'schema': {
+                'type': 'object'
+            }
+        },
+        '400': {
+            'description': 'Validation error'
+        }
+    }
+})
+def bulk_transition_documents():
+    """Queue a bulk transition job"""
+    try:
+        # Validate request data
+        data = bulk_transition_schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Validation error", "messages": err.messages}), 400
+    
+    changes = {key: data[key] for key in ('current_station_id', 'status') if key in data}
+    if not changes:
+        return jsonify({"error": "Validation error",
+                        "messages": {"_schema": ["Give current_station_id and/or status"]}}), 400
+    
+    user_id = current_user_id()
+    job = enqueue(BULK_TRANSITION, {'document_ids': data['document_ids'], 'changes': changes, 'user_id': user_id},
+                  created_by=user_id, tenant_id=current_tenant())
     
-    return jsonify(history_list_schema.dump(history)), 200
+    return job_response(job, 202)
@@ -1,16 +1,18 @@
 from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from app.api.v1 import bp
 from app import db
-from app.api.v1.models.models import Flow, FlowStep, Station, User
+from app.api.v1.models.models import Flow, FlowStep, Station
+from app.security.claims import current_user_id
 from app.api.v1.schemas.schemas import FlowSchema, FlowStepSchema
+from app.api.v1.utils.idempotency import idempotent
+from app.api.v1.utils.fieldsets import fieldset
+from app.api.v1.utils.flow_graph import flow_graph
 from marshmallow import ValidationError
-from flasgger import swag_from
+from app.api.v1.utils.swagger import swag_from
 
 flow_schema = FlowSchema()
-flows_schema = FlowSchema(many=True)
 flow_step_schema = FlowStepSchema()
-flow_steps_schema = FlowStepSchema(many=True)
 
 @bp.route('/flows', methods=['GET'])
 @jwt_required()
@@ -41,16 +43,17 @@ flow_steps_schema = FlowStepSchema(many=True)
 })
 def get_flows():
     """Get all flows"""
+    view = fieldset('flow')
     # Check for active filter
     active = request.args.get('active')
     
     if active is not None:
         is_active = active.lower() in ('true', '1', 't', 'y', 'yes')
-        flows = Flow.query.filter_by(is_active=is_active).order_by(Flow.name).all()
+        flows = Flow.query.options(*view.options).filter_by(is_active=is_active).order_by(Flow.name).all()
     else:
-        flows = Flow.query.order_by(Flow.name).all()
+        flows = Flow.query.options(*view.options).order_by(Flow.name).all()
     
-    return jsonify(flows_schema.dump(flows)), 200
+    return jsonify(view.many.dump(flows)), 200
 
 
 @bp.route('/flows/<string:public_id>', methods=['GET'])
@@ -83,16 +86,18 @@ def get_flows():
 })
 def get_flow(public_id):
     """Get a specific flow"""
-    flow = Flow.query.filter_by(public_id=public_id).first()
+    # Flow, steps and stations in three queries, or none while nothing changed
+    graph = flow_graph(public_id, fieldset('flow'))
     
-    if not flow:
+    if graph is None:
         return jsonify({"error": "Flow not found"}), 404
     
-    return jsonify(flow_schema.dump(flow)), 200
+    return jsonify(graph), 200
 
 
 @bp.route('/flows', methods=['POST'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Flows'],
     'summary': 'Create a flow',
@@ -136,32 +141,33 @@ def get_flow(public_id):
 })
 def create_flow():
     """Create a new flow"""
+    view = fieldset('flow')
     try:
         # Validate request data
         data = flow_schema.load(request.json)
     except ValidationError as err:
         return jsonify({"error": "Validation error", "messages": err.messages}), 400
     
-    # Get current user
-    identity = get_jwt_identity()
-    user = User.query.filter_by(public_id=identity['sub']).first()
+    # Get current user from the token claims
+    user_id = current_user_id()
     
     # Create flow
     flow = Flow(
         name=data['name'],
         description=data.get('description'),
         is_active=data.get('is_active', True),
-        created_by=user.id if user else None
+        created_by=user_id
     )
     
     # Save flow to database
     flow.save()
     
-    return jsonify(flow_schema.dump(flow)), 201
+    return jsonify(view.schema.dump(flow)), 201
 
 
 @bp.route('/flows/<string:public_id>', methods=['PUT'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Flows'],
     'summary': 'Update a flow',
@@ -211,6 +217,7 @@ def create_flow():
 })
 def update_flow(public_id):
     """Update an existing flow"""
+    view = fieldset('flow')
     flow = Flow.query.filter_by(public_id=public_id).first()
     
     if not flow:
@@ -235,7 +242,7 @@ def update_flow(public_id):
     # Save changes to database
     db.session.commit()
     
-    return jsonify(flow_schema.dump(flow)), 200
+    return jsonify(view.schema.dump(flow)), 200
 
 
 @bp.route('/flows/<string:public_id>', methods=['DELETE'])
@@ -278,8 +285,10 @@ def delete_flow(public_id):
     if not flow:
         return jsonify({"error": "Flow not found"}), 404
     
-    # Delete flow steps first (due to foreign key constraint)
-    FlowStep.query.filter_by(flow_id=flow.id).delete()
+    # Delete flow steps first (due to foreign key constraint); through the session so
+    # each deletion reaches the change log
+    for step in FlowStep.query.filter_by(flow_id=flow.id).all():
+        db.session.delete(step)
     
     # Delete flow
     flow.delete()
@@ -320,19 +329,21 @@ def delete_flow(public_id):
 })
 def get_flow_steps(public_id):
     """Get all steps in a flow"""
+    view = fieldset('step')
     flow = Flow.query.filter_by(public_id=public_id).first()
     
     if not flow:
         return jsonify({"error": "Flow not found"}), 404
     
     # Get flow steps ordered by order
-    steps = FlowStep.query.filter_by(flow_id=flow.id).order_by(FlowStep.order).all()
+    steps = FlowStep.query.options(*view.options).filter_by(flow_id=flow.id).order_by(FlowStep.order).all()
     
-    return jsonify(flow_steps_schema.dump(steps)), 200
+    return jsonify(view.many.dump(steps)), 200
 
 
 @bp.route('/flows/<string:public_id>/steps', methods=['POST'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Flows'],
     'summary': 'Add a flow step',
@@ -390,6 +401,7 @@ def get_flow_steps(public_id):
 })
 def add_flow_step(public_id):
     """Add a new step to a flow"""
+    view = fieldset('step')
     flow = Flow.query.filter_by(public_id=public_id).first()
     
     if not flow:
@@ -422,11 +434,12 @@ def add_flow_step(public_id):
     # Save flow step to database
     flow_step.save()
     
-    return jsonify(flow_step_schema.dump(flow_step)), 201
+    return jsonify(view.schema.dump(flow_step)), 201
 
 
 @bp.route('/flows/<string:flow_public_id>/steps/<string:step_public_id>', methods=['PUT'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Flows'],
     'summary': 'Update a flow step',
@@ -486,6 +499,7 @@ def add_flow_step(public_id):
 })
 def update_flow_step(flow_public_id, step_public_id):
     """Update an existing flow step"""
+    view = fieldset('step')
     flow = Flow.query.filter_by(public_id=flow_public_id).first()
     
     if not flow:
@@ -525,7 +539,7 @@ def update_flow_step(flow_public_id, step_public_id):
     # Save changes to database
     db.session.commit()
     
-    return jsonify(flow_step_schema.dump(flow_step)), 200
+    return jsonify(view.schema.dump(flow_step)), 200
 
 
 @bp.route('/flows/<string:flow_public_id>/steps/<string:step_public_id>', methods=['DELETE'])
@@ -0,0 +1,188 @@
+import os
+from flask import request, jsonify, current_app, send_file
+from flask_jwt_extended import jwt_required
+from app.api.v1 import bp
+from app.api.v1.models.models import Job
+from app.security.claims import current_claims, current_user_id
+from app.jobs.queue import SUCCEEDED, cancel, jobs_dir
+from app.api.v1.utils.fieldsets import fieldset
+from app.api.v1.utils.swagger import swag_from
+
+JOB_PARAMETER = {
+    'name': 'public_id',
+    'in': 'path',
+    'type': 'string',
+    'required': True,
+    'description': 'Public ID of the job'
+}
+
+
+def job_response(job, status_code=200):
+    """Job status plus links to poll, fetch the result and cancel"""
+    data = fieldset('job').schema.dump(job)
+    data['links'] = {
+        'self': f'/api/v1/jobs/{job.public_id}',
+        'result': f'/api/v1/jobs/{job.public_id}/result',
+        'cancel': f'/api/v1/jobs/{job.public_id}/cancel'
+    }
+    response = jsonify(data)
+    response.status_code = status_code
+    if status_code == 202:
+        response.headers['Location'] = data['links']['self']
+    return response
+
+
+def find_job(public_id):
+    """The job, if the caller queued it or is an admin"""
+    job = Job.query.filter_by(public_id=public_id).first()
+    if job is None:
+        return None
+    if job.created_by != current_user_id() and current_claims().get('role') != 'admin':
+        return None
+    return job
+
+
+@bp.route('/jobs', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Jobs'],
+    'summary': 'Get my jobs',
+    'description': 'Most recent background jobs queued by the caller',
+    'security': [{'Bearer': []}],
+    'parameters': [
+        {
+            'name': 'status',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['queued', 'running', 'succeeded', 'failed', 'cancelled'],
+            'description': 'Filter jobs by status'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'List of jobs',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object'
+                }
+            }
+        }
+    }
+})
+def get_jobs():
+    """Get the caller's recent jobs"""
+    view = fieldset('job')
+    query = Job.query.filter_by(created_by=current_user_id())
+    
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    
+    jobs = query.order_by(Job.id.desc()).limit(50).all()
+    
+    return jsonify(view.many.dump(jobs)), 200
+
+
+@bp.route('/jobs/<string:public_id>', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Jobs'],
+    'summary': 'Get job status',
+    'description': 'Status, progress and attempts of a background job',
+    'security': [{'Bearer': []}],
+    'parameters': [JOB_PARAMETER],
+    'responses': {
+        '200': {
+            'description': 'Job details',
+            'schema': {
+                'type': 'object'
+            }
+        },
+        '404': {
+            'description': 'Job not found'
+        }
+    }
+})
+def get_job(public_id):
+    """Get a job's status and progress"""
+    job = find_job(public_id)
+    
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    return job_response(job)
+
+
+@bp.route('/jobs/<string:public_id>/result', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Jobs'],
+    'summary': 'Get job result',
+    'description': 'Result of a finished job; exports are returned as the exported file',
+    'security': [{'Bearer': []}],
+    'parameters': [JOB_PARAMETER],
+    'responses': {
+        '200': {
+            'description': 'Job result'
+        },
+        '404': {
+            'description': 'Job not found'
+        },
+        '409': {
+            'description': 'Job has not succeeded (yet)'
+        }
+    }
+})
+def get_job_result(public_id):
+    """Get the result of a succeeded job"""
+    job = find_job(public_id)
+    
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if job.status != SUCCEEDED:
+        return jsonify({"error": "Job has not succeeded", "status": job.status}), 409
+    
+    result = job.get_result()
+    if isinstance(result, dict) and 'file' in result:
+        path = os.path.join(jobs_dir(current_app), result['file'])
+        if not os.path.exists(path):
+            return jsonify({"error": "Job result has been purged"}), 404
+        return send_file(path, mimetype=result.get('mimetype'), as_attachment=True,
+                         download_name=f'{job.kind}-{job.public_id}{os.path.splitext(path)[1]}')
+    
+    return jsonify(result), 200
+
+
+@bp.route('/jobs/<string:public_id>/cancel', methods=['POST'])
+@jwt_required()
+@swag_from({
+    'tags': ['Jobs'],
+    'summary': 'Cancel a job',
+    'description': 'Cancel a queued job, or stop a running job at its next progress report',
+    'security': [{'Bearer': []}],
+    'parameters': [JOB_PARAMETER],
+    'responses': {
+        '202': {
+            'description': 'Cancellation requested or done'
+        },
+        '404': {
+            'description': 'Job not found'
+        },
+        '409': {
+            'description': 'Job already finished'
+        }
+    }
+})
+def cancel_job(public_id):
+    """Cancel a job"""
+    job = find_job(public_id)
+    
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if not cancel(job):
+        return jsonify({"error": "Job already finished", "status": job.status}), 409
+    
+    return job_response(job, 202)
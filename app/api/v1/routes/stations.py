@@ -1,14 +1,17 @@
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.api.v1 import bp
 from app import db
 from app.api.v1.models.models import Station, Document
+from app.database.sharding import count_on_all_shards, current_tenant
 from app.api.v1.schemas.schemas import StationSchema
+from app.api.v1.utils.idempotency import idempotent
+from app.api.v1.utils.station_events import RETRY_MS, event_stream, station_events
+from app.api.v1.utils.fieldsets import fieldset
 from marshmallow import ValidationError
-from flasgger import swag_from
+from app.api.v1.utils.swagger import swag_from
 
 station_schema = StationSchema()
-stations_schema = StationSchema(many=True)
 
 @bp.route('/stations', methods=['GET'])
 @jwt_required()
@@ -39,6 +42,7 @@ stations_schema = StationSchema(many=True)
 })
 def get_stations():
     """Get all stations"""
+    view = fieldset('station')
     # Check for type filter
     station_type = request.args.get('type')
     
@@ -47,7 +51,7 @@ def get_stations():
     else:
         stations = Station.query.order_by(Station.name).all()
     
-    return jsonify(stations_schema.dump(stations)), 200
+    return jsonify(view.many.dump(stations)), 200
 
 
 @bp.route('/stations/<string:public_id>', methods=['GET'])
@@ -80,16 +84,18 @@ def get_stations():
 })
 def get_station(public_id):
     """Get a specific station"""
+    view = fieldset('station')
     station = Station.query.filter_by(public_id=public_id).first()
     
     if not station:
         return jsonify({"error": "Station not found"}), 404
     
-    return jsonify(station_schema.dump(station)), 200
+    return jsonify(view.schema.dump(station)), 200
 
 
 @bp.route('/stations', methods=['POST'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Stations'],
     'summary': 'Create a station',
@@ -137,6 +143,7 @@ def get_station(public_id):
 })
 def create_station():
     """Create a new station"""
+    view = fieldset('station')
     try:
         # Validate request data
         data = station_schema.load(request.json)
@@ -154,11 +161,12 @@ def create_station():
     # Save station to database
     station.save()
     
-    return jsonify(station_schema.dump(station)), 201
+    return jsonify(view.schema.dump(station)), 201
 
 
 @bp.route('/stations/<string:public_id>', methods=['PUT'])
 @jwt_required()
+@idempotent
 @swag_from({
     'tags': ['Stations'],
     'summary': 'Update a station',
@@ -211,6 +219,7 @@ def create_station():
 })
 def update_station(public_id):
     """Update an existing station"""
+    view = fieldset('station')
     station = Station.query.filter_by(public_id=public_id).first()
     
     if not station:
@@ -238,7 +247,7 @@ def update_station(public_id):
     # Save changes to database
     db.session.commit()
     
-    return jsonify(station_schema.dump(station)), 200
+    return jsonify(view.schema.dump(station)), 200
 
 
 @bp.route('/stations/<string:public_id>', methods=['DELETE'])
@@ -284,8 +293,10 @@ def delete_station(public_id):
     if not station:
         return jsonify({"error": "Station not found"}), 404
     
-    # Check if any documents are currently at this station
-    documents_at_station = Document.query.filter_by(current_station_id=station.id).count()
+    # Check if any documents of any tenant are currently at this station
+    documents_at_station = count_on_all_shards(
+        Document.__table__, Document.__table__.c.current_station_id == station.id
+    )
     if documents_at_station > 0:
         return jsonify({"error": "Cannot delete station with active documents"}), 400
     
@@ -335,15 +346,14 @@ def delete_station(public_id):
 })
 def get_station_documents(public_id):
     """Get all documents at a station"""
-    from app.api.v1.schemas.schemas import DocumentSchema
-    
+    view = fieldset('document')
     station = Station.query.filter_by(public_id=public_id).first()
     
     if not station:
         return jsonify({"error": "Station not found"}), 404
     
     # Build query for documents at this station
-    query = Document.query.filter_by(current_station_id=station.id)
+    query = Document.query.filter_by(current_station_id=station.id, tenant_id=current_tenant())
     
     # Apply status filter if provided
     status = request.args.get('status')
@@ -351,9 +361,70 @@ def get_station_documents(public_id):
         query = query.filter_by(status=status)
     
     # Get documents ordered by last update
-    documents = query.order_by(Document.updated_at.desc()).all()
+    documents = query.options(*view.options).order_by(Document.updated_at.desc()).all()
     
-    # Use DocumentSchema to serialize
-    documents_schema = DocumentSchema(many=True)
+    return jsonify(view.many.dump(documents)), 200
+
+
+@bp.route('/stations/<string:public_id>/events', methods=['GET'])
+@jwt_required()
+@swag_from({
+    'tags': ['Stations'],
+    'summary': 'Stream station events',
+    'description': 'Server-sent events for documents arriving at, leaving, or changing at a station. '
+                   'Send Last-Event-ID to resume; a reset event means the document list should be reloaded.',
+    'security': [{'Bearer': []}],
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {
+            'name': 'public_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Public ID of the station'
+        },
+        {
+            'name': 'Last-Event-ID',
+            'in': 'header',
+            'type': 'string',
+            'description': 'Id of the last event received'
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Stream of arrive, leave, update and reset events'
+        },
+        '404': {
+            'description': 'Station not found'
+        },
+        '503': {
+            'description': 'This worker already serves STATION_EVENTS_MAX_STREAMS streams; retry later'
+        }
+    }
+})
+def get_station_events(public_id):
+    """Stream document events for a station"""
+    station = Station.query.filter_by(public_id=public_id).first()
+    
+    if not station:
+        return jsonify({"error": "Station not found"}), 404
     
-    return jsonify(documents_schema.dump(documents)), 200
+    # Each stream holds a thread; leave the rest of this worker's threads to the API
+    if not station_events.open_stream():
+        return jsonify({"error": "Too many open event streams, please retry"}), 503, \
+            {'Retry-After': str(RETRY_MS // 1000)}
+    
+    # The stream outlives the request context, so read everything it needs now
+    config = current_app.config
+    stream = event_stream(
+        station.id,
+        current_tenant(),
+        last_event_id=request.headers.get('Last-Event-ID'),
+        heartbeat=config.get('STATION_EVENTS_HEARTBEAT_SECONDS', 15),
+        max_seconds=config.get('STATION_EVENTS_MAX_SECONDS', 300)
+    )
+    response = current_app.response_class(stream, mimetype='text/event-stream')
+    response.call_on_close(station_events.close_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
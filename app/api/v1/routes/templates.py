@@ -1,10 +1,13 @@
-from flask import request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import request
+from flask_jwt_extended import jwt_required
 from flask_restx import Namespace, Resource, fields
-from app import api
+from app import restx_api
 from app import db
-from app.api.v1.models.models import Template, User
+from app.api.v1.models.models import Template
+from app.security.claims import current_user_id
 from app.api.v1.schemas.schemas import TemplateSchema
+from app.api.v1.utils.idempotency import idempotent
+from app.api.v1.utils.fieldsets import InvalidFieldset, fieldset
 from marshmallow import ValidationError
 
 templates_ns = Namespace('templates', description='Template operations')
@@ -31,20 +34,25 @@ template_response = templates_ns.model('TemplateResponse', {
 })
 
 template_schema = TemplateSchema()
-templates_schema = TemplateSchema(many=True)
 
 # Register namespace with API
-api.add_namespace(templates_ns, path='/api/v1/templates')
+restx_api.add_namespace(templates_ns, path='/api/v1/templates')
 
-@templates_ns.route('/')
+# Flask-RESTX answers exceptions from its resources itself, before the app's error handlers
+@templates_ns.errorhandler(InvalidFieldset)
+def invalid_fieldset(err):
+    return {"error": str(err)}, 400
+
+@templates_ns.route('', '/')
 class TemplateList(Resource):
     @templates_ns.doc('list_templates',
                      params={'status': 'Filter templates by status (draft, active, archived)'},
                      security='Bearer')
-    @templates_ns.marshal_list_with(template_response)
+    @templates_ns.response(200, 'Success', [template_response])
     @jwt_required()
     def get(self):
         """Get all templates"""
+        view = fieldset('template')
         # Check for status filter
         status = request.args.get('status')
         
@@ -53,24 +61,25 @@ class TemplateList(Resource):
         else:
             templates = Template.query.order_by(Template.updated_at.desc()).all()
         
-        return templates_schema.dump(templates)
+        return view.many.dump(templates)
     
     @templates_ns.doc('create_template', security='Bearer')
     @templates_ns.expect(template_model)
     @templates_ns.response(201, 'Template created', template_response)
     @templates_ns.response(400, 'Validation error')
     @jwt_required()
+    @idempotent
     def post(self):
         """Create a new template"""
+        view = fieldset('template')
         try:
             # Validate request data
             data = template_schema.load(request.json)
         except ValidationError as err:
             return {"error": "Validation error", "messages": err.messages}, 400
         
-        # Get current user
-        identity = get_jwt_identity()
-        user = User.query.filter_by(public_id=identity['sub']).first()
+        # Get current user from the token claims
+        user_id = current_user_id()
         
         # Create template
         template = Template(
@@ -78,7 +87,7 @@ class TemplateList(Resource):
             description=data.get('description'),
             content=data['content'],
             status=data.get('status', 'draft'),
-            created_by=user.id if user else None
+            created_by=user_id
         )
         
         # Set editable fields if provided
@@ -89,7 +98,7 @@ class TemplateList(Resource):
         # Save template to database
         template.save()
         
-        return template_schema.dump(template), 201
+        return view.schema.dump(template), 201
 
 
 @templates_ns.route('/<string:public_id>')
@@ -101,12 +110,13 @@ class TemplateResource(Resource):
     @jwt_required()
     def get(self, public_id):
         """Get a specific template"""
+        view = fieldset('template')
         template = Template.query.filter_by(public_id=public_id).first()
         
         if not template:
             return {"error": "Template not found"}, 404
         
-        return template_schema.dump(template)
+        return view.schema.dump(template)
     
     @templates_ns.doc('update_template', security='Bearer')
     @templates_ns.expect(template_model)
@@ -114,8 +124,10 @@ class TemplateResource(Resource):
     @templates_ns.response(400, 'Validation error')
     @templates_ns.response(404, 'Template not found')
     @jwt_required()
+    @idempotent
     def put(self, public_id):
         """Update an existing template"""
+        view = fieldset('template')
         template = Template.query.filter_by(public_id=public_id).first()
         
         if not template:
@@ -146,7 +158,7 @@ class TemplateResource(Resource):
         # Save changes to database
         db.session.commit()
         
-        return template_schema.dump(template)
+        return view.schema.dump(template)
     
     @templates_ns.doc('delete_template', security='Bearer')
     @templates_ns.response(200, 'Template deleted')
@@ -1,5 +1,6 @@
 from marshmallow import Schema, fields, validate, validates, ValidationError
 import json
+from app.api.v1.utils.template_fields import TemplateFields
 
 class UserSchema(Schema):
     """Schema for User model"""
@@ -20,6 +21,22 @@ class LoginSchema(Schema):
     password = fields.Str(required=True)
 
 
+class EditableFields(fields.Raw):
+    """Editable field definitions, accepted as JSON text or as an object and parsed only once"""
+    
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                raise ValidationError("Editable fields must be valid JSON")
+        try:
+            TemplateFields(value, strict=True)
+        except ValueError as err:
+            raise ValidationError(str(err))
+        return value
+
+
 class TemplateSchema(Schema):
     """Schema for Template model"""
     id = fields.Int(dump_only=True)
@@ -27,21 +44,11 @@ class TemplateSchema(Schema):
     name = fields.Str(required=True, validate=validate.Length(min=3, max=100))
     description = fields.Str()
     content = fields.Str(required=True)
-    editable_fields = fields.Raw()
+    editable_fields = EditableFields()
     status = fields.Str(validate=validate.OneOf(['draft', 'active', 'archived']), default='draft')
     created_by = fields.Int(dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
-    
-    @validates('editable_fields')
-    def validate_editable_fields(self, value):
-        """Validate that editable_fields is valid JSON"""
-        if value:
-            try:
-                if isinstance(value, str):
-                    json.loads(value)
-            except json.JSONDecodeError:
-                raise ValidationError("Editable fields must be valid JSON")
 
 
 class DocumentSchema(Schema):
@@ -53,6 +60,8 @@ class DocumentSchema(Schema):
     template_id = fields.Int(required=True)
     status = fields.Str(validate=validate.OneOf(['draft', 'submitted', 'approved', 'rejected']), default='draft')
     current_station_id = fields.Int(allow_none=True)
+    # Values of the template's editable fields; typed and checked against the template in the route
+    field_values = fields.Method('get_field_values', deserialize='load_field_values', data_key='fields')
     created_by = fields.Int(dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
@@ -60,6 +69,14 @@ class DocumentSchema(Schema):
     # Include related data when needed
     template = fields.Nested('TemplateSchema', exclude=('content', 'editable_fields'), dump_only=True)
     current_station = fields.Nested('StationSchema', exclude=('description',), dump_only=True)
+    
+    def get_field_values(self, document):
+        return document.get_field_values()
+    
+    def load_field_values(self, value):
+        if not isinstance(value, dict):
+            raise ValidationError("Fields must be an object of field names to values")
+        return value
 
 
 class StationSchema(Schema):
@@ -121,3 +138,40 @@ class DocumentHistorySchema(Schema):
     # Include related data when needed
     user = fields.Nested('UserSchema', only=('id', 'username', 'email'), dump_only=True)
     station = fields.Nested('StationSchema', only=('id', 'name', 'type'), dump_only=True)
+
+
+class JobSchema(Schema):
+    """Schema for Job model"""
+    public_id = fields.Str(dump_only=True)
+    kind = fields.Str(dump_only=True)
+    status = fields.Str(dump_only=True)
+    progress = fields.Float(dump_only=True)
+    progress_message = fields.Str(dump_only=True)
+    attempts = fields.Int(dump_only=True)
+    max_attempts = fields.Int(dump_only=True)
+    error = fields.Str(dump_only=True)
+    run_after = fields.DateTime(dump_only=True)
+    started_at = fields.DateTime(dump_only=True)
+    finished_at = fields.DateTime(dump_only=True)
+    created_at = fields.DateTime(dump_only=True)
+    updated_at = fields.DateTime(dump_only=True)
+
+
+class DocumentExportSchema(Schema):
+    """Filters for a document export job"""
+    status = fields.Str(validate=validate.OneOf(['draft', 'submitted', 'approved', 'rejected']))
+    template_id = fields.Str()  # public id
+    station_id = fields.Str()  # public id
+
+
+class BulkTransitionSchema(Schema):
+    """Documents to move and/or re-status in one background job"""
+    document_ids = fields.List(fields.Str(), required=True, validate=validate.Length(min=1, max=10000))
+    current_station_id = fields.Int(allow_none=True)
+    status = fields.Str(validate=validate.OneOf(['draft', 'submitted', 'approved', 'rejected']))
+    
+    @validates('document_ids')
+    def validate_document_ids(self, value):
+        """Reject duplicate ids"""
+        if len(set(value)) != len(value):
+            raise ValidationError("Document ids must be unique")
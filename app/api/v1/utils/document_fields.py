@@ -0,0 +1,109 @@
+"""Typed editable-field values of documents.
+
+A template's ``editable_fields`` defines the fields its documents fill in,
+either as a list of ``{"name", "type", "required", "options"}`` or as
+``{"fields": [...]}``. Documents send their values as ``fields`` and they
+are checked against those definitions and stored one row per field in
+``document_fields``, in a column matching the type, so that they can be
+indexed:
+
+=========== ================ =========================================
+type        column           accepted values
+=========== ================ =========================================
+``number``  ``number_value`` JSON numbers
+``date``    ``date_value``   ``YYYY-MM-DD`` strings
+``boolean`` ``number_value`` ``true``/``false`` (stored as 1/0)
+``select``  ``text_value``   one of ``options`` (any string without)
+other       ``text_value``   strings
+=========== ================ =========================================
+
+``GET /documents?field.amount__gt=10000`` filters on them through the
+``(name, <column>)`` indexes. The definitions are compiled and cached by
+``template_fields``.
+"""
+import re
+from datetime import date
+
+from sqlalchemy import and_, or_, select
+
+from app.api.v1.models.models import Document, DocumentField
+from app.api.v1.utils.template_fields import template_fields
+
+FILTER_PREFIX = 'field.'
+FILTER_OPERATORS = ('eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'in')
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,99}$')
+
+
+class InvalidFieldFilter(ValueError):
+    """A ``field.`` query parameter that cannot be applied"""
+
+
+def validate_field_values(template, values, partial=False):
+    """Typed ``{name: (value_type, value)}`` for ``values``, or ValidationError keyed by field"""
+    return template_fields(template).validate(values, partial)
+
+
+def _literal_conditions(raw):
+    """Per-column ``(column, value)`` pairs the query string ``raw`` can be compared as
+    
+    Only the column of a row's own type is set, so comparing a literal with
+    every column it parses as matches each field by its stored type.
+    """
+    pairs = [(DocumentField.text_value, raw)]
+    try:
+        pairs.append((DocumentField.number_value, float(raw)))
+    except ValueError:
+        pass
+    if raw in ('true', 'false'):
+        pairs.append((DocumentField.number_value, 1.0 if raw == 'true' else 0.0))
+    try:
+        pairs.append((DocumentField.date_value, date.fromisoformat(raw)))
+    except ValueError:
+        pass
+    return pairs
+
+
+def _compare(column, operator, value):
+    if operator == 'eq':
+        return column == value
+    if operator == 'ne':
+        return column != value
+    if operator == 'gt':
+        return column > value
+    if operator == 'gte':
+        return column >= value
+    if operator == 'lt':
+        return column < value
+    return column <= value
+
+
+def field_filter(name, operator, raw):
+    """``Document.id IN (...)`` for one ``field.<name>__<operator>=<raw>`` parameter"""
+    if operator == 'in':
+        condition = or_(*[
+            _compare(column, 'eq', value)
+            for literal in raw.split(',') for column, value in _literal_conditions(literal)
+        ])
+    else:
+        condition = or_(*[_compare(column, operator, value) for column, value in _literal_conditions(raw)])
+    return Document.id.in_(
+        select(DocumentField.document_id).where(and_(DocumentField.name == name, condition))
+    )
+
+
+def field_filters(args):
+    """Filters for the ``field.`` parameters in ``args``; raises InvalidFieldFilter"""
+    filters = []
+    for key, raw in args.items(multi=True):
+        if not key.startswith(FILTER_PREFIX):
+            continue
+        # The last ``__`` starts the operator; field.<name>=<value> means equals
+        name, _, operator = key[len(FILTER_PREFIX):].rpartition('__')
+        if not name:
+            name, operator = operator, 'eq'
+        if operator not in FILTER_OPERATORS:
+            raise InvalidFieldFilter(f'Unknown operator {operator!r} in {key}')
+        if not FIELD_NAME.match(name):
+            raise InvalidFieldFilter(f'Invalid field name in {key}')
+        filters.append(field_filter(name, operator, raw))
+    return filters
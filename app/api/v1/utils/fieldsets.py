@@ -0,0 +1,202 @@
+"""Sparse fieldsets and relationship expansion for API responses.
+
+Every endpoint that returns documents, templates, stations, flows, flow
+steps, history entries or jobs accepts two JSON:API-style parameters:
+
+``fields[<type>]=a,b``
+    Return only these fields for every object of ``<type>`` in the
+    response, at the top level or nested. Relationships count as fields:
+    with ``fields[document]=name,status`` the template is left out.
+
+``expand=template,steps.from_station``
+    The relationships to embed, as dotted paths from the top-level object.
+    Without ``expand`` the relationships embedded so far are embedded
+    (``DEFAULT_EXPAND``). ``expand=`` with no value embeds none.
+
+``fieldset(resource)`` turns the parameters into a ``Fieldset``. It holds
+trimmed schemas (``only=``/``exclude=`` with dotted paths) and matching
+loader options. Relationships that are embedded are loaded with one
+``selectinload`` query each. Those that are not are never loaded. Building
+a schema costs far more than dumping a few rows with it, so fieldsets are
+cached per parameter set.
+"""
+import threading
+from collections import OrderedDict
+
+from flask import jsonify, request
+from sqlalchemy.orm import lazyload, selectinload
+
+from app.api.v1.models.models import Document, DocumentHistory, Flow, FlowStep, Job, Station, Template, User
+from app.api.v1.schemas.schemas import (DocumentHistorySchema, DocumentSchema, FlowSchema, FlowStepSchema,
+                                        JobSchema, StationSchema, TemplateSchema, UserSchema)
+from app.observability.metrics import record_cache_lookup
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class InvalidFieldset(ValueError):
+    """A ``fields[...]`` or ``expand`` parameter naming something that does not exist"""
+
+
+class Resource:
+    """A response object type: its schema, model and relationships"""
+    
+    def __init__(self, schema, model, relations=None, loaded_by=None):
+        self.schema = schema
+        self.model = model
+        # Relationship attribute -> resource type it holds
+        self.relations = relations or {}
+        # Schema field -> relationship it reads, loaded only when the field is returned
+        self.loaded_by = loaded_by or {}
+        self.names = {}
+        for name, field in schema._declared_fields.items():
+            if not field.load_only:
+                self.names[field.data_key or name] = name
+        self.attributes = tuple(name for name in self.names.values() if name not in self.relations)
+
+
+RESOURCES = {
+    'document': Resource(DocumentSchema, Document, {'template': 'template', 'current_station': 'station'},
+                         loaded_by={'field_values': 'fields'}),
+    'template': Resource(TemplateSchema, Template),
+    'station': Resource(StationSchema, Station),
+    'flow': Resource(FlowSchema, Flow, {'steps': 'step'}),
+    'step': Resource(FlowStepSchema, FlowStep, {'from_station': 'station', 'to_station': 'station'}),
+    'history': Resource(DocumentHistorySchema, DocumentHistory, {'user': 'user', 'station': 'station'}),
+    'job': Resource(JobSchema, Job),
+    'user': Resource(UserSchema, User),
+}
+
+# Relationships embedded when no ``expand`` is given (what the schemas always nested)
+DEFAULT_EXPAND = {
+    'document': ('template', 'current_station'),
+    'flow': ('steps', 'steps.from_station', 'steps.to_station'),
+    'step': ('from_station', 'to_station'),
+    'history': ('user', 'station'),
+}
+
+
+def _split(raw):
+    return tuple(sorted({name.strip() for name in raw.split(',') if name.strip()}))
+
+
+def fieldset_key(resource, fields, expand):
+    """Hashable identity of a parameter set"""
+    return resource, tuple(sorted(fields.items())), expand
+
+
+class Fieldset:
+    """Trimmed schemas and loader options for one resource and parameter set"""
+    
+    def __init__(self, resource, fields=None, expand=None):
+        self.resource = resource
+        self.key = fieldset_key(resource, fields or {}, expand)
+        self.fields = {}
+        for kind, names in (fields or {}).items():
+            if kind not in RESOURCES:
+                raise InvalidFieldset(f'Unknown type in fields[{kind}]')
+            unknown = [name for name in names if name not in RESOURCES[kind].names]
+            if unknown:
+                raise InvalidFieldset(f'Unknown fields for {kind}: {", ".join(unknown)}')
+            self.fields[kind] = {RESOURCES[kind].names[name] for name in names}
+        self.expand = set()
+        for path in DEFAULT_EXPAND.get(resource, ()) if expand is None else expand:
+            kind = resource
+            for relation in path.split('.'):
+                kind = RESOURCES[kind].relations.get(relation)
+                if kind is None:
+                    raise InvalidFieldset(f'Cannot expand {path} on {resource}')
+            # Expanding steps.from_station also expands steps
+            while path:
+                self.expand.add(path)
+                path = path.rpartition('.')[0]
+        
+        self.exclude, self.options, self.embedded = [], [], set()
+        only = self._walk(resource, '', None)
+        self.schema = RESOURCES[resource].schema(only=only, exclude=self.exclude)
+        self.many = RESOURCES[resource].schema(many=True, only=only, exclude=self.exclude)
+    
+    def _walk(self, kind, prefix, loader):
+        """Collect excludes and loader options below ``prefix``; returns its ``only`` entries or None"""
+        spec = RESOURCES[kind]
+        wanted = self.fields.get(kind)
+        own = [name for name in spec.attributes if wanted is None or name in wanted]
+        nested, restricted = [], wanted is not None
+        for field, relation in spec.loaded_by.items():
+            if field not in own:
+                attribute = getattr(spec.model, relation)
+                self.options.append(lazyload(attribute) if loader is None else loader.lazyload(attribute))
+        for relation, target in spec.relations.items():
+            path = prefix + relation
+            if path not in self.expand or (wanted is not None and relation not in wanted):
+                self.exclude.append(path)
+                continue
+            self.embedded.add(path)
+            attribute = getattr(spec.model, relation)
+            child_loader = selectinload(attribute) if loader is None else loader.selectinload(attribute)
+            self.options.append(child_loader)
+            own.append(relation)
+            child = self._walk(target, path + '.', child_loader)
+            if child is not None:
+                restricted = True
+                nested.extend(f'{relation}.{name}' for name in child)
+        return own + nested if restricted else None
+
+
+def parse_fieldset_args(args):
+    """``({type: names}, expand paths or None)`` from request arguments"""
+    fields = {}
+    for key, raw in args.items():
+        if key.startswith('fields[') and key.endswith(']'):
+            fields[key[len('fields['):-1]] = _split(raw)
+    expand = _split(args['expand']) if 'expand' in args else None
+    return fields, expand
+
+
+class FieldsetCache:
+    """Bounded LRU of ``Fieldset`` objects keyed by resource and parameters"""
+    
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def get(self, resource, fields, expand):
+        key = fieldset_key(resource, fields, expand)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache_lookup('fieldsets', hit=entry is not None)
+        if entry is not None:
+            return entry
+        
+        # Raises InvalidFieldset before anything is cached
+        entry = Fieldset(resource, fields, expand)
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fieldset_cache = FieldsetCache()
+
+
+def fieldset(resource, args=None):
+    """The ``Fieldset`` for ``resource`` asked for by ``args`` (the request's by default)"""
+    fields, expand = parse_fieldset_args(request.args if args is None else args)
+    return fieldset_cache.get(resource, fields, expand)
+
+
+def init_fieldsets(app):
+    """Answer unknown fields and relationships with 400"""
+    
+    @app.errorhandler(InvalidFieldset)
+    def invalid_fieldset(err):
+        return jsonify({"error": str(err)}), 400
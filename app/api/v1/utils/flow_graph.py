@@ -0,0 +1,162 @@
+"""Flow detail graphs loaded in three queries and memoized.
+
+``GET /flows/<id>`` returns the flow with its steps, and each step with its
+from and to stations. Loading these through the relationships took one
+query for the steps and two per step for the stations. ``load_flow_graph``
+instead loads the flow, its steps and the distinct stations they use with
+one query each. It attaches them with ``set_committed_value``, so dumping
+the graph runs no further queries.
+
+``flow_graph`` keeps the dumped graph per flow and fieldset in
+``flow_graph_cache``. A commit that touches a flow, step or station clears
+this worker's copy at once. Other workers learn about such changes from
+the change log, which each worker reads at most every
+``FLOW_GRAPH_REFRESH_SECONDS``.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.database.routing import RoutingSession
+from app.observability.metrics import record_cache_lookup
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_REFRESH_SECONDS = 5
+GRAPH_TABLES = ('flows', 'flow_steps', 'stations')
+GRAPH_ENTITIES = ('flow', 'flow_step', 'station')
+STEP_ENDS = ('from_station', 'to_station')
+
+
+def load_flow_graph(public_id, view):
+    """The flow with the steps and stations ``view`` embeds attached, or None"""
+    from app.api.v1.models.models import Flow, FlowStep, Station
+    
+    flow = Flow.query.filter_by(public_id=public_id).first()
+    if flow is None or 'steps' not in view.embedded:
+        return flow
+    
+    steps = FlowStep.query.filter_by(flow_id=flow.id).order_by(FlowStep.order, FlowStep.id).all()
+    set_committed_value(flow, 'steps', steps)
+    ends = [end for end in STEP_ENDS if f'steps.{end}' in view.embedded]
+    station_ids = {getattr(step, f'{end}_id') for step in steps for end in ends}
+    if station_ids:
+        stations = {station.id: station for station in Station.query.filter(Station.id.in_(station_ids))}
+        for step in steps:
+            for end in ends:
+                set_committed_value(step, end, stations.get(getattr(step, f'{end}_id')))
+    return flow
+
+
+class FlowGraphCache:
+    """Bounded LRU of dumped flow graphs, cleared whenever a flow, step or station changes"""
+    
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped on every clear; graphs loaded under an older generation are not stored
+        self.generation = 0
+        self._checked_seq = None
+        self._checked_at = 0.0
+    
+    def _clear(self):
+        self.generation += 1
+        self._entries.clear()
+    
+    def _sync(self):
+        """Clear if the change log has flow, step or station changes this worker has not seen"""
+        from app.api.v1.models.models import ChangeLog
+        table = ChangeLog.__table__
+        
+        query = select(func.max(table.c.seq), func.count(case((table.c.entity.in_(GRAPH_ENTITIES), 1))))
+        if self._checked_seq is not None:
+            # Seqs follow commit order, so nothing can still appear below the last one seen
+            query = query.where(table.c.seq > self._checked_seq)
+        with db.get_engine(current_app).connect() as conn:
+            last_seq, changes = conn.execute(query).one()
+        if changes and self._checked_seq is not None:
+            self._clear()
+        if last_seq is not None:
+            self._checked_seq = last_seq
+        elif self._checked_seq is None:
+            self._checked_seq = 0
+    
+    def get(self, key):
+        """``(graph or None, generation)``; pass the generation back to ``put``"""
+        refresh = current_app.config.get('FLOW_GRAPH_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            if time.monotonic() - self._checked_at >= refresh:
+                self._sync()
+                self._checked_at = time.monotonic()
+            graph = self._entries.get(key)
+            if graph is not None:
+                self._entries.move_to_end(key)
+            generation = self.generation
+        record_cache_lookup('flow_graph', hit=graph is not None)
+        return graph, generation
+    
+    def put(self, key, graph, generation):
+        with self._lock:
+            # A change committed while the graph was loaded makes it stale already
+            if generation != self.generation or self.maxsize <= 0:
+                return
+            self._entries[key] = graph
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+    
+    def clear(self):
+        """Forget all cached state"""
+        with self._lock:
+            self._clear()
+            self._checked_seq = None
+            self._checked_at = 0.0
+
+
+flow_graph_cache = FlowGraphCache()
+
+
+def flow_graph(public_id, view):
+    """The flow dumped with ``view``, from the cache when unchanged; None if there is no such flow"""
+    key = (public_id, view.key)
+    graph, generation = flow_graph_cache.get(key)
+    if graph is not None:
+        return graph
+    
+    flow = load_flow_graph(public_id, view)
+    if flow is None:
+        return None
+    graph = view.schema.dump(flow)
+    flow_graph_cache.put(key, graph, generation)
+    return graph
+
+
+def note_graph_changes(session, flush_context):
+    """Remember that this transaction wrote a flow, step or station"""
+    for instances in (session.new, session.dirty, session.deleted):
+        if any(getattr(obj, '__tablename__', None) in GRAPH_TABLES for obj in instances):
+            session.info['flow_graph_changed'] = True
+            return
+
+
+def clear_after_commit(session):
+    if session.info.pop('flow_graph_changed', False):
+        flow_graph_cache.invalidate()
+
+
+def forget_after_rollback(session):
+    session.info.pop('flow_graph_changed', None)
+
+
+event.listen(RoutingSession, 'after_flush', note_graph_changes)
+event.listen(RoutingSession, 'after_commit', clear_after_commit)
+event.listen(RoutingSession, 'after_rollback', forget_after_rollback)
@@ -0,0 +1,134 @@
+"""``Idempotency-Key`` support for write endpoints.
+
+A client that times out and retries a POST/PUT with the same
+``Idempotency-Key`` header gets the stored response of the first attempt
+instead of running the handler again. Keys are scoped to the caller, method
+and path, stored hashed in ``idempotency_keys`` for
+``IDEMPOTENCY_KEY_TTL_SECONDS``, and bound to a hash of the request body so a
+key reused for a different request is rejected. Replays repeat the
+status, body and the headers in ``REPLAYED_HEADERS`` (such as the
+``Location`` of a created job).
+
+The key is claimed before the handler runs. Retries during the first
+request get 409 with ``Retry-After``; a claim still unfinished after
+``IDEMPOTENCY_CLAIM_SECONDS`` is taken to belong to a worker that died
+(timeout, OOM kill, restart) and the retry claims the key and runs the
+handler itself.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.api.v1.models.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_CLAIM_SECONDS = 120
+MAX_KEY_LENGTH = 255
+# Headers that belong to the outcome of the request rather than to one transmission of it
+REPLAYED_HEADERS = ('Location', 'Content-Location', 'ETag', 'Last-Modified', 'Retry-After')
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _scope_key(key):
+    """Hash the client key together with who sent it and where"""
+    identity = get_jwt_identity() or {}
+    return _digest(str(identity.get('sub', '')), request.method, request.path, key)
+
+
+def _replay(record):
+    response = current_app.response_class(record.response_body, status=record.status_code,
+                                          mimetype=record.mimetype)
+    for name, value in json.loads(record.response_headers or '{}').items():
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _in_progress(retry_after):
+    response = jsonify({"error": "A request with this key is still in progress"})
+    return response, 409, {'Retry-After': str(max(1, int(retry_after)))}
+
+
+def idempotent(fn):
+    """Replay the stored response when a request repeats its Idempotency-Key"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return fn(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+        
+        scope_key = _scope_key(key)
+        request_hash = _digest(request.get_data(as_text=True))
+        now = datetime.utcnow()
+        claim_seconds = current_app.config.get('IDEMPOTENCY_CLAIM_SECONDS', DEFAULT_CLAIM_SECONDS)
+        
+        record = IdempotencyKey.query.get(scope_key)
+        if record is not None and record.expires_at <= now:
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+        
+        if record is not None:
+            if record.request_hash != request_hash:
+                return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+            if record.status_code is not None:
+                return _replay(record)
+            if record.claimed_at is not None and record.claimed_at > now - timedelta(seconds=claim_seconds):
+                return _in_progress((record.claimed_at - now).total_seconds() + claim_seconds)
+            # The first request never finished; only drop the claim if no other retry has renewed it
+            IdempotencyKey.query.filter(
+                IdempotencyKey.key == scope_key,
+                IdempotencyKey.status_code.is_(None),
+                db.or_(IdempotencyKey.claimed_at.is_(None),
+                       IdempotencyKey.claimed_at <= now - timedelta(seconds=claim_seconds))
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        
+        # Claim the key before running the handler so concurrent retries see it
+        ttl = current_app.config.get('IDEMPOTENCY_KEY_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+        IdempotencyKey.query.filter(IdempotencyKey.expires_at <= now).delete()
+        db.session.add(IdempotencyKey(key=scope_key, request_hash=request_hash, claimed_at=now,
+                                      expires_at=now + timedelta(seconds=ttl)))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return _in_progress(claim_seconds)
+        
+        try:
+            response = current_app.make_response(fn(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            IdempotencyKey.query.filter_by(key=scope_key, claimed_at=now).delete()
+            db.session.commit()
+            raise
+        
+        record = IdempotencyKey.query.get(scope_key)
+        if record is None or record.claimed_at != now:
+            # Our claim outlived IDEMPOTENCY_CLAIM_SECONDS and a retry took the key over
+            return response
+        if response.status_code >= 500:
+            # Server errors are worth retrying for real
+            db.session.delete(record)
+        else:
+            record.status_code = response.status_code
+            record.mimetype = response.mimetype
+            record.response_body = response.get_data(as_text=True)
+            record.response_headers = json.dumps({
+                name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers
+            })
+        db.session.commit()
+        return response
+    return wrapper
@@ -0,0 +1,313 @@
+"""Document events for station inboxes.
+
+The document write paths publish an event whenever a document arrives at,
+leaves, or changes at a station. ``GET /api/v1/stations/<id>/events`` streams
+them to station UIs as server-sent events, so the UIs no longer poll
+``GET /stations/<id>/documents``.
+
+Events go into a per-process ring buffer of the last
+``STATION_EVENTS_BUFFER`` events, and waiting streams are woken up when one
+arrives. With a single worker that is all that is needed. With several
+workers, set ``STATION_EVENTS_FILE``: publishers append events to that file
+as JSON lines, and one thread per worker tails it into the buffer, so every
+worker sees every event. The file is rotated to ``<file>.1`` once it grows
+past ``STATION_EVENTS_MAX_BYTES``. An event's id is its sequence number in
+the buffer, or ``<generation>:<offset>`` with the file: the first line of
+each new file names a random generation, and the offset is the event's byte
+offset in that file. Ids therefore match across workers and never repeat
+after a rotation.
+
+A reconnecting ``EventSource`` sends ``Last-Event-ID`` and gets the events it
+missed. If those are no longer in the buffer it gets a ``reset`` event
+instead, and should reload the station's document list.
+
+Open streams hold no database connection. Each stream still takes a worker
+thread, so run gunicorn with the ``gthread`` (or ``gevent``) worker class.
+A worker serves at most ``STATION_EVENTS_MAX_STREAMS`` streams at once and
+answers further ones with 503, so streams cannot take every thread away
+from the rest of the API; keep it below ``GUNICORN_THREADS`` (or
+``ASGI_THREADS``). Streams are closed after ``STATION_EVENTS_MAX_SECONDS``;
+browsers reconnect on their own.
+"""
+import fcntl
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+from app.api.v1.schemas.schemas import DocumentSchema
+
+DEFAULT_BUFFER = 1000
+DEFAULT_HEARTBEAT_SECONDS = 15
+DEFAULT_MAX_SECONDS = 300
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_POLL_SECONDS = 0.2
+DEFAULT_MAX_STREAMS = 8
+RETRY_MS = 3000
+READY_TIMEOUT_SECONDS = 5
+# Bytes read back from the end of the file when a worker starts tailing it
+WARMUP_BYTES = 256 * 1024
+
+# Without nested template/station, so dumping never lazy-loads relationships
+summary_schema = DocumentSchema(only=('id', 'public_id', 'name', 'template_id', 'status', 'current_station_id',
+                                      'created_by', 'created_at', 'updated_at'))
+
+
+class StationEventBus:
+    """Ring buffer of recent events that streams can wait on"""
+    
+    def __init__(self, size=DEFAULT_BUFFER):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self.path = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.poll_seconds = DEFAULT_POLL_SECONDS
+        self.max_streams = DEFAULT_MAX_STREAMS
+        self._streams = 0
+        self._follower = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+    
+    def configure(self, size=DEFAULT_BUFFER, path=None, max_bytes=DEFAULT_MAX_BYTES,
+                  poll_seconds=DEFAULT_POLL_SECONDS, max_streams=DEFAULT_MAX_STREAMS):
+        """Drop buffered events and switch to a new buffer size and file (open streams stay counted)"""
+        self._stop.set()
+        with self._condition:
+            self._events = deque(maxlen=size)
+            self._seq = 0
+            self.path = path
+            self.max_bytes = max_bytes
+            self.poll_seconds = poll_seconds
+            self.max_streams = max_streams
+            self._follower = None
+            self._stop = threading.Event()
+            self._ready = threading.Event()
+    
+    def open_stream(self):
+        """Count a new stream in; False if this worker already serves ``max_streams`` (0 = no limit)"""
+        with self._condition:
+            if self.max_streams and self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+    
+    def close_stream(self):
+        with self._condition:
+            self._streams -= 1
+    
+    def publish(self, event):
+        """Publish ``event`` to every worker"""
+        if self.path is None:
+            self._deliver(None, event)
+            return
+        line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        fd = self._open_locked()
+        try:
+            if os.fstat(fd).st_size == 0:
+                header = {'generation': secrets.token_hex(4)}
+                os.write(fd, (json.dumps(header, separators=(',', ':')) + '\n').encode('utf-8'))
+            os.write(fd, line)
+            if os.fstat(fd).st_size > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+        finally:
+            os.close(fd)
+    
+    def _open_locked(self):
+        """Open the events file for appending and lock it, making sure it was not rotated in between"""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                return fd
+            # Another publisher rotated the file after we opened it; followers have moved on from it
+            os.close(fd)
+    
+    def _deliver(self, event_id, event):
+        with self._condition:
+            self._seq += 1
+            self._events.append((self._seq, self._seq if event_id is None else event_id, event))
+            self._condition.notify_all()
+    
+    def cursor(self, last_event_id=None):
+        """Buffer position to stream from, and whether events were missed"""
+        self._ensure_follower()
+        if self.path is not None:
+            # Let a new follower load the file's recent events first, so they are not streamed as new
+            self._ready.wait(READY_TIMEOUT_SECONDS)
+        with self._condition:
+            if last_event_id is None:
+                return self._seq, False
+            for seq, event_id, _ in self._events:
+                if str(event_id) == last_event_id:
+                    return seq, False
+            return self._seq, True
+    
+    def wait(self, cursor, timeout):
+        """Events after ``cursor``, waiting up to ``timeout`` for one to arrive"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > cursor, timeout)
+            if self._events and self._events[0][0] > cursor + 1:
+                # The stream fell behind by more than the buffer holds
+                return [], self._seq, True
+            events = [(event_id, event) for seq, event_id, event in self._events if seq > cursor]
+            return events, self._seq, False
+    
+    def _ensure_follower(self):
+        with self._condition:
+            if self.path is None or self._follower is not None:
+                return
+            self._follower = threading.Thread(target=self._follow, args=(self.path, self._stop, self._ready),
+                                              name='station-events', daemon=True)
+            self._follower.start()
+    
+    def _follow(self, path, stop, ready):
+        """Tail the events file into the buffer, following rotations"""
+        handle, inode, offset, generation = None, None, 0, None
+        while not stop.is_set():
+            if handle is None:
+                try:
+                    handle = open(path, 'rb')
+                except FileNotFoundError:
+                    ready.set()
+                    stop.wait(self.poll_seconds)
+                    continue
+                inode = os.fstat(handle.fileno()).st_ino
+                generation = self._generation(handle)
+                if offset == 0 and self._seq == 0:
+                    offset = self._warm_up(handle)
+                handle.seek(offset)
+            
+            line = handle.readline()
+            if line.endswith(b'\n'):
+                offset += len(line)
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if 'type' not in event:
+                    # The header of a file created after the follower opened it
+                    generation = event.get('generation', generation)
+                    continue
+                self._deliver(f'{generation}:{offset}', event)
+                continue
+            handle.seek(offset)
+            ready.set()
+            
+            try:
+                rotated = os.stat(path).st_ino != inode
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                # Everything left in the old file has been read above
+                handle.close()
+                handle, offset = None, 0
+                continue
+            stop.wait(self.poll_seconds)
+        if handle is not None:
+            handle.close()
+    
+    def _generation(self, handle):
+        """Generation named by the file's first line ('0' for files written before generations)"""
+        handle.seek(0)
+        first = handle.readline()
+        try:
+            header = json.loads(first) if first.endswith(b'\n') else {}
+        except ValueError:
+            header = {}
+        return header.get('generation', '0') if isinstance(header, dict) else '0'
+    
+    def _warm_up(self, handle):
+        """Start near the end of the file, so recent events can be resumed"""
+        size = os.fstat(handle.fileno()).st_size
+        if size <= WARMUP_BYTES:
+            return 0
+        handle.seek(size - WARMUP_BYTES)
+        partial = handle.readline()
+        return size - WARMUP_BYTES + len(partial)
+
+
+station_events = StationEventBus()
+
+
+def document_events(document, action, previous_station_id=None):
+    """Arrive/leave/update events for a document change
+    
+    ``action`` is ``created``, ``updated`` or ``deleted``; updates pass the
+    station the document was at before the change. Build the events while the
+    document is still loaded (before a delete) and publish them once the
+    change is committed.
+    """
+    current_station_id = None if action == 'deleted' else document.current_station_id
+    if action == 'created':
+        previous_station_id = None
+    elif action == 'deleted':
+        previous_station_id = document.current_station_id
+    
+    data = summary_schema.dump(document)
+    stations = []
+    if previous_station_id is not None and previous_station_id != current_station_id:
+        stations.append(('leave', previous_station_id))
+    if current_station_id is not None:
+        stations.append(('arrive' if previous_station_id != current_station_id else 'update', current_station_id))
+    return [
+        {'type': event_type, 'station_id': station_id, 'tenant_id': document.tenant_id, 'document': data}
+        for event_type, station_id in stations
+    ]
+
+
+def publish_events(events):
+    for event in events:
+        station_events.publish(event)
+
+
+def format_event(event_id, event_type, data):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+def event_stream(station_id, tenant_id, last_event_id=None, heartbeat=DEFAULT_HEARTBEAT_SECONDS,
+                 max_seconds=DEFAULT_MAX_SECONDS):
+    """SSE lines for one station's events, as seen by ``tenant_id``"""
+    cursor, missed = station_events.cursor(last_event_id)
+    yield f'retry: {RETRY_MS}\n\n'
+    if missed:
+        yield 'event: reset\ndata: {}\n\n'
+    
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    last_write = time.monotonic()
+    while deadline is None or time.monotonic() < deadline:
+        timeout = last_write + heartbeat - time.monotonic()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        events, cursor, missed = station_events.wait(cursor, max(0, timeout))
+        if missed:
+            yield 'event: reset\ndata: {}\n\n'
+            last_write = time.monotonic()
+        for event_id, event in events:
+            if event['station_id'] == station_id and event['tenant_id'] == tenant_id:
+                yield format_event(event_id, event['type'], event['document'])
+                last_write = time.monotonic()
+        if time.monotonic() - last_write >= heartbeat:
+            # Comment line: keeps proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+            last_write = time.monotonic()
+
+
+def init_station_events(app):
+    """Size the buffer and pick the in-process or file-backed transport"""
+    path = app.config.get('STATION_EVENTS_FILE')
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    station_events.configure(
+        size=app.config.get('STATION_EVENTS_BUFFER', DEFAULT_BUFFER),
+        path=path,
+        max_bytes=app.config.get('STATION_EVENTS_MAX_BYTES', DEFAULT_MAX_BYTES),
+        poll_seconds=app.config.get('STATION_EVENTS_POLL_SECONDS', DEFAULT_POLL_SECONDS),
+        max_streams=app.config.get('STATION_EVENTS_MAX_STREAMS', DEFAULT_MAX_STREAMS),
+    )
@@ -0,0 +1,17 @@
+"""Swagger specs for the blueprint routes without importing flasgger.
+
+The routes describe themselves with ``@swag_from({...})`` dicts. For a dict,
+flasgger's decorator only stores it on the view as ``specs_dict``, but
+importing flasgger costs more worker boot time than the rest of the route
+modules put together. This decorator stores the spec the same way, so
+flasgger can still read it if ``Swagger(app)`` is ever set up. The
+Flask-RESTX docs at ``/apidocs/`` build their spec on the first request.
+"""
+
+
+def swag_from(specs):
+    """Attach an OpenAPI operation spec (a dict) to a view function"""
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
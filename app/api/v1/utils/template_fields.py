@@ -0,0 +1,195 @@
+"""Compiled, cached editable-field definitions of templates.
+
+``Template.editable_fields`` is a JSON text column. Parsing it, and then
+interpreting each definition, used to happen on every
+``get_editable_fields`` call, so once per document in batch and render
+paths. ``template_fields(template)`` instead returns a ``TemplateFields``
+built once per template version, ``(id, updated_at)``, and shared by all
+requests in the process. It holds one ``FieldValidator`` per field, which
+checks a value in a single call, with the type check and the option set
+chosen up front. ``get_editable_fields`` still parses the text on each
+call, so that every caller gets definitions of its own to change.
+
+Entries also remember the JSON they were built from. A template edited in
+the current session, before ``updated_at`` changes on flush, is therefore
+never validated against stale definitions.
+"""
+import json
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from marshmallow import ValidationError
+
+from app.observability.metrics import record_cache_lookup
+
+DEFAULT_CACHE_SIZE = 512
+NUMBER_TYPES = ('number', 'integer', 'decimal', 'currency')
+BOOLEAN_TYPES = ('boolean', 'checkbox')
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Must be a number')
+    return value
+
+
+def _boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError('Must be true or false')
+    return value
+
+
+def _date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('Must be a date (YYYY-MM-DD)')
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError('Must be a string')
+    return value
+
+
+CHECKS = {'number': _number, 'boolean': _boolean, 'date': _date, 'text': _text}
+
+
+def storage_type(declared):
+    """The value_type a declared field type is stored as"""
+    declared = (declared or 'text').lower()
+    if declared in NUMBER_TYPES:
+        return 'number'
+    if declared in BOOLEAN_TYPES:
+        return 'boolean'
+    if declared == 'date':
+        return 'date'
+    return 'text'
+
+
+class FieldValidator:
+    """One field definition, ready to check values"""
+    
+    __slots__ = ('name', 'value_type', 'required', 'options', '_check')
+    
+    def __init__(self, definition):
+        if not isinstance(definition, dict) or not isinstance(definition.get('name'), str) \
+                or not definition['name']:
+            raise ValueError('Each field needs a name')
+        options = definition.get('options')
+        if options is not None and not isinstance(options, list):
+            raise ValueError(f'Options of {definition["name"]} must be a list')
+        self.name = definition['name']
+        self.value_type = storage_type(definition.get('type'))
+        self.required = bool(definition.get('required'))
+        self.options = options or None
+        self._check = CHECKS[self.value_type]
+    
+    def coerce(self, value):
+        """``(value_type, value)`` for a valid value; raises ValueError otherwise"""
+        if value is None:
+            if self.required:
+                raise ValueError('Field is required')
+            return self.value_type, None
+        value = self._check(value)
+        if self.options and value not in self.options:
+            raise ValueError(f'Must be one of: {", ".join(map(str, self.options))}')
+        return self.value_type, value
+
+
+class TemplateFields:
+    """All field validators of one template version"""
+    
+    def __init__(self, source, strict=False, raw=None):
+        # ``source`` is the parsed editable_fields: a list of definitions or {"fields": [...]}
+        self._raw = raw if raw is not None else json.dumps(source)
+        definitions = source.get('fields', []) if isinstance(source, dict) else source or []
+        if not isinstance(definitions, list):
+            raise ValueError('Editable fields must be a list of field definitions')
+        self.validators = {}
+        for definition in definitions:
+            try:
+                validator = FieldValidator(definition)
+            except ValueError:
+                # Stored templates predate validation; skip what cannot be checked
+                if strict:
+                    raise
+                continue
+            self.validators[validator.name] = validator
+        self.required = tuple(name for name, validator in self.validators.items() if validator.required)
+    
+    def definitions(self):
+        """The editable_fields, freshly parsed, so callers are free to change them"""
+        # The instance is shared by every request; parsing the text again is cheaper than a deepcopy
+        return json.loads(self._raw)
+    
+    @classmethod
+    def parse(cls, raw, strict=False):
+        """Build from the JSON text stored on the template"""
+        return cls(json.loads(raw) if raw else [], strict, raw or '[]')
+    
+    def validate(self, values, partial=False):
+        """Typed ``{name: (value_type, value)}``, or ValidationError keyed by field
+        
+        Unless ``partial``, every required field has to be given.
+        """
+        errors, typed = {}, {}
+        for name, value in (values or {}).items():
+            validator = self.validators.get(name)
+            if validator is None:
+                errors[name] = ['Not an editable field of this template']
+                continue
+            try:
+                typed[name] = validator.coerce(value)
+            except ValueError as err:
+                errors[name] = [str(err)]
+        if not partial:
+            for name in self.required:
+                if name not in typed and name not in errors:
+                    errors[name] = ['Field is required']
+        if errors:
+            raise ValidationError({'fields': errors})
+        return typed
+
+
+class TemplateFieldsCache:
+    """Bounded LRU of ``TemplateFields`` keyed by template id and version"""
+    
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    def get(self, template):
+        key = (template.id, template.updated_at)
+        raw = template.editable_fields
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry[0] == raw
+            if hit:
+                self._entries.move_to_end(key)
+        record_cache_lookup('template_fields', hit=hit)
+        if hit:
+            return entry[1]
+        
+        compiled = TemplateFields.parse(raw)
+        if template.id is not None and self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = (raw, compiled)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return compiled
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+template_fields_cache = TemplateFieldsCache()
+
+
+def template_fields(template):
+    """Compiled field definitions of ``template`` (cached per version)"""
+    return template_fields_cache.get(template)
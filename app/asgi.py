@@ -0,0 +1,254 @@
+"""ASGI deployment mode.
+
+Serves the polling-heavy document reads (``GET /api/v1/documents`` and
+``GET /api/v1/documents/<public_id>``) as native coroutines on SQLAlchemy's
+asyncio engine, so a slow client or a slow query only parks a coroutine
+instead of tying up a whole worker. Every other route is passed through to
+the regular Flask app via ``asgiref``'s WSGI adapter, so the API surface is
+unchanged. Those requests run on a pool of ``ASGI_THREADS`` threads per
+worker: the adapter's default would put every one of them on a single
+shared thread, so one slow request or open event stream held up all the
+others.
+
+Run with an ASGI server, e.g.::
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8531 --workers 4
+"""
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.datastructures import MultiDict
+
+from app import create_app, db
+from app.api.v1.models.models import Document, Station, Template
+from app.api.v1.utils.document_fields import InvalidFieldFilter, field_filters
+from app.api.v1.utils.fieldsets import InvalidFieldset, fieldset_cache, parse_fieldset_args
+from app.security.claims import revocation_list
+from app.database.sharding import PRIMARY, shard_map
+
+DEFAULT_THREADS = 16
+
+# Sync driver name -> asyncio driver used for the same database
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+class AuthError(Exception):
+    """Bearer token missing or rejected"""
+    
+    def __init__(self, message, status=401):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """``WsgiToAsgi`` that runs each request on a thread of ``executor``
+    
+    asgiref runs the WSGI app with ``sync_to_async`` in thread-sensitive
+    mode, which serializes every request of the process on one thread.
+    """
+    
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+    
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiToAsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+
+class PooledWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """One request of ``PooledWsgiToAsgi``"""
+    
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+    
+    # The plain function under asgiref's ``@sync_to_async``
+    _run_wsgi_app = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+    
+    async def run_wsgi_app(self, body):
+        await SyncToAsync(self._run_wsgi_app, thread_sensitive=False, executor=self.executor)(body)
+
+
+def async_database_url(url):
+    """Swap a sync SQLAlchemy URL onto its asyncio driver"""
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is None:
+        raise ValueError(f'No asyncio driver configured for {url.drivername}')
+    return url.set(drivername=driver)
+
+
+class AsyncAPI:
+    """ASGI app with async document reads in front of the Flask app"""
+    
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(flask_app.config.get('ASGI_THREADS', DEFAULT_THREADS),
+                                           thread_name_prefix='wsgi')
+        self.wsgi = PooledWsgiToAsgi(flask_app, self.executor)
+        
+        with flask_app.app_context():
+            url = async_database_url(db.engine.url)
+        self.engine = create_async_engine(url, **flask_app.config.get('ASYNC_ENGINE_OPTIONS', {}))
+        self.session_factory = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        
+        self.routes = [
+            (re.compile(r'^/api/v1/documents/?$'), self.list_documents),
+            (re.compile(r'^/api/v1/documents/(?P<public_id>[^/]+)$'), self.get_document),
+        ]
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, handler in self.routes:
+                match = pattern.match(scope['path'])
+                if match:
+                    return await self.dispatch(handler, scope, receive, send, **match.groupdict())
+        
+        return await self.wsgi(scope, receive, send)
+    
+    async def lifespan(self, receive, send):
+        """Dispose of the async engine and the WSGI threads on shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    async def dispatch(self, handler, scope, receive, send, **kwargs):
+        """Authenticate, run an async handler and send its JSON response"""
+        try:
+            claims = await self.authenticate(scope)
+        except AuthError as err:
+            return await self.respond(send, {"msg": err.message}, err.status)
+        
+        # Tenants living on a shard are served by the sync app's shard routing
+        tenant = (claims.get('sub') or {}).get('tenant')
+        shard, _ = await self.run_sync(shard_map.lookup, tenant)
+        if shard != PRIMARY:
+            return await self.wsgi(scope, receive, send)
+        
+        query = parse_query(scope)
+        try:
+            async with self.session_factory() as session:
+                body, status = await handler(session, query, tenant, **kwargs)
+        except (InvalidFieldFilter, InvalidFieldset) as err:
+            body, status = {"error": str(err)}, 400
+        await self.respond(send, body, status)
+    
+    async def run_sync(self, fn, *args):
+        """Run a blocking call (it may query the database) in a thread, inside an app context"""
+        def call():
+            with self.flask_app.app_context():
+                return fn(*args)
+        return await asyncio.to_thread(call)
+    
+    async def authenticate(self, scope):
+        """Mirror ``@jwt_required()`` using the app's JWT settings and deny-list"""
+        headers = dict(scope['headers'])
+        auth = headers.get(b'authorization', b'').decode('latin-1')
+        if not auth:
+            raise AuthError('Missing Authorization Header')
+        
+        parts = auth.split()
+        if len(parts) != 2 or parts[0] != 'Bearer':
+            raise AuthError("Bad Authorization header. Expected 'Authorization: Bearer <JWT>'", 422)
+        
+        with self.flask_app.app_context():
+            try:
+                claims = decode_token(parts[1])
+            except ExpiredSignatureError:
+                raise AuthError('Token has expired')
+            except InvalidTokenError as err:
+                raise AuthError(str(err), 422)
+            
+            if claims.get('type') != 'access':
+                raise AuthError('Only non-refresh tokens are allowed', 422)
+        if await self.run_sync(revocation_list.is_revoked, claims['jti']):
+            raise AuthError('Token has been revoked')
+        return claims
+    
+    async def respond(self, send, body, status):
+        payload = json.dumps(body, sort_keys=True).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+    
+    async def list_documents(self, session, query, tenant):
+        """Async variant of ``documents.get_documents``"""
+        view = fieldset_cache.get('document', *parse_fieldset_args(query))
+        stmt = select(Document).filter_by(tenant_id=tenant).options(*view.options)
+        
+        status = query.get('status')
+        if status:
+            stmt = stmt.filter_by(status=status)
+        
+        template_id = query.get('template_id')
+        if template_id:
+            template = (await session.execute(
+                select(Template.id).filter_by(public_id=template_id)
+            )).scalar()
+            if template:
+                stmt = stmt.filter_by(template_id=template)
+        
+        station_id = query.get('station_id')
+        if station_id:
+            station = (await session.execute(
+                select(Station.id).filter_by(public_id=station_id)
+            )).scalar()
+            if station:
+                stmt = stmt.filter_by(current_station_id=station)
+        
+        stmt = stmt.filter(*field_filters(query))
+        
+        result = await session.execute(stmt.order_by(Document.updated_at.desc()))
+        return view.many.dump(result.scalars().all()), 200
+    
+    async def get_document(self, session, query, tenant, public_id):
+        """Async variant of ``documents.get_document``"""
+        view = fieldset_cache.get('document', *parse_fieldset_args(query))
+        result = await session.execute(
+            select(Document).filter_by(public_id=public_id, tenant_id=tenant).options(*view.options)
+        )
+        document = result.scalars().first()
+        
+        if not document:
+            return {"error": "Document not found"}, 404
+        
+        return view.schema.dump(document), 200
+
+
+def parse_query(scope):
+    """Decode the query string into a MultiDict, as Flask's ``request.args``"""
+    return MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+
+
+def create_asgi_app(test_config=None):
+    """Create the ASGI application"""
+    return AsyncAPI(create_app(test_config))
@@ -0,0 +1,258 @@
+"""Change data capture for documents, templates, stations and flows.
+
+Every flush that inserts, updates or deletes one of those rows is noted on
+the session, and just before the transaction commits one ``change_log`` row
+per change is written on the same connection as the change. The row records
+the entity, its ``public_id``, the operation and a JSON snapshot of the row
+after the change. A change is therefore logged exactly when it commits,
+whichever route or command made it. Bulk ``query.delete()``/``update()``
+calls bypass the ORM and are not logged, so write paths for tracked tables
+go through the session.
+
+Sharded documents are logged on their tenant's shard, next to the document.
+Each database numbers its changes with its own ``seq``, so consumers read
+with a cursor that holds one position per database.
+
+A ``seq`` is handed out by the single ``change_log_counter`` row of its
+database, as the last step before commit. The counter row stays locked
+until the transaction ends, so a later writer cannot get a higher ``seq``
+until the earlier one has committed or rolled back: once ``seq`` N is
+visible, every change numbered below N is visible too, however long the
+transaction took before it reached its commit. On SQLite writes are
+serialized and the lock costs nothing extra.
+
+``GET /api/v1/changes?after=<cursor>&limit=500`` returns the changes after
+the cursor, oldest first, plus the cursor to send next. Each read is an
+index range scan on ``seq``, so syncing costs time in proportion to the
+changes since the last sync, not to the size of the tables.
+
+``flask changes compact`` drops rows that a newer change to the same row
+supersedes, once they are older than ``--older-than-hours``. A consumer far
+behind then still ends up with the latest state of every row, including
+deletes.
+"""
+import heapq
+import json
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, event, exists, func, inspect as sa_inspect, select
+
+from app import db
+from app.database.routing import RoutingSession
+from app.database.sharding import PRIMARY, shard_keys
+
+# Table -> entity name used in the log
+TRACKED_TABLES = {
+    'documents': 'document',
+    'templates': 'template',
+    'stations': 'station',
+    'flows': 'flow',
+    'flow_steps': 'flow_step',
+}
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+DEFAULT_COMPACT_BATCH = 1000
+
+
+class InvalidCursor(ValueError):
+    """Raised for an ``after`` value that is not a change log cursor"""
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def snapshot(obj, mapper):
+    """Column values of ``obj`` as a JSON string"""
+    return json.dumps({attr.key: _json_value(getattr(obj, attr.key)) for attr in mapper.column_attrs})
+
+
+def record_changes(session, flush_context):
+    """Note the tracked rows in this flush, by the connection each row was written to"""
+    # After a flush the new/dirty/deleted collections still describe what was flushed
+    pending = session.info.setdefault('change_log_pending', {})
+    for op, instances in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in instances:
+            entity = TRACKED_TABLES.get(getattr(obj, '__tablename__', None))
+            if entity is None:
+                continue
+            if op == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            mapper = sa_inspect(obj).mapper
+            connection = session.connection(bind_arguments={'mapper': mapper})
+            pending.setdefault(connection, []).append({
+                'entity': entity,
+                'entity_id': obj.public_id,
+                'op': op,
+                'tenant_id': getattr(obj, 'tenant_id', None),
+                'data': None if op == 'delete' else snapshot(obj, mapper),
+            })
+
+
+def allocate_seqs(connection, count):
+    """Reserve ``count`` seqs; returns the first. Holds the counter row's lock until commit"""
+    from app.api.v1.models.models import ChangeLog, ChangeLogCounter
+    counter = ChangeLogCounter.__table__
+    
+    updated = connection.execute(
+        counter.update().where(counter.c.id == 1).values(value=counter.c.value + count)
+    )
+    if not updated.rowcount:
+        # A database whose counter was never seeded; start after any seq already used
+        last = connection.execute(select(func.coalesce(func.max(ChangeLog.__table__.c.seq), 0))).scalar()
+        connection.execute(counter.insert().values(id=1, value=last + count))
+    return connection.execute(select(counter.c.value).where(counter.c.id == 1)).scalar() - count + 1
+
+
+def write_changes(session):
+    """Write the noted changes, numbered in commit order, as the transaction's last statements"""
+    from app.api.v1.models.models import ChangeLog
+    
+    # Flush now so that the commit's own flush has nothing left to note
+    session.flush()
+    pending = session.info.pop('change_log_pending', None)
+    if not pending:
+        return
+    now = datetime.utcnow()
+    for connection, changes in pending.items():
+        first = allocate_seqs(connection, len(changes))
+        for offset, change in enumerate(changes):
+            change['seq'] = first + offset
+            change['changed_at'] = now
+        connection.execute(ChangeLog.__table__.insert(), changes)
+
+
+def forget_changes(session):
+    session.info.pop('change_log_pending', None)
+
+
+def seed_counter(engine):
+    """Create the counter row of a database, after the highest seq already logged there"""
+    from app.api.v1.models.models import ChangeLog, ChangeLogCounter
+    counter = ChangeLogCounter.__table__
+    with engine.begin() as conn:
+        if conn.execute(select(counter.c.id).where(counter.c.id == 1)).first() is None:
+            last = conn.execute(select(func.coalesce(func.max(ChangeLog.__table__.c.seq), 0))).scalar()
+            conn.execute(counter.insert().values(id=1, value=last))
+
+
+event.listen(RoutingSession, 'after_flush', record_changes)
+event.listen(RoutingSession, 'before_commit', write_changes)
+event.listen(RoutingSession, 'after_rollback', forget_changes)
+
+
+def change_sources(app):
+    """``(name, bind key)`` of every database with a change log, primary first"""
+    return [(PRIMARY, None)] + [(key[len('shard_'):], key) for key in shard_keys(app)]
+
+
+def parse_cursor(value, sources):
+    """Positions per source from an ``after`` value
+    
+    With only the primary database the cursor is its last ``seq``; with
+    shards it is ``name:seq`` pairs joined by commas.
+    """
+    positions = {name: 0 for name, _ in sources}
+    if not value:
+        return positions
+    try:
+        if ':' not in value:
+            positions[PRIMARY] = int(value)
+            return positions
+        for part in value.split(','):
+            name, seq = part.rsplit(':', 1)
+            if name not in positions:
+                raise InvalidCursor(value)
+            positions[name] = int(seq)
+    except ValueError:
+        raise InvalidCursor(value)
+    return positions
+
+
+def format_cursor(positions):
+    if list(positions) == [PRIMARY]:
+        return str(positions[PRIMARY])
+    return ','.join(f'{name}:{seq}' for name, seq in positions.items())
+
+
+def read_changes(app, positions, limit=DEFAULT_PAGE_SIZE):
+    """Up to ``limit`` changes after ``positions``, merged across databases by time
+    
+    Returns ``(changes, next positions, has_more)``.
+    """
+    from app.api.v1.models.models import ChangeLog
+    table = ChangeLog.__table__
+    
+    per_source = []
+    more = False
+    for name, bind in change_sources(app):
+        query = select(table).where(table.c.seq > positions[name]).order_by(table.c.seq).limit(limit + 1)
+        with db.get_engine(app, bind).connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        more = more or len(rows) > limit
+        per_source.append([(row['changed_at'], name, row) for row in rows[:limit]])
+    
+    # Each source stays in seq order, so a position never skips past a change not yet returned
+    candidates = list(heapq.merge(*per_source, key=lambda candidate: candidate[:2]))
+    taken = candidates[:limit]
+    next_positions = dict(positions)
+    changes = []
+    for _, name, row in taken:
+        next_positions[name] = max(next_positions[name], row['seq'])
+        changes.append({
+            'source': name,
+            'seq': row['seq'],
+            'entity': row['entity'],
+            'id': row['entity_id'],
+            'op': row['op'],
+            'tenant_id': row['tenant_id'],
+            'changed_at': row['changed_at'].isoformat(),
+            'data': json.loads(row['data']) if row['data'] is not None else None,
+        })
+    return changes, next_positions, more or len(candidates) > limit
+
+
+def compact(engine, older_than, batch_size=DEFAULT_COMPACT_BATCH):
+    """Delete changes older than ``older_than`` that a newer change to the same row supersedes"""
+    from app.api.v1.models.models import ChangeLog
+    table = ChangeLog.__table__
+    newer = table.alias('newer')
+    
+    superseded = select(table.c.seq).where(
+        table.c.changed_at < older_than,
+        exists().where(and_(newer.c.entity == table.c.entity,
+                            newer.c.entity_id == table.c.entity_id,
+                            newer.c.seq > table.c.seq)),
+    ).order_by(table.c.seq).limit(batch_size)
+    
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            seqs = conn.execute(superseded).scalars().all()
+            if not seqs:
+                return deleted
+            conn.execute(table.delete().where(table.c.seq.in_(seqs)))
+        deleted += len(seqs)
+
+
+@click.group('changes')
+def changes_cli():
+    """Change log commands"""
+
+
+@changes_cli.command('compact')
+@click.option('--older-than-hours', default=24.0, show_default=True,
+              help='only compact changes older than this')
+@click.option('--batch-size', default=DEFAULT_COMPACT_BATCH, show_default=True)
+@with_appcontext
+def compact_command(older_than_hours, batch_size):
+    """Drop superseded changes on the primary and every shard"""
+    older_than = datetime.utcnow() - timedelta(hours=older_than_hours)
+    for name, bind in change_sources(current_app):
+        deleted = compact(db.get_engine(current_app, bind), older_than, batch_size)
+        click.echo(f'{name}: removed {deleted} superseded changes')
@@ -0,0 +1,188 @@
+"""Connection pool configuration and instrumentation.
+
+Engine options come from the environment: ``SQLALCHEMY_ENGINE_OPTIONS`` may
+hold a JSON object of ``create_engine`` keyword arguments, and the common
+pool settings can be given individually (``DB_POOL_SIZE``,
+``DB_MAX_OVERFLOW``, ``DB_POOL_TIMEOUT``, ``DB_POOL_RECYCLE``,
+``DB_POOL_PRE_PING``); individual variables win over the JSON.
+
+Engines are fork-safe. Under ``gunicorn --preload``, the app and its
+engines are built once in the master and the workers are forked from it.
+In each child, every engine drops the pool it inherited without closing
+those connections, since they still belong to the parent. The child then
+opens its own connections.
+
+Every engine is built with an instrumented subclass of the pool class it
+would otherwise use, which records how long checkouts wait, how many
+connections are in use and how far the pool overflows. ``pool_snapshot()``
+reports the numbers for this process, by bind name rather than by URL.
+"""
+import json
+import os
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc as sa_exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+DEFAULT_POOL_RECYCLE = 1800
+
+# Per-process stats for every engine created, keyed by the masked URL
+pool_registry = {}
+
+
+def _as_bool(value):
+    return str(value).lower() in ('true', '1', 't', 'y', 'yes')
+
+
+POOL_ENV_VARS = (
+    ('DB_POOL_SIZE', 'pool_size', int),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int),
+    ('DB_POOL_PRE_PING', 'pool_pre_ping', _as_bool),
+)
+
+
+def engine_options_from_env(environ=None):
+    """Build ``SQLALCHEMY_ENGINE_OPTIONS`` from environment variables"""
+    environ = os.environ if environ is None else environ
+    options = {'pool_pre_ping': True, 'pool_recycle': DEFAULT_POOL_RECYCLE}
+    
+    raw = environ.get('SQLALCHEMY_ENGINE_OPTIONS')
+    if raw:
+        options.update(json.loads(raw))
+    
+    for name, key, cast in POOL_ENV_VARS:
+        if environ.get(name):
+            options[key] = cast(environ[name])
+    return options
+
+
+class PoolStats:
+    """Checkout counters for one engine's pool"""
+    
+    def __init__(self, name, pool_class):
+        self.name = name
+        self.pool_class = pool_class
+        self.engine = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.in_use_peak = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+    
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+    
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+    
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+    
+    def reset(self):
+        """Zero the counters (a forked worker starts with an empty pool)"""
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.in_use = 0
+            self.in_use_peak = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+    
+    def snapshot(self):
+        """Current numbers as a plain dict"""
+        # engine.dispose() swaps in a new pool, so always read it from the engine
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            data = {
+                'pool_class': self.pool_class,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'in_use': self.in_use,
+                'in_use_peak': self.in_use_peak,
+                'checkout_wait_total_seconds': round(self.wait_total, 6),
+                'checkout_wait_max_seconds': round(self.wait_max, 6),
+                'checkout_wait_avg_seconds': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+        # Only QueuePool-style pools have a fixed size and overflow
+        for attr in ('size', 'overflow', 'checkedin'):
+            method = getattr(pool, attr, None)
+            data[attr] = method() if callable(method) else None
+        return data
+
+
+class TimedCheckoutMixin:
+    """Pool mixin that times how long ``connect()`` waits for a connection"""
+    
+    stats = None
+    
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except sa_exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension that instruments every engine's pool"""
+    
+    def create_engine(self, sa_url, engine_opts):
+        poolclass = engine_opts.get('poolclass')
+        if poolclass in (None, NullPool) and sa_url.get_backend_name() == 'sqlite' and engine_opts.get('pool_size'):
+            # File databases default to a NullPool; an explicit size asks for a queue
+            poolclass = QueuePool
+            engine_opts = dict(engine_opts, connect_args=dict(
+                engine_opts.get('connect_args', {}), check_same_thread=False
+            ))
+        poolclass = poolclass or sa_url.get_dialect().get_pool_class(sa_url)
+        stats = PoolStats(repr(sa_url), poolclass.__name__)
+        engine_opts = dict(engine_opts, poolclass=type(
+            f'Timed{poolclass.__name__}', (TimedCheckoutMixin, poolclass), {'stats': stats}
+        ))
+        
+        engine = super().create_engine(sa_url, engine_opts)
+        event.listen(engine, 'checkout', stats.on_checkout)
+        event.listen(engine, 'checkin', stats.on_checkin)
+        stats.engine = engine
+        pool_registry[stats.name] = stats
+        return engine
+
+
+def dispose_inherited_pools():
+    """Drop pools copied from the parent process without closing its connections"""
+    for stats in pool_registry.values():
+        # Locks may have been held by another thread at fork time
+        stats._lock = threading.Lock()
+        if stats.engine is not None:
+            stats.engine.dispose(close=False)
+        stats.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispose_inherited_pools)
+
+
+def pool_snapshot(engines):
+    """Pool statistics for ``engines`` (``{name: engine}``) in this process"""
+    by_engine = {id(stats.engine): stats for stats in pool_registry.values() if stats.engine is not None}
+    pools = {name: by_engine[id(engine)].snapshot() for name, engine in engines.items() if id(engine) in by_engine}
+    return {'pid': os.getpid(), 'pools': pools}
@@ -0,0 +1,136 @@
+"""Read-replica routing.
+
+Replica URLs are listed (comma separated) in ``DATABASE_REPLICA_URLS`` and
+registered as ``replica_<n>`` binds. Requests with a safe method (GET, HEAD,
+OPTIONS) read from one replica picked per request; everything else, and any
+flush, goes to the primary.
+
+A request that has flushed reads from the primary from then on, so it sees
+its own writes. Replicas lag, so a client that has just written is pinned to
+the primary for ``DATABASE_REPLICA_STICKY_SECONDS``. The pin is kept in a cookie (so every
+worker honours it) and, for clients that drop cookies, in a per-process map
+keyed by a digest of their ``Authorization`` header.
+"""
+import hashlib
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import event, orm
+
+from app.database.pool import InstrumentedSQLAlchemy
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'db_primary_until'
+DEFAULT_STICKY_SECONDS = 5
+
+_sticky_lock = threading.Lock()
+_sticky_clients = {}
+
+
+def replica_binds(urls):
+    """Map ``DATABASE_REPLICA_URLS`` to ``SQLALCHEMY_BINDS`` entries"""
+    urls = [url.strip() for url in (urls or '').split(',') if url.strip()]
+    return {f'replica_{index}': url for index, url in enumerate(urls)}
+
+
+def replica_keys(app):
+    return [key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith('replica_')]
+
+
+def _client_key():
+    auth = request.headers.get('Authorization')
+    return hashlib.sha256(auth.encode('utf-8')).hexdigest() if auth else None
+
+
+def _is_sticky():
+    """Check if the current client wrote recently enough to need the primary"""
+    now = time.time()
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+            return True
+    except ValueError:
+        pass
+    
+    key = _client_key()
+    if key is None:
+        return False
+    with _sticky_lock:
+        until = _sticky_clients.get(key)
+        if until is not None and until <= now:
+            del _sticky_clients[key]
+            return False
+        return until is not None
+
+
+def choose_replica():
+    """Pick the replica bind for this request, or None to use the primary"""
+    replicas = replica_keys(current_app)
+    if not replicas or request.method not in SAFE_METHODS or _is_sticky():
+        return None
+    return random.choice(replicas)
+
+
+def mark_sticky(response):
+    """Pin a client that just wrote to the primary for the sticky window"""
+    if request.method in SAFE_METHODS or response.status_code >= 400 or not replica_keys(current_app):
+        return response
+    
+    window = current_app.config.get('DATABASE_REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+    until = time.time() + window
+    response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(window) + 1, httponly=True)
+    
+    key = _client_key()
+    if key is not None:
+        with _sticky_lock:
+            _sticky_clients[key] = until
+            # Keep the map from growing without bound
+            if len(_sticky_clients) > 10000:
+                now = time.time()
+                for stale in [k for k, v in _sticky_clients.items() if v <= now]:
+                    del _sticky_clients[stale]
+    return response
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends tenant data to its shard and safe reads to a replica"""
+    
+    def get_bind(self, mapper=None, clause=None):
+        from app.database.sharding import tenant_bind
+        sharded, shard = tenant_bind(mapper)
+        if sharded and shard is not None:
+            return get_state(self.app).db.get_engine(self.app, bind=shard)
+        
+        if not self._flushing and has_request_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+def pin_to_primary(session, flush_context):
+    """Read the rest of a request that wrote from the primary, where its writes are"""
+    if has_request_context():
+        g.db_replica = None
+
+
+event.listen(RoutingSession, 'after_flush', pin_to_primary)
+
+
+class RoutingSQLAlchemy(InstrumentedSQLAlchemy):
+    """Flask-SQLAlchemy extension using ``RoutingSession``"""
+    
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def init_replica_routing(app):
+    """Register the per-request replica choice and write stickiness"""
+    
+    @app.before_request
+    def route_reads_to_replica():
+        g.db_replica = choose_replica()
+    
+    app.after_request(mark_sticky)
@@ -0,0 +1,78 @@
+"""Explicit schema creation.
+
+Creating tables used to happen in ``create_app``, so every worker checked
+the schema, with reflection and DDL round trips, each time it booted. Run
+``flask schema create`` once per deploy instead (``deploy.sh`` and
+``run.sh`` do). Test and embedded configs still create tables on startup
+unless they set ``AUTO_CREATE_SCHEMA`` to false.
+
+Columns added to tables that already exist are listed in ``ADDED_COLUMNS``
+and added by ``create_schema`` too, along with any index declared on the
+models that such a table is missing.
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect as sa_inspect, text
+
+from app import db
+from app.database.change_log import seed_counter
+from app.database.sharding import create_shard_tables, shard_keys
+
+# (table, column, type) added after the table was first created; all nullable
+ADDED_COLUMNS = (
+    ('users', 'tenant_id', 'VARCHAR(64)'),
+    ('documents', 'tenant_id', 'VARCHAR(64)'),
+    ('document_history', 'tenant_id', 'VARCHAR(64)'),
+    ('idempotency_keys', 'response_headers', 'TEXT'),
+    ('idempotency_keys', 'claimed_at', 'DATETIME'),
+    ('analytics_state', 'refresh_queued_at', 'DATETIME'),
+)
+
+
+def add_missing_columns(engine):
+    """Add the ``ADDED_COLUMNS`` and model indexes a database created before them lacks"""
+    inspector = sa_inspect(engine)
+    existing_tables = inspector.get_table_names()
+    with engine.begin() as conn:
+        for table, column, column_type in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            if column not in [c['name'] for c in inspector.get_columns(table)]:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+    
+    # Indexes on the added columns are declared on the models
+    inspector = sa_inspect(engine)
+    for table in db.Model.metadata.sorted_tables:
+        if table.name in existing_tables:
+            names = {index['name'] for index in inspector.get_indexes(table.name)}
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for index in table.indexes:
+                if index.name not in names and {column.name for column in index.columns} <= columns:
+                    index.create(bind=engine)
+
+
+def create_schema(app):
+    """Create missing tables and columns on the primary database and on every shard"""
+    with app.app_context():
+        db.create_all()
+        add_missing_columns(db.engine)
+        seed_counter(db.engine)
+        for bind in shard_keys(app):
+            engine = db.get_engine(app, bind)
+            create_shard_tables(engine)
+            add_missing_columns(engine)
+            seed_counter(engine)
+
+
+@click.group('schema')
+def schema_cli():
+    """Database schema commands"""
+
+
+@schema_cli.command('create')
+@with_appcontext
+def create_command():
+    """Create missing tables (run once per deploy, before the workers start)"""
+    create_schema(current_app)
+    click.echo('Schema is up to date')
@@ -0,0 +1,428 @@
+"""Tenant sharding for documents and their history.
+
+Each organization (tenant) is identified by the ``tenant`` claim in its
+users' access tokens. ``documents``, ``document_history`` and
+``document_fields`` rows carry a ``tenant_id`` and live on the tenant's
+shard: a database registered as a ``shard_<name>`` bind from
+``TENANT_SHARD_URLS`` (``name=url,name=url``). Tenants without an entry in
+``tenant_shards`` stay on the primary database.
+
+The tenant -> shard map is read from the primary and cached per worker for
+``TENANT_SHARD_REFRESH_SECONDS``. ``flask tenants move`` relocates a tenant
+online: it bulk-copies the tenant's rows, catches up on changes made in the
+meantime, and then briefly rejects the tenant's writes with 503. While they
+are frozen it compares every row on both sides, copies whatever differs and
+checks the row counts match, and only then flips the mapping and purges the
+old copy.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, has_app_context, has_request_context, jsonify
+from flask.cli import with_appcontext
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, func, inspect as sa_inspect, select
+from sqlalchemy.schema import CreateTable
+
+from app import db
+from app.database.routing import RoutingSession
+
+PRIMARY = 'primary'
+SHARDED_TABLES = ('documents', 'document_history', 'document_fields')
+ACTIVE = 'active'
+MOVING = 'moving'
+DEFAULT_REFRESH_SECONDS = 5
+DEFAULT_BATCH_SIZE = 500
+
+
+class TenantMovingError(Exception):
+    """Raised when a tenant's data is written during the final move step"""
+
+
+def shard_binds(spec):
+    """Map ``TENANT_SHARD_URLS`` to ``SQLALCHEMY_BINDS`` entries"""
+    binds = {}
+    for entry in (spec or '').split(','):
+        if '=' in entry:
+            name, url = entry.split('=', 1)
+            binds[f'shard_{name.strip()}'] = url.strip()
+    return binds
+
+
+def shard_keys(app):
+    return [key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith('shard_')]
+
+
+def bind_for_shard(shard):
+    """Bind key for a shard name (None is the primary)"""
+    return None if shard in (None, PRIMARY) else f'shard_{shard}'
+
+
+def shard_engine(shard):
+    return db.get_engine(current_app, bind_for_shard(shard))
+
+
+def all_shard_engines():
+    """Primary plus every configured shard engine"""
+    return [db.get_engine(current_app)] + [
+        db.get_engine(current_app, key) for key in shard_keys(current_app)
+    ]
+
+
+def count_on_all_shards(table, *criteria):
+    """Count matching rows of a sharded table across the primary and every shard"""
+    total = 0
+    for engine in all_shard_engines():
+        with engine.connect() as conn:
+            total += conn.execute(select(func.count()).select_from(table).where(*criteria)).scalar()
+    return total
+
+
+class ShardMap:
+    """Per-process cache of the ``tenant_shards`` table"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._loaded_at = 0.0
+    
+    def _refresh(self):
+        from app.api.v1.models.models import TenantShard
+        table = TenantShard.__table__
+        # Always read the map from the primary, never a lagging replica
+        with db.get_engine(current_app).connect() as conn:
+            rows = conn.execute(select(table.c.tenant_id, table.c.shard, table.c.state)).all()
+        self._entries = {tenant: (shard, state) for tenant, shard, state in rows}
+    
+    def lookup(self, tenant_id):
+        """Get ``(shard, state)`` for a tenant"""
+        if tenant_id is None:
+            return PRIMARY, ACTIVE
+        refresh = current_app.config.get('TENANT_SHARD_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= refresh:
+                self._refresh()
+                self._loaded_at = time.monotonic()
+            return self._entries.get(tenant_id, (PRIMARY, ACTIVE))
+    
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+shard_map = ShardMap()
+
+
+def current_tenant():
+    """Tenant of the authenticated caller, or of the background job being run, or None"""
+    if not has_request_context():
+        # Jobs run outside requests, on behalf of the tenant that queued them
+        return g.get('tenant') if has_app_context() else None
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        return None
+    return identity.get('tenant') if isinstance(identity, dict) else None
+
+
+def tenant_bind(mapper):
+    """Bind key for a mapper when it is sharded and the caller's tenant has a shard"""
+    if mapper is None or mapper.persist_selectable.name not in SHARDED_TABLES:
+        return False, None
+    tenant = current_tenant()
+    if tenant is None:
+        return False, None
+    shard, _ = shard_map.lookup(tenant)
+    return True, bind_for_shard(shard)
+
+
+def guard_tenant_writes(session, flush_context, instances):
+    """Reject writes to sharded tables while the caller's tenant is being moved"""
+    tenant = current_tenant()
+    if tenant is None:
+        return
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(obj.__table__.name in SHARDED_TABLES for obj in changed):
+        _, state = shard_map.lookup(tenant)
+        if state == MOVING:
+            raise TenantMovingError(tenant)
+
+
+def create_shard_tables(engine):
+    """Create the sharded tables, and the change log and rollups fed by them, on a shard database
+    
+    Templates, stations and users stay on the primary, so foreign keys to
+    them are left out; only those between tables on the shard are created.
+    """
+    from app.api.v1.models.models import (AnalyticsGap, AnalyticsState, ChangeLog, ChangeLogCounter, Document,
+                                          DocumentField, DocumentHistory, StationDwellRollup, StationVisit)
+    names = {table.name for table in (Document.__table__, DocumentHistory.__table__, DocumentField.__table__,
+                                      ChangeLog.__table__, ChangeLogCounter.__table__, StationDwellRollup.__table__,
+                                      StationVisit.__table__, AnalyticsState.__table__, AnalyticsGap.__table__)}
+    with engine.begin() as conn:
+        existing = set(sa_inspect(conn).get_table_names())
+        for table in db.Model.metadata.sorted_tables:
+            if table.name not in names or table.name in existing:
+                continue
+            local = [fk for fk in table.foreign_key_constraints if fk.referred_table.name in names]
+            conn.execute(CreateTable(table, include_foreign_key_constraints=local))
+            for index in table.indexes:
+                index.create(bind=conn)
+
+
+class TenantMover:
+    """Copy one tenant's documents, history and field values between shard databases"""
+    
+    def __init__(self, tenant_id, source, target, batch_size=DEFAULT_BATCH_SIZE, log=None):
+        from app.api.v1.models.models import Document, DocumentField, DocumentHistory, StationDwellRollup, StationVisit
+        self.tenant_id = tenant_id
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.log = log or current_app.logger.info
+        self.documents = Document.__table__
+        self.history = DocumentHistory.__table__
+        self.fields = DocumentField.__table__
+        # Rebuilt on the target from the copied history; only removed from the source
+        self.rollups = (StationDwellRollup.__table__, StationVisit.__table__)
+    
+    def _ids_by_public_id(self, engine, table):
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.public_id, table.c.id).where(table.c.tenant_id == self.tenant_id)
+            ).all()
+        return dict(rows)
+    
+    def _versions(self, engine, table):
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.public_id, table.c.updated_at).where(table.c.tenant_id == self.tenant_id)
+            ).all()
+        return dict(rows)
+    
+    def _count(self, engine, table):
+        with engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(table).where(table.c.tenant_id == self.tenant_id)
+            ).scalar()
+    
+    def _stale(self, table):
+        """Public ids of source rows the target lacks or holds another version of"""
+        target = self._versions(self.target, table)
+        return {public_id for public_id, updated_at in self._versions(self.source, table).items()
+                if public_id not in target or target[public_id] != updated_at}
+    
+    def _upsert(self, table, since, remap=None, only=None):
+        """Copy rows changed since ``since`` (all rows if None); returns rows copied
+        
+        If ``only`` is given, rows whose public id is not in it are skipped.
+        """
+        existing = self._ids_by_public_id(self.target, table)
+        query = select(table).where(table.c.tenant_id == self.tenant_id).order_by(table.c.id)
+        if since is not None:
+            query = query.where(table.c.updated_at >= since)
+        
+        copied = 0
+        with self.source.connect() as src:
+            result = src.execution_options(stream_results=True).execute(query)
+            while True:
+                rows = result.mappings().fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if only is not None:
+                    rows = [row for row in rows if row['public_id'] in only]
+                with self.target.begin() as dst:
+                    for row in rows:
+                        values = {k: v for k, v in row.items() if k != 'id'}
+                        if remap:
+                            values = remap(values)
+                            if values is None:
+                                continue
+                        if row['public_id'] in existing:
+                            dst.execute(table.update()
+                                        .where(table.c.id == existing[row['public_id']])
+                                        .values(**values))
+                        else:
+                            dst.execute(table.insert().values(**values))
+                copied += len(rows)
+        return copied
+    
+    def _remap_document_ids(self):
+        """Build a function translating source document ids to target ids"""
+        source_ids = {v: k for k, v in self._ids_by_public_id(self.source, self.documents).items()}
+        target_ids = self._ids_by_public_id(self.target, self.documents)
+        
+        def remap(values):
+            # The document may have been deleted since it was copied
+            public_id = source_ids.get(values['document_id'])
+            if public_id not in target_ids:
+                return None
+            values['document_id'] = target_ids[public_id]
+            return values
+        return remap
+    
+    def copy_changes(self, since=None):
+        """One copy pass; returns the number of rows copied"""
+        copied = self._upsert(self.documents, since)
+        remap = self._remap_document_ids()
+        copied += self._upsert(self.history, since, remap)
+        copied += self._upsert(self.fields, since, remap)
+        return copied
+    
+    def reconcile(self):
+        """Copy every row that differs between source and target; returns the number of rows copied
+        
+        ``copy_changes`` trusts ``updated_at``, which is stamped at flush: a
+        transaction that flushed before a pass started but committed after it
+        read is missed. This compares every row instead, so run it once the
+        tenant's writes are frozen.
+        """
+        copied = self._upsert(self.documents, None, only=self._stale(self.documents))
+        remap = self._remap_document_ids()
+        copied += self._upsert(self.history, None, remap, only=self._stale(self.history))
+        copied += self._upsert(self.fields, None, remap, only=self._stale(self.fields))
+        self.remove_deleted()
+        return copied
+    
+    def verify(self):
+        """Raise RuntimeError unless the target holds as many of the tenant's rows as the source"""
+        for table in (self.documents, self.history, self.fields):
+            source, target = self._count(self.source, table), self._count(self.target, table)
+            if source != target:
+                raise RuntimeError(f'{table.name}: {source} rows on the source but {target} on the target')
+    
+    def remove_deleted(self):
+        """Delete target rows whose source rows were deleted during the move"""
+        for table in (self.fields, self.history, self.documents):
+            gone = set(self._ids_by_public_id(self.target, table)) - set(self._ids_by_public_id(self.source, table))
+            if gone:
+                with self.target.begin() as dst:
+                    dst.execute(table.delete().where(table.c.public_id.in_(gone)))
+    
+    def purge_source(self):
+        """Delete the tenant's rows from the old shard"""
+        with self.source.begin() as src:
+            for table in self.rollups:
+                src.execute(table.delete().where(table.c.tenant_id == self.tenant_id))
+            src.execute(self.fields.delete().where(self.fields.c.tenant_id == self.tenant_id))
+            src.execute(self.history.delete().where(self.history.c.tenant_id == self.tenant_id))
+            src.execute(self.documents.delete().where(self.documents.c.tenant_id == self.tenant_id))
+
+
+def _set_mapping(tenant_id, shard, state):
+    from app.api.v1.models.models import TenantShard
+    mapping = TenantShard.query.filter_by(tenant_id=tenant_id).first()
+    if mapping is None:
+        mapping = TenantShard(tenant_id=tenant_id)
+    mapping.shard = shard
+    mapping.state = state
+    mapping.save()
+    shard_map.invalidate()
+
+
+def move_tenant(tenant_id, target_shard, batch_size=DEFAULT_BATCH_SIZE, catch_up_passes=3, log=None):
+    """Move a tenant to ``target_shard`` while it keeps serving traffic"""
+    log = log or current_app.logger.info
+    from app.api.v1.models.models import TenantShard
+    
+    mapping = TenantShard.query.filter_by(tenant_id=tenant_id).first()
+    source_shard = mapping.shard if mapping else PRIMARY
+    if source_shard == target_shard:
+        log(f'{tenant_id} is already on {target_shard}')
+        return
+    
+    source, target = shard_engine(source_shard), shard_engine(target_shard)
+    create_shard_tables(target)
+    mover = TenantMover(tenant_id, source, target, batch_size, log)
+    
+    # Bulk copy, then catch up on whatever changed while we were copying
+    since = None
+    for attempt in range(catch_up_passes + 1):
+        started = datetime.utcnow() - timedelta(seconds=1)
+        copied = mover.copy_changes(since)
+        log(f'pass {attempt}: copied {copied} rows')
+        since = started
+        if attempt and copied < batch_size:
+            break
+    
+    # Freeze writes long enough for every worker to see it, then compare everything
+    _set_mapping(tenant_id, source_shard, MOVING)
+    refresh = current_app.config.get('TENANT_SHARD_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    time.sleep(refresh)
+    try:
+        log(f'final pass: copied {mover.reconcile()} rows')
+        mover.verify()
+    except Exception:
+        _set_mapping(tenant_id, source_shard, ACTIVE)
+        raise
+    _set_mapping(tenant_id, target_shard, ACTIVE)
+    
+    # Workers may still read the old shard until their map refreshes
+    time.sleep(refresh)
+    mover.purge_source()
+    log(f'{tenant_id} moved from {source_shard} to {target_shard}')
+
+
+def init_sharding(app):
+    """Answer writes during a tenant move with 503"""
+    
+    @app.errorhandler(TenantMovingError)
+    def tenant_moving(err):
+        return jsonify({"error": "Tenant is being moved, please retry"}), 503, {'Retry-After': '5'}
+
+
+event.listen(RoutingSession, 'before_flush', guard_tenant_writes)
+
+
+@click.group('tenants')
+def tenants_cli():
+    """Tenant sharding commands"""
+
+
+@tenants_cli.command('list')
+@with_appcontext
+def list_command():
+    """Show each tenant's shard and document count"""
+    from app.api.v1.models.models import Document, TenantShard
+    mappings = {m.tenant_id: m for m in TenantShard.query.all()}
+    table = Document.__table__
+    
+    for engine in all_shard_engines():
+        with engine.connect() as conn:
+            counts = conn.execute(
+                select(table.c.tenant_id, func.count()).group_by(table.c.tenant_id)
+            ).all()
+        for tenant_id, count in counts:
+            mapping = mappings.get(tenant_id)
+            shard = mapping.shard if mapping else PRIMARY
+            state = mapping.state if mapping else ACTIVE
+            click.echo(f'{tenant_id or "-"}\t{shard}\t{state}\t{count} documents\t({engine.url!r})')
+
+
+@tenants_cli.command('assign-user')
+@click.argument('username')
+@click.argument('tenant_id')
+@with_appcontext
+def assign_user_command(username, tenant_id):
+    """Put a user in a tenant (takes effect at their next login)"""
+    from app.api.v1.models.models import User
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username}')
+    user.tenant_id = tenant_id
+    user.save()
+    click.echo(f'{username} -> {tenant_id}')
+
+
+@tenants_cli.command('move')
+@click.argument('tenant_id')
+@click.argument('target_shard')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+@with_appcontext
+def move_command(tenant_id, target_shard, batch_size):
+    """Move a tenant to another shard online"""
+    if target_shard != PRIMARY and bind_for_shard(target_shard) not in shard_keys(current_app):
+        raise click.ClickException(f'Unknown shard {target_shard}')
+    move_tenant(tenant_id, target_shard, batch_size, log=click.echo)
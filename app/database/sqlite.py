@@ -0,0 +1,142 @@
+"""SQLite production profile.
+
+Small deployments run on the default SQLite file with several gunicorn
+workers, where the rollback journal turns every concurrent write into
+"database is locked". With ``SQLITE_PROFILE=production`` every connection
+switches to WAL (readers no longer block the writer), ``synchronous=NORMAL``,
+a busy timeout, and larger mmap/page cache sizes. Writes made through
+``Base.save``/``Base.delete`` are funnelled through a per-process lock so
+threads of one worker never race each other for the write lock. When the
+saved object is all the transaction writes, they are retried with backoff
+while another process holds it.
+"""
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import OperationalError
+
+from app.database.routing import RoutingSession
+
+PRODUCTION = 'production'
+
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE = -64 * 1024  # negative means KiB, i.e. 64 MiB
+DEFAULT_WRITE_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 0.05
+
+_write_lock = threading.RLock()
+
+
+def is_production_profile(config):
+    """Check if the SQLite production profile applies to this app"""
+    return (config.get('SQLITE_PROFILE') == PRODUCTION
+            and config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'))
+
+
+def production_pragmas(config):
+    """PRAGMA statements run on every new connection"""
+    return (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS))}",
+        f"PRAGMA mmap_size={int(config.get('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE))}",
+        f"PRAGMA cache_size={int(config.get('SQLITE_CACHE_SIZE', DEFAULT_CACHE_SIZE))}",
+        'PRAGMA temp_store=MEMORY',
+    )
+
+
+def configure_sqlite(engine, config):
+    """Install the production pragmas on an engine's connections"""
+    pragmas = production_pragmas(config)
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _is_lock_error(err):
+    message = str(err.orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def _column_changes(instance):
+    """Uncommitted column values, which a rollback would throw away"""
+    state = inspect(instance)
+    if not state.persistent:
+        return {}
+    return {
+        attr.key: getattr(instance, attr.key)
+        for attr in state.mapper.column_attrs
+        if state.attrs[attr.key].history.has_changes()
+    }
+
+
+def note_write(orm_execute_state):
+    """Remember bulk ``query.update()``/``delete()`` calls, which leave no pending objects behind"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['sqlite_wrote'] = True
+
+
+def note_flush(session, flush_context):
+    session.info['sqlite_wrote'] = True
+
+
+def forget_writes(session):
+    session.info.pop('sqlite_wrote', None)
+
+
+def _only_change(session, instance):
+    """Check that the transaction holds no writes besides those ``apply`` makes for ``instance``
+    
+    A rollback loses everything else in the transaction, so only then can the
+    commit be retried by re-applying ``instance`` alone.
+    """
+    if session.info.get('sqlite_wrote'):
+        return False
+    pending = set(session.new) | set(session.dirty) | set(session.deleted)
+    return pending <= {instance}
+
+
+def serialized_commit(session, apply, instance):
+    """Run ``apply`` then commit, serialized per process and retried on lock errors
+    
+    Retries only happen when ``instance`` is the whole unit of work. Otherwise
+    the commit is tried once (SQLite still waits ``busy_timeout`` for the lock).
+    """
+    config = current_app.config
+    if not is_production_profile(config):
+        apply()
+        session.commit()
+        return
+    
+    retries = config.get('SQLITE_WRITE_RETRIES', DEFAULT_WRITE_RETRIES) if _only_change(session, instance) else 0
+    for attempt in range(retries + 1):
+        with _write_lock:
+            changes = _column_changes(instance)
+            apply()
+            try:
+                session.commit()
+                return
+            except OperationalError as err:
+                session.rollback()
+                if not _is_lock_error(err) or attempt == retries:
+                    raise
+            
+            # Rollback expired the instance; put its changes back before retrying
+            for key, value in changes.items():
+                setattr(instance, key, value)
+        # Back off without the lock, so this worker's other threads can write meanwhile
+        time.sleep(DEFAULT_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random()))
+
+
+event.listen(RoutingSession, 'do_orm_execute', note_write)
+event.listen(RoutingSession, 'after_flush', note_flush)
+event.listen(RoutingSession, 'after_commit', forget_writes)
+event.listen(RoutingSession, 'after_rollback', forget_writes)
@@ -0,0 +1,352 @@
+"""Time-in-station rollups maintained from ``document_history``.
+
+A document's visit to a station starts with the history entry that puts
+it there and ends with the next entry that shows it somewhere else.
+Entries that leave the station unchanged (edits, status changes) are
+ignored. ``refresh`` reads only the history written since the last run.
+A window query (``LAG`` of ``station_id`` per document) keeps just the
+station changes. Finished visits go into ``station_dwell_rollups``, and
+the visit each document is in now goes into ``station_visits``.
+
+Rollups are histograms with four buckets per doubling of the dwell time,
+per tenant and station. Counts and means are exact. Percentiles are read
+off the histogram and are within about 10% of the true value.
+``GET /api/v1/analytics/stations`` therefore costs the same however long
+the history is. It serves the rollups as they are and reports when they
+were refreshed. Rollups older than ``ANALYTICS_REFRESH_SECONDS`` get an
+``analytics.refresh`` background job queued, by whichever read first wins
+a conditional update of ``analytics_state``; ``flask analytics refresh``
+from cron does the same work.
+
+Each database (primary and every shard) keeps its own rollups next to its
+history. ``refresh`` claims the range of history ids it reads with a
+conditional update of ``analytics_state``, so two workers refreshing at
+once never count a visit twice. Ids are handed out before commit, so a
+transaction that commits late can leave an id below the range already
+read. Ids missing from a claimed range are therefore noted in
+``analytics_gaps``, and each refresh first folds in the noted ids that
+have since appeared. A late row is skipped if a later row of the same
+document was already read: the visits it would have split are counted
+already, and applying it would reopen a station the document has left. A
+gap still empty after ``DEFAULT_GAP_SECONDS`` was a rollback or a deleted
+document and is forgotten.
+"""
+import math
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.database.change_log import change_sources
+from app.jobs.queue import enqueue, job_handler
+
+STATE_NAME = 'station_dwell'
+REFRESH_ROLLUPS = 'analytics.refresh'
+BUCKETS_PER_DOUBLING = 4
+DEFAULT_GAP_SECONDS = 600
+# A longer run of missing ids is deleted history, not transactions still in flight
+MAX_GAP_RUN = 1000
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_REFRESH_SECONDS = 60
+PERCENTILES = (50, 90)
+
+
+def bucket_for(seconds):
+    """Histogram bucket of a dwell time"""
+    return int(BUCKETS_PER_DOUBLING * math.log2(seconds)) if seconds > 1 else 0
+
+
+def bucket_value(bucket):
+    """Representative dwell time of a bucket (its geometric midpoint)"""
+    return 2 ** ((bucket + 0.5) / BUCKETS_PER_DOUBLING)
+
+
+def _tables():
+    from app.api.v1.models.models import AnalyticsState, DocumentHistory, StationDwellRollup, StationVisit
+    return (DocumentHistory.__table__, StationDwellRollup.__table__, StationVisit.__table__,
+            AnalyticsState.__table__)
+
+
+def _gaps():
+    from app.api.v1.models.models import AnalyticsGap
+    return AnalyticsGap.__table__
+
+
+def _ensure_state(conn, state):
+    """Create the state row unless another refresher or reader created it first"""
+    try:
+        with conn.begin_nested():
+            conn.execute(state.insert().values(name=STATE_NAME, last_history_id=0))
+    except IntegrityError:
+        pass
+
+
+def _claim(conn, state, batch_size):
+    """Move the watermark over the next batch of history; returns ``(start, end)`` or None
+    
+    Ids in the batch's range that are not visible yet are noted as gaps.
+    """
+    history = _tables()[0]
+    row = conn.execute(select(state.c.last_history_id).where(state.c.name == STATE_NAME)).first()
+    if row is None:
+        _ensure_state(conn, state)
+        start = 0
+    else:
+        start = row.last_history_id
+    # Ids can have gaps (deleted documents take their history), so count rows rather than ids
+    ids = conn.execute(
+        select(history.c.id).where(history.c.id > start).order_by(history.c.id).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        conn.execute(update(state).where(state.c.name == STATE_NAME).values(refreshed_at=datetime.utcnow()))
+        return None
+    claimed = conn.execute(
+        update(state).where(state.c.name == STATE_NAME, state.c.last_history_id == start)
+        .values(last_history_id=ids[-1], refreshed_at=datetime.utcnow())
+    ).rowcount
+    if not claimed:
+        return None
+    _note_gaps(conn, start, ids)
+    return start, ids[-1]
+
+
+def _note_gaps(conn, start, ids):
+    """Record the ids missing between ``start`` and the sorted ``ids``"""
+    now = datetime.utcnow()
+    missing = []
+    previous = start
+    for history_id in ids:
+        if 1 < history_id - previous <= MAX_GAP_RUN:
+            missing.extend(range(previous + 1, history_id))
+        previous = history_id
+    if missing:
+        conn.execute(_gaps().insert(), [
+            {'name': STATE_NAME, 'history_id': history_id, 'noted_at': now} for history_id in missing
+        ])
+
+
+def _fold_late_history(conn, gap_seconds):
+    """Fold in history that committed after its id was passed over; returns finished visits added"""
+    history, rollups, visits, state = _tables()
+    gaps = _gaps()
+    mine = gaps.c.name == STATE_NAME
+    conn.execute(gaps.delete().where(mine, gaps.c.noted_at < datetime.utcnow() - timedelta(seconds=gap_seconds)))
+    late = conn.execute(
+        select(history.c.id).where(history.c.id.in_(select(gaps.c.history_id).where(mine)))
+    ).scalars().all()
+    if not late:
+        return 0
+    # Whoever deletes the gaps folds the rows in, so two refreshers never both count them
+    with conn.begin_nested() as savepoint:
+        taken = conn.execute(gaps.delete().where(mine, gaps.c.history_id.in_(late))).rowcount
+        if taken != len(late):
+            savepoint.rollback()
+            return 0
+    # Rows already read that come after a late row, in the order visits are built
+    watermark = conn.execute(select(state.c.last_history_id).where(state.c.name == STATE_NAME)).scalar() or 0
+    newer = history.alias('newer')
+    superseded = exists().where(
+        newer.c.document_id == history.c.document_id,
+        newer.c.id <= watermark,
+        newer.c.id.notin_(late),
+        or_(newer.c.created_at > history.c.created_at,
+            and_(newer.c.created_at == history.c.created_at, newer.c.id > history.c.id)),
+    )
+    changes = conn.execute(_station_changes(history, and_(history.c.id.in_(late), ~superseded))).all()
+    return _apply(conn, rollups, visits, changes)
+
+
+def _station_changes(history, criterion):
+    """History rows matching ``criterion`` that put a document in a different station than its previous row"""
+    order = (history.c.created_at, history.c.id)
+    rows = select(
+        history.c.document_id, history.c.station_id, history.c.created_at, history.c.tenant_id,
+        func.lag(history.c.station_id).over(partition_by=history.c.document_id, order_by=order)
+        .label('previous_station_id'),
+        func.row_number().over(partition_by=history.c.document_id, order_by=order).label('position'),
+    ).where(criterion).subquery()
+    # The first row of a document in the batch is compared with its open visit instead
+    return select(rows).where(or_(
+        rows.c.position == 1, rows.c.station_id.is_distinct_from(rows.c.previous_station_id)
+    )).order_by(rows.c.document_id, rows.c.created_at)
+
+
+def _apply(conn, rollups, visits, changes):
+    """Close and open visits for ``changes``; add finished visits to the histograms"""
+    document_ids = sorted({row.document_id for row in changes})
+    open_visits = {}
+    for offset in range(0, len(document_ids), 500):
+        chunk = document_ids[offset:offset + 500]
+        for visit in conn.execute(select(visits).where(visits.c.document_id.in_(chunk))):
+            open_visits[visit.document_id] = (visit.station_id, visit.entered_at, visit.tenant_id)
+    
+    finished = {}
+    for row in changes:
+        visit = open_visits.get(row.document_id)
+        if visit is not None and visit[0] == row.station_id:
+            continue
+        if visit is not None:
+            station_id, entered_at, tenant_id = visit
+            seconds = max(0.0, (row.created_at - entered_at).total_seconds())
+            count, total = finished.get((tenant_id, station_id, bucket_for(seconds)), (0, 0.0))
+            finished[(tenant_id, station_id, bucket_for(seconds))] = (count + 1, total + seconds)
+        open_visits[row.document_id] = (row.station_id, row.created_at, row.tenant_id) \
+            if row.station_id is not None else None
+    
+    for offset in range(0, len(document_ids), 500):
+        conn.execute(visits.delete().where(visits.c.document_id.in_(document_ids[offset:offset + 500])))
+    now_open = [
+        {'document_id': document_id, 'station_id': visit[0], 'entered_at': visit[1], 'tenant_id': visit[2]}
+        for document_id, visit in open_visits.items() if visit is not None
+    ]
+    if now_open:
+        conn.execute(visits.insert(), now_open)
+    
+    for (tenant_id, station_id, bucket), (count, total) in finished.items():
+        key = and_(rollups.c.tenant_id.is_(None) if tenant_id is None else rollups.c.tenant_id == tenant_id,
+                   rollups.c.station_id == station_id, rollups.c.bucket == bucket)
+        updated = conn.execute(update(rollups).where(key).values(
+            count=rollups.c.count + count, total_seconds=rollups.c.total_seconds + total
+        )).rowcount
+        if not updated:
+            conn.execute(rollups.insert().values(tenant_id=tenant_id, station_id=station_id, bucket=bucket,
+                                                 count=count, total_seconds=total))
+    return sum(count for count, _ in finished.values())
+
+
+def refresh(engine, batch_size=DEFAULT_BATCH_SIZE, gap_seconds=DEFAULT_GAP_SECONDS):
+    """Fold history written since the last refresh into the rollups; returns finished visits added"""
+    history, rollups, visits, state = _tables()
+    documents = db.Model.metadata.tables['documents']
+    with engine.begin() as conn:
+        added = _fold_late_history(conn, gap_seconds)
+    while True:
+        with engine.begin() as conn:
+            claimed = _claim(conn, state, batch_size)
+            if claimed is None:
+                break
+            start, end = claimed
+            changes = conn.execute(
+                _station_changes(history, and_(history.c.id > start, history.c.id <= end))
+            ).all()
+            added += _apply(conn, rollups, visits, changes)
+    # Deleted documents take their history with them; forget their visits
+    with engine.begin() as conn:
+        conn.execute(visits.delete().where(~exists().where(documents.c.id == visits.c.document_id)))
+    return added
+
+
+def rebuild(engine, batch_size=DEFAULT_BATCH_SIZE):
+    """Drop the rollups and recompute them from the whole history"""
+    _, rollups, visits, state = _tables()
+    with engine.begin() as conn:
+        for table in (rollups, visits):
+            conn.execute(table.delete())
+        conn.execute(_gaps().delete().where(_gaps().c.name == STATE_NAME))
+        conn.execute(state.delete().where(state.c.name == STATE_NAME))
+    return refresh(engine, batch_size)
+
+
+def last_refreshed(engine):
+    """When the rollups on ``engine`` were last refreshed, or None"""
+    state = _tables()[3]
+    with engine.connect() as conn:
+        return conn.execute(select(state.c.refreshed_at).where(state.c.name == STATE_NAME)).scalar()
+
+
+def queue_refresh_if_stale(engine, max_age_seconds=DEFAULT_REFRESH_SECONDS):
+    """Queue a background refresh if the rollups on ``engine`` are stale and no read queued one lately
+    
+    The read that moves ``refresh_queued_at`` forward with a conditional
+    update is the only one to queue the job.
+    """
+    state = _tables()[3]
+    stale = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    with engine.connect() as conn:
+        row = conn.execute(select(state.c.refreshed_at).where(state.c.name == STATE_NAME)).first()
+    if row is not None and row.refreshed_at is not None and row.refreshed_at >= stale:
+        return None
+    with engine.begin() as conn:
+        if row is None:
+            _ensure_state(conn, state)
+        queued = conn.execute(
+            update(state).where(
+                state.c.name == STATE_NAME,
+                or_(state.c.refreshed_at.is_(None), state.c.refreshed_at < stale),
+                or_(state.c.refresh_queued_at.is_(None), state.c.refresh_queued_at < stale),
+            ).values(refresh_queued_at=datetime.utcnow())
+        ).rowcount
+    return enqueue(REFRESH_ROLLUPS) if queued else None
+
+
+@job_handler(REFRESH_ROLLUPS)
+def refresh_job(context):
+    """Refresh the rollups on every database; returns finished visits added per database"""
+    sources = change_sources(current_app)
+    added = {}
+    for done, (name, bind) in enumerate(sources):
+        added[name] = refresh(db.get_engine(current_app, bind))
+        context.progress((done + 1) / len(sources), f'{name} refreshed')
+    return added
+
+
+def summarize(buckets):
+    """Count, mean and percentiles from ``[(bucket, count, total_seconds)]``"""
+    count = sum(bucket_count for _, bucket_count, _ in buckets)
+    summary = {'completed': count, 'mean_seconds': None}
+    summary.update({f'p{percentile}_seconds': None for percentile in PERCENTILES})
+    if not count:
+        return summary
+    summary['mean_seconds'] = round(sum(total for _, _, total in buckets) / count, 1)
+    ordered = sorted(buckets)
+    for percentile in PERCENTILES:
+        rank, seen = math.ceil(count * percentile / 100), 0
+        for bucket, bucket_count, _ in ordered:
+            seen += bucket_count
+            if seen >= rank:
+                summary[f'p{percentile}_seconds'] = round(bucket_value(bucket), 1)
+                break
+    return summary
+
+
+def station_histograms(engine, tenant_id):
+    """``({station_id: [(bucket, count, total_seconds)]}, {station_id: documents there now})`` for a tenant"""
+    _, rollups, visits, _ = _tables()
+    tenant_rollups = rollups.c.tenant_id.is_(None) if tenant_id is None else rollups.c.tenant_id == tenant_id
+    tenant_visits = visits.c.tenant_id.is_(None) if tenant_id is None else visits.c.tenant_id == tenant_id
+    with engine.connect() as conn:
+        histograms = {}
+        for row in conn.execute(select(rollups.c.station_id, rollups.c.bucket, rollups.c.count,
+                                       rollups.c.total_seconds).where(tenant_rollups)):
+            histograms.setdefault(row.station_id, []).append((row.bucket, row.count, row.total_seconds))
+        current = dict(conn.execute(
+            select(visits.c.station_id, func.count()).where(tenant_visits).group_by(visits.c.station_id)
+        ).all())
+    return histograms, current
+
+
+@click.group('analytics')
+def analytics_cli():
+    """Analytics rollup commands"""
+
+
+@analytics_cli.command('refresh')
+@with_appcontext
+def refresh_command():
+    """Fold new document history into the station dwell rollups (every database)"""
+    for name, bind in change_sources(current_app):
+        added = refresh(db.get_engine(current_app, bind))
+        click.echo(f'{name}: {added} finished station visits added')
+
+
+@analytics_cli.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recompute the station dwell rollups from the whole history (every database)"""
+    for name, bind in change_sources(current_app):
+        added = rebuild(db.get_engine(current_app, bind))
+        click.echo(f'{name}: {added} finished station visits')
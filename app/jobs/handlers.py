@@ -0,0 +1,105 @@
+"""Built-in job handlers for heavy document operations.
+
+Both handlers work in keyset-paginated batches. Each batch is committed
+before progress is reported, which keeps memory flat and lets a cancel
+request stop the job between batches.
+"""
+import json
+import os
+
+from app import db
+from app.api.v1.models.models import Document, DocumentHistory
+from app.api.v1.schemas.schemas import DocumentSchema
+from app.api.v1.utils.station_events import document_events, publish_events
+from app.database.sharding import current_tenant
+from app.jobs.queue import job_handler
+
+EXPORT_DOCUMENTS = 'documents.export'
+BULK_TRANSITION = 'documents.bulk_transition'
+EXPORT_BATCH = 1000
+TRANSITION_BATCH = 100
+
+# Nested template/station would lazy-load once per document
+export_schema = DocumentSchema(exclude=('template', 'current_station'))
+
+
+@job_handler(EXPORT_DOCUMENTS)
+def export_documents(context, status=None, template_id=None, station_id=None):
+    """Write the caller's documents matching the filters to an NDJSON file"""
+    query = Document.query.filter_by(tenant_id=current_tenant())
+    if status:
+        query = query.filter_by(status=status)
+    if template_id:
+        query = query.filter_by(template_id=template_id)
+    if station_id:
+        query = query.filter_by(current_station_id=station_id)
+    total = query.count()
+    
+    path = context.path('.ndjson')
+    written, last_id = 0, 0
+    # Written to a temporary name first, so a retried or cancelled export never leaves a partial file
+    with open(path + '.part', 'w', encoding='utf-8') as out:
+        while True:
+            batch = query.filter(Document.id > last_id).order_by(Document.id).limit(EXPORT_BATCH).all()
+            if not batch:
+                break
+            for document in batch:
+                out.write(json.dumps(export_schema.dump(document)) + '\n')
+            written += len(batch)
+            last_id = batch[-1].id
+            db.session.expunge_all()
+            context.progress(written / total if total else 1.0, f'{written} of {total} documents')
+    os.replace(path + '.part', path)
+    return {'count': written, 'file': os.path.basename(path), 'mimetype': 'application/x-ndjson'}
+
+
+@job_handler(BULK_TRANSITION)
+def bulk_transition(context, document_ids, changes, user_id=None):
+    """Apply ``changes`` (status and/or current_station_id) to many documents
+    
+    Documents already in the requested state are skipped, so a retried job
+    does not write duplicate history entries.
+    """
+    tenant = current_tenant()
+    updated, unchanged, missing = 0, 0, []
+    for start in range(0, len(document_ids), TRANSITION_BATCH):
+        public_ids = document_ids[start:start + TRANSITION_BATCH]
+        documents = {
+            document.public_id: document
+            for document in Document.query.filter(Document.public_id.in_(public_ids),
+                                                  Document.tenant_id == tenant)
+        }
+        moves = []
+        for public_id in public_ids:
+            document = documents.get(public_id)
+            if document is None:
+                missing.append(public_id)
+                continue
+            if all(getattr(document, key) == value for key, value in changes.items()):
+                unchanged += 1
+                continue
+            old_station_id = document.current_station_id
+            for key, value in changes.items():
+                setattr(document, key, value)
+            moved = old_station_id != document.current_station_id
+            db.session.add(DocumentHistory(
+                document_id=document.id,
+                action='moved' if moved else 'updated',
+                description='Moved by bulk transition' if moved else 'Updated by bulk transition',
+                user_id=user_id,
+                station_id=document.current_station_id,
+                tenant_id=document.tenant_id
+            ))
+            moves.append((document, old_station_id))
+        # Build the events between flush and commit, while the documents are still loaded
+        db.session.flush()
+        events = [event for document, old_station_id in moves
+                  for event in document_events(document, 'updated', previous_station_id=old_station_id)]
+        db.session.commit()
+        publish_events(events)
+        updated += len(moves)
+        db.session.expunge_all()
+        
+        done = min(start + TRANSITION_BATCH, len(document_ids))
+        context.progress(done / len(document_ids), f'{done} of {len(document_ids)} documents')
+    return {'updated': updated, 'unchanged': unchanged, 'missing': missing}
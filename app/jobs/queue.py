@@ -0,0 +1,360 @@
+"""Background jobs backed by the ``jobs`` table.
+
+Long-running API operations (exports, bulk transitions) queue a job and
+answer ``202 Accepted`` with its id instead of running inside the request.
+``flask jobs worker`` starts worker processes that claim queued jobs and run
+the registered handler for each one:
+
+- Claiming is a conditional ``UPDATE ... WHERE status = 'queued'``, so two
+  workers never run the same job, on SQLite or on a server database. A
+  running job holds a lease of ``JOBS_LEASE_SECONDS``. Every progress report
+  renews it, and jobs whose lease ran out because their worker died are
+  queued again. A worker only writes progress and the outcome while it
+  still holds the lease, so a worker that stalled past its lease cannot
+  overwrite the job once another worker has claimed it.
+- A handler that raises is retried with exponential backoff
+  (``JOBS_RETRY_BACKOFF_SECONDS`` doubled per attempt, with jitter) until
+  ``max_attempts`` is used up.
+- Handlers report progress with ``context.progress(fraction, message)``.
+  Cancelling a running job takes effect at its next progress report.
+- Jobs run with the tenant that queued them as ``g.tenant``, so sharded
+  documents are read from and written to the right shard.
+
+Concurrency is the number of worker processes (``--processes``). Results
+that do not fit in a JSON column, such as export files, are written under
+``JOBS_DIR`` and streamed by ``GET /api/v1/jobs/<id>/result``.
+"""
+import json
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+from sqlalchemy import update
+
+from app import db
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 600
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_POLL_SECONDS = 1
+CLAIM_CANDIDATES = 10
+
+handlers = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled"""
+
+
+class LeaseLost(JobCancelled):
+    """Raised inside a handler when its lease ran out and the job was queued again or claimed elsewhere"""
+
+
+def job_handler(kind):
+    """Register the decorated function as the handler for jobs of ``kind``
+    
+    Handlers are called as ``handler(context, **params)`` and return a
+    JSON-serializable result.
+    """
+    def decorator(fn):
+        handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def jobs_dir(app):
+    return app.config.get('JOBS_DIR') or os.path.join(app.instance_path, 'jobs')
+
+
+def enqueue(kind, params=None, created_by=None, tenant_id=None, max_attempts=None):
+    """Queue a job and return it"""
+    from app.api.v1.models.models import Job
+    
+    if kind not in handlers:
+        raise ValueError(f'No handler registered for job kind {kind!r}')
+    job = Job(
+        kind=kind,
+        params=json.dumps(params or {}),
+        created_by=created_by,
+        tenant_id=tenant_id,
+        max_attempts=max_attempts or current_app.config.get('JOBS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    )
+    job.save()
+    return job
+
+
+def cancel(job):
+    """Cancel a queued job now, or ask a running one to stop; returns False if it already finished"""
+    from app.api.v1.models.models import Job
+    
+    if job.status in FINISHED:
+        return False
+    # Conditional update, so a worker claiming the job at the same moment cannot be overwritten
+    cancelled = db.session.execute(
+        update(Job).where(Job.id == job.id, Job.status == QUEUED)
+        .values(status=CANCELLED, finished_at=datetime.utcnow())
+    ).rowcount
+    if not cancelled:
+        db.session.execute(update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+    db.session.refresh(job)
+    return True
+
+
+class JobContext:
+    """Handed to a handler: progress reporting, cancellation and the job's files"""
+    
+    def __init__(self, app, job):
+        self.app = app
+        self.job_id = job.id
+        self.public_id = job.public_id
+        self.attempt = job.attempts
+        self.worker_id = job.locked_by
+        self._lease = app.config.get('JOBS_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    
+    def progress(self, fraction, message=None):
+        """Record progress, renew the lease and raise ``JobCancelled`` if the job was cancelled
+        
+        Raises ``LeaseLost`` if this worker no longer holds the job. Call it
+        between batches, after committing, because it uses its own
+        transaction.
+        """
+        from app.api.v1.models.models import Job
+        table = Job.__table__
+        
+        with db.engine.begin() as conn:
+            renewed = conn.execute(table.update().where(
+                table.c.id == self.job_id, table.c.locked_by == self.worker_id
+            ).values(
+                progress=max(0.0, min(1.0, fraction)),
+                progress_message=message,
+                locked_until=datetime.utcnow() + timedelta(seconds=self._lease),
+            )).rowcount
+            if not renewed:
+                raise LeaseLost()
+            cancel_requested = conn.execute(
+                table.select().with_only_columns(table.c.cancel_requested).where(table.c.id == self.job_id)
+            ).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+    
+    def path(self, suffix):
+        """File for this job's output under ``JOBS_DIR``"""
+        directory = jobs_dir(self.app)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'{self.public_id}{suffix}')
+
+
+def requeue_expired(now):
+    """Put running jobs whose worker stopped renewing the lease back in the queue
+    
+    A job that keeps killing its worker fails once its attempts are used up.
+    """
+    from app.api.v1.models.models import Job
+    
+    expired = (Job.status == RUNNING, Job.locked_until < now)
+    db.session.execute(
+        update(Job).where(*expired, Job.attempts >= Job.max_attempts)
+        .values(status=FAILED, error='Worker stopped while running the job', locked_by=None,
+                locked_until=None, finished_at=now)
+    )
+    db.session.execute(
+        update(Job).where(*expired)
+        .values(status=QUEUED, locked_by=None, locked_until=None, run_after=now)
+    )
+    db.session.commit()
+
+
+def claim_next(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Claim the next due job for ``worker_id``, or None if there is none"""
+    from app.api.v1.models.models import Job
+    
+    now = datetime.utcnow()
+    requeue_expired(now)
+    candidates = db.session.query(Job.id) \
+        .filter(Job.status == QUEUED, Job.run_after <= now) \
+        .order_by(Job.run_after, Job.id).limit(CLAIM_CANDIDATES).all()
+    for (job_id,) in candidates:
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == QUEUED).values(
+                status=RUNNING,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=lease_seconds),
+                started_at=now,
+                attempts=Job.attempts + 1,
+            )
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def retry_delay(attempts, base):
+    """Exponential backoff with jitter for the attempt that just failed"""
+    return min(MAX_BACKOFF_SECONDS, base * 2 ** (attempts - 1)) * (0.5 + random.random() / 2)
+
+
+def run_job(app, job):
+    """Run a claimed job and record how it ended
+    
+    The outcome is written only if the job is still leased to the worker
+    that claimed it; otherwise it is dropped and the job is left to its new
+    owner. Returns the job as stored.
+    """
+    from app.api.v1.models.models import Job
+    
+    handler = handlers.get(job.kind)
+    context = JobContext(app, job)
+    # Handlers may commit and reset the session, after which ``job`` cannot be read
+    max_attempts = job.max_attempts
+    g.tenant = job.tenant_id
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job kind {job.kind!r}')
+        result = handler(context, **job.get_params())
+    except JobCancelled:
+        db.session.rollback()
+        outcome = {'status': CANCELLED}
+    except Exception:
+        db.session.rollback()
+        outcome = {'error': traceback.format_exc(limit=5)}
+        if context.attempt < max_attempts and handler is not None:
+            delay = retry_delay(context.attempt, app.config.get('JOBS_RETRY_BACKOFF_SECONDS', DEFAULT_BACKOFF_SECONDS))
+            outcome.update(status=QUEUED, run_after=datetime.utcnow() + timedelta(seconds=delay))
+        else:
+            outcome['status'] = FAILED
+    else:
+        outcome = {'status': SUCCEEDED, 'result': json.dumps(result), 'progress': 1.0, 'error': None}
+    finally:
+        g.pop('tenant', None)
+    
+    if outcome['status'] in FINISHED:
+        outcome['finished_at'] = datetime.utcnow()
+    # Conditional on the lease, like claiming: a worker that stalled past it must not overwrite the new owner
+    recorded = db.session.execute(
+        update(Job).where(Job.id == context.job_id, Job.status == RUNNING, Job.locked_by == context.worker_id)
+        .values(locked_by=None, locked_until=None, **outcome)
+    ).rowcount
+    db.session.commit()
+    if not recorded:
+        app.logger.warning('Job %s: lease lost, dropped the %s outcome of worker %s',
+                           context.public_id, outcome['status'], context.worker_id)
+    return Job.query.get(context.job_id)
+
+
+def run_next(app, worker_id):
+    """Claim and run one job; returns it, or None if the queue was empty"""
+    job = claim_next(worker_id, app.config.get('JOBS_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+    if job is None:
+        return None
+    return run_job(app, job)
+
+
+def work(app, worker_id, burst=False):
+    """Run jobs until SIGTERM/SIGINT (or, with ``burst``, until the queue is empty)"""
+    stopping = []
+    
+    def stop(signum, frame):
+        # Finish the current job, then exit
+        stopping.append(signum)
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    poll = app.config.get('JOBS_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+    with app.app_context():
+        while not stopping:
+            try:
+                job = run_next(app, worker_id)
+            finally:
+                # Start each job with an empty identity map
+                db.session.remove()
+            if job is None:
+                if burst:
+                    return
+                time.sleep(poll)
+
+
+def start_workers(app, processes, burst=False):
+    """Fork ``processes`` workers and wait for them; SIGTERM/SIGINT stops them all"""
+    hostname = socket.gethostname()
+    children = []
+    for number in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                work(app, f'{hostname}:{os.getpid()}:{number}', burst)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+    
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Background job commands"""
+
+
+@jobs_cli.command('worker')
+@click.option('--processes', default=1, show_default=True, help='jobs run at most this many at a time')
+@click.option('--burst', is_flag=True, help='exit once the queue is empty')
+@with_appcontext
+def worker_command(processes, burst):
+    """Run queued jobs"""
+    from app.jobs import handlers  # noqa: F401 - registers the built-in handlers
+    
+    app = current_app._get_current_object()
+    click.echo(f'Starting {processes} job worker(s)')
+    if processes == 1:
+        work(app, f'{socket.gethostname()}:{os.getpid()}:0', burst)
+    else:
+        start_workers(app, processes, burst)
+
+
+@jobs_cli.command('purge')
+@click.option('--older-than-days', default=7.0, show_default=True)
+@with_appcontext
+def purge_command(older_than_days):
+    """Delete finished jobs and their files"""
+    from app.api.v1.models.models import Job
+    
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    jobs = Job.query.filter(Job.status.in_(FINISHED), Job.finished_at < cutoff).all()
+    directory = jobs_dir(current_app)
+    for job in jobs:
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if name.startswith(job.public_id):
+                os.unlink(os.path.join(directory, name))
+        db.session.delete(job)
+    db.session.commit()
+    click.echo(f'Purged {len(jobs)} jobs')
@@ -0,0 +1,302 @@
+"""Negotiated response compression.
+
+A WSGI middleware in front of the Flask app compresses response bodies with
+the best encoding the client accepts (``Accept-Encoding`` with q-values):
+``br`` and ``zstd`` when the optional ``brotli`` and ``zstandard`` packages
+are installed, ``gzip`` always. ``COMPRESSION_ENCODINGS`` sets the server's
+preference order when the client rates several encodings the same.
+
+- Only text-like bodies (JSON, NDJSON, HTML, XML, CSV, JavaScript) are
+  compressed, and only when they are at least ``COMPRESSION_MIN_SIZE`` bytes.
+  Responses that already have a ``Content-Encoding``, send
+  ``Cache-Control: no-transform``, or are server-sent event streams pass
+  through untouched.
+- Responses with a ``Content-Length`` are compressed in one go. Their
+  compressed bytes are kept in a per-worker LRU cache, keyed by encoding
+  and a digest of the body, so a document that every client polls is
+  compressed once and then served from the cache.
+- Streamed responses (no ``Content-Length``, e.g. NDJSON exports) are
+  compressed chunk by chunk and flushed after every chunk, so clients get
+  each record as soon as the app yields it.
+
+Routes served natively by ``app.asgi`` do not go through this layer.
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from werkzeug.http import parse_accept_header, parse_options_header
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+DEFAULT_ENCODINGS = ('br', 'zstd', 'gzip')
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+MAX_CACHED_BODY = 1024 * 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'application/xhtml+xml',
+    'image/svg+xml',
+}
+SKIPPED_STATUSES = (204, 206, 304)
+
+
+class GzipEncoder:
+    name = 'gzip'
+    
+    def __init__(self, level=6):
+        self.level = level
+    
+    def _compressobj(self):
+        # wbits=31 writes a gzip header with a zero mtime, so output is deterministic
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+    
+    def compress(self, data):
+        compressor = self._compressobj()
+        return compressor.compress(data) + compressor.flush()
+    
+    def stream(self, chunks):
+        compressor = self._compressobj()
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+    
+    def __init__(self, level=5):
+        self.level = level
+    
+    def compress(self, data):
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=self.level)
+    
+    def stream(self, chunks):
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=self.level)
+        for chunk in chunks:
+            if chunk:
+                yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+class ZstdEncoder:
+    name = 'zstd'
+    
+    def __init__(self, level=3):
+        self.level = level
+    
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+    
+    def stream(self, chunks):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+
+
+def available_encoders(config):
+    """Encoders usable in this process, in the configured preference order"""
+    factories = {'gzip': (GzipEncoder, 'COMPRESSION_GZIP_LEVEL')}
+    if brotli is not None:
+        factories['br'] = (BrotliEncoder, 'COMPRESSION_BROTLI_LEVEL')
+    if zstandard is not None:
+        factories['zstd'] = (ZstdEncoder, 'COMPRESSION_ZSTD_LEVEL')
+    
+    encoders = []
+    for name in config.get('COMPRESSION_ENCODINGS') or DEFAULT_ENCODINGS:
+        name = name.strip()
+        if name not in factories:
+            continue
+        factory, level_key = factories[name]
+        level = config.get(level_key)
+        encoders.append(factory() if level is None else factory(level))
+    return encoders
+
+
+def negotiate(accept_encoding, encoders):
+    """Encoder with the client's highest q-value, ties going to server order; None for identity"""
+    accept = parse_accept_header(accept_encoding or '')
+    best, best_quality = None, 0
+    for encoder in encoders:
+        quality = accept.quality(encoder.name)
+        if quality > best_quality:
+            best, best_quality = encoder, quality
+    return best
+
+
+def is_compressible(content_type):
+    mimetype, _ = parse_options_header(content_type or '')
+    if mimetype == 'text/event-stream':
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES or mimetype.endswith('+json')
+
+
+class CompressedCache:
+    """Thread-safe LRU of compressed bodies, bounded by total bytes"""
+    
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_or_compress(self, encoder, body):
+        """``encoder.compress(body)``, reusing an earlier result for the same body"""
+        from app.observability.metrics import record_cache_lookup
+        
+        if not self.max_bytes or len(body) > MAX_CACHED_BODY:
+            return encoder.compress(body)
+        key = (encoder.name, encoder.level, hashlib.blake2b(body, digest_size=16).digest())
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+        record_cache_lookup('compression', hit=compressed is not None)
+        if compressed is not None:
+            return compressed
+        
+        compressed = encoder.compress(body)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self.size += len(compressed)
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return compressed
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+class CompressionMiddleware:
+    """Compress response bodies of a WSGI app with the negotiated encoding"""
+    
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        config = flask_app.config
+        self.encoders = available_encoders(config)
+        self.min_size = config.get('COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+        self.cache = CompressedCache(config.get('COMPRESSION_CACHE_BYTES', DEFAULT_CACHE_BYTES))
+    
+    def __call__(self, environ, start_response):
+        encoder = negotiate(environ.get('HTTP_ACCEPT_ENCODING'), self.encoders)
+        captured = {}
+        
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None:
+                return start_response(status, headers, exc_info)
+            captured['status'], captured['headers'] = status, headers
+            return start_response_body
+        
+        def start_response_body(data):
+            # Legacy write() callable: send headers unchanged, then the data
+            captured['passthrough'] = True
+            return start_response(captured['status'], captured['headers'])(data)
+        
+        body = self.wsgi_app(environ, capture)
+        if 'status' not in captured or captured.get('passthrough'):
+            return body
+        
+        status, headers = captured['status'], captured['headers']
+        if not self.applies(environ, status, headers):
+            start_response(status, headers)
+            return body
+        
+        headers = add_vary(headers)
+        length = header_value(headers, 'Content-Length')
+        if encoder is None or (length is not None and int(length) < self.min_size):
+            start_response(status, headers)
+            return body
+        
+        headers = [(name, weak_etag(value) if name.lower() == 'etag' else value)
+                   for name, value in headers if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoder.name))
+        # Large files (export downloads) are compressed as they stream instead of being read into memory
+        if length is None or int(length) > MAX_CACHED_BODY:
+            start_response(status, headers)
+            return ClosingIterator(encoder.stream(body), body)
+        
+        try:
+            data = b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        compressed = self.cache.get_or_compress(encoder, data)
+        headers.append(('Content-Length', str(len(compressed))))
+        start_response(status, headers)
+        return [compressed]
+    
+    def applies(self, environ, status, headers):
+        """Whether the response may be encoded at all (the Vary header goes on these too)"""
+        if environ.get('REQUEST_METHOD') == 'HEAD' or int(status.split(None, 1)[0]) in SKIPPED_STATUSES:
+            return False
+        if header_value(headers, 'Content-Encoding') is not None:
+            return False
+        if 'no-transform' in (header_value(headers, 'Cache-Control') or '').lower():
+            return False
+        return is_compressible(header_value(headers, 'Content-Type'))
+
+
+class ClosingIterator:
+    """Iterate over ``chunks`` and close the app's original iterable afterwards"""
+    
+    def __init__(self, chunks, body):
+        self.chunks = chunks
+        self.body = body
+    
+    def __iter__(self):
+        return iter(self.chunks)
+    
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def header_value(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def weak_etag(etag):
+    """The encoded body is a different byte sequence, so a strong ETag no longer holds"""
+    return etag if etag.startswith('W/') else f'W/{etag}'
+
+
+def add_vary(headers):
+    vary = header_value(headers, 'Vary')
+    if vary is None:
+        return list(headers) + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return list(headers)
+    return [(key, f'{value}, Accept-Encoding' if key.lower() == 'vary' else value) for key, value in headers]
+
+
+def init_compression(app):
+    """Install the compression middleware unless ``COMPRESSION_ENABLED`` is false"""
+    if app.config.get('COMPRESSION_ENABLED', True):
+        app.wsgi_app = CompressionMiddleware(app.wsgi_app, app)
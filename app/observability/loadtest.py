@@ -0,0 +1,368 @@
+"""Open-loop load generator: ``flask loadtest``.
+
+Replays a weighted mix of client actions against the app. By default it
+runs in-process through the WSGI test client. With ``--url`` it targets a
+running server, e.g. gunicorn on ``http://127.0.0.1:8531``. Requests arrive
+as a Poisson process at ``--rate`` per second whether or not earlier ones
+have finished, which is how real clients behave. Each latency is measured
+from the moment the request was due to be sent, not from when a thread got
+around to it. A saturated server therefore shows up as growing latency
+instead of quietly lowering the offered load.
+
+Virtual users sign up and log in the way the tests' ``AuthActions`` do.
+A few documents are created up front, so the polling and station-advance
+actions have something to work on.
+"""
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+API = '/api/v1'
+USER_PASSWORD = 'loadtest-password'
+
+# Named traffic mixes: action -> relative weight
+MIXES = {
+    'polling': {'poll_document': 60, 'poll_station': 30, 'create_document': 4, 'advance_station': 4, 'login': 2},
+    'mixed': {'poll_document': 35, 'poll_station': 20, 'create_document': 20, 'advance_station': 20, 'login': 5},
+    'writes': {'create_document': 50, 'advance_station': 45, 'login': 5},
+}
+
+
+class LoadTestError(click.ClickException):
+    """Setup failed or the options make no sense"""
+
+
+def parse_mix(value):
+    """A named mix or ``action=weight,...`` into a weight mapping"""
+    if value in MIXES:
+        return dict(MIXES[value])
+    mix = {}
+    for part in value.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise LoadTestError(f'Unknown action {action!r}; choose from {", ".join(sorted(ACTIONS))}')
+        try:
+            mix[action] = float(weight)
+        except ValueError:
+            raise LoadTestError(f'Weight for {action!r} must be a number')
+    if not mix or sum(mix.values()) <= 0:
+        raise LoadTestError('Mix needs at least one action with a positive weight')
+    return mix
+
+
+class WSGITransport:
+    """Requests through the app's test client, one client per thread"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+    
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPTransport:
+    """Requests over keep-alive HTTP connections, one per thread"""
+    
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+    
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        
+        for attempt in (1, 2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                conn.request(method, self.prefix + path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may have closed an idle keep-alive connection; retry once on a fresh one
+                conn.close()
+                self.local.conn = None
+                if attempt == 2:
+                    raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Session:
+    """Virtual users, seed data and the documents the run has created"""
+    
+    def __init__(self, transport, users, rng):
+        self.transport = transport
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.users = [f'loadtest-user-{index}' for index in range(users)]
+        self.tokens = {}
+        self.documents = []
+        self.template_ids = []
+        self.station_ids = []
+        self.station_public_ids = []
+        self.counter = 0
+    
+    def register(self, username):
+        return self.transport.request('POST', f'{API}/auth/register', {
+            'username': username, 'email': f'{username}@example.com', 'password': USER_PASSWORD
+        })
+    
+    def login(self, username):
+        return self.transport.request('POST', f'{API}/auth/login', {
+            'username': username, 'password': USER_PASSWORD
+        })
+    
+    def headers(self, username=None):
+        username = username or self.rng.choice(self.users)
+        return {'Authorization': f'Bearer {self.tokens[username]}'}
+    
+    def next_name(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f'{prefix} {self.counter}'
+    
+    def setup(self, documents):
+        """Sign users up, make sure templates and stations exist, create documents"""
+        for username in self.users:
+            self.register(username)  # 400 when the user exists from an earlier run
+            status, body = self.login(username)
+            if status != 200:
+                raise LoadTestError(f'Login for {username} failed with {status}: {body}')
+            self.tokens[username] = body['access_token']
+        
+        headers = self.headers(self.users[0])
+        status, templates = self.transport.request('GET', f'{API}/templates/', headers=headers)
+        if status == 200 and templates:
+            self.template_ids = [template['id'] for template in templates[:50]]
+        else:
+            status, template = self.transport.request('POST', f'{API}/templates/', {
+                'name': 'Load test template', 'content': '<p>{{amount}}</p>', 'status': 'active'
+            }, headers)
+            if status != 201:
+                raise LoadTestError(f'Could not create a template ({status}): {template}')
+            self.template_ids = [template['id']]
+        
+        status, stations = self.transport.request('GET', f'{API}/stations', headers=headers)
+        stations = stations if status == 200 else []
+        for index in range(len(stations), 3):
+            status, station = self.transport.request('POST', f'{API}/stations', {
+                'name': f'Load test station {index + 1}', 'type': 'review'
+            }, headers)
+            if status != 201:
+                raise LoadTestError(f'Could not create a station ({status}): {station}')
+            stations.append(station)
+        self.station_ids = [station['id'] for station in stations]
+        self.station_public_ids = [station['public_id'] for station in stations]
+        
+        for _ in range(documents):
+            status, document = create_document(self)
+            if status != 201:
+                raise LoadTestError(f'Could not create a document ({status}): {document}')
+    
+    def remember(self, document):
+        with self.lock:
+            self.documents.append(document['public_id'])
+    
+    def pick_document(self):
+        with self.lock:
+            return self.rng.choice(self.documents)
+
+
+def poll_document(session):
+    return session.transport.request('GET', f'{API}/documents/{session.pick_document()}', headers=session.headers())
+
+
+def poll_station(session):
+    station = session.rng.choice(session.station_public_ids)
+    return session.transport.request('GET', f'{API}/stations/{station}/documents', headers=session.headers())
+
+
+def create_document(session):
+    status, body = session.transport.request('POST', f'{API}/documents', {
+        'name': session.next_name('Load test document'),
+        'content': '<p>load test</p>',
+        'template_id': session.rng.choice(session.template_ids),
+        'current_station_id': session.station_ids[0],
+    }, headers=session.headers())
+    if status == 201:
+        session.remember(body)
+    return status, body
+
+
+def advance_station(session):
+    return session.transport.request('PUT', f'{API}/documents/{session.pick_document()}', {
+        'current_station_id': session.rng.choice(session.station_ids)
+    }, headers=session.headers())
+
+
+def login(session):
+    username = session.rng.choice(session.users)
+    status, body = session.login(username)
+    if status == 200:
+        session.tokens[username] = body['access_token']
+    return status, body
+
+
+# action -> (route label, function)
+ACTIONS = {
+    'poll_document': ('GET /documents/<id>', poll_document),
+    'poll_station': ('GET /stations/<id>/documents', poll_station),
+    'create_document': ('POST /documents', create_document),
+    'advance_station': ('PUT /documents/<id>', advance_station),
+    'login': ('POST /auth/login', login),
+}
+
+
+class Recorder:
+    """Latencies and outcomes per route"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+    
+    def record(self, route, latency, status):
+        with self.lock:
+            self.latencies[route].append(latency)
+            self.statuses[route][status] += 1
+            if status is None or status >= 400:
+                self.errors[route] += 1
+    
+    def summary(self, elapsed):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            routes[route] = {
+                'requests': len(latencies),
+                'errors': self.errors[route],
+                'throughput': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'max_ms': round(latencies[-1] * 1000, 2),
+                'statuses': {str(status): count for status, count in self.statuses[route].items()},
+            }
+        total = sum(route['requests'] for route in routes.values())
+        return {
+            'duration_s': round(elapsed, 2),
+            'requests': total,
+            'errors': sum(route['errors'] for route in routes.values()),
+            'throughput': round(total / elapsed, 2) if elapsed else 0.0,
+            'routes': routes,
+        }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def arrival_schedule(rate, duration, mix, rng):
+    """``(offset, action)`` pairs for a Poisson process of ``rate`` per second"""
+    actions, weights = zip(*mix.items())
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        yield offset, rng.choices(actions, weights)[0]
+        offset += rng.expovariate(rate)
+
+
+def run_load(session, mix, rate, duration, concurrency, rng):
+    """Fire the schedule open-loop and return the recorder"""
+    recorder = Recorder()
+    
+    def fire(action, due):
+        route, func = ACTIONS[action]
+        try:
+            status, _ = func(session)
+        except Exception:
+            status = None
+        recorder.record(route, time.perf_counter() - due, status)
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='loadtest') as pool:
+        for offset, action in arrival_schedule(rate, duration, mix, rng):
+            due = started + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, action, due)
+    return recorder, time.perf_counter() - started
+
+
+def format_report(summary):
+    lines = [
+        f'{"route":<32}{"reqs":>7}{"err":>6}{"req/s":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}',
+    ]
+    for route, stats in summary['routes'].items():
+        lines.append(
+            f'{route:<32}{stats["requests"]:>7}{stats["errors"]:>6}{stats["throughput"]:>9.1f}'
+            f'{stats["p50_ms"]:>10.1f}{stats["p95_ms"]:>10.1f}{stats["p99_ms"]:>10.1f}'
+        )
+    lines.append(
+        f'{"total":<32}{summary["requests"]:>7}{summary["errors"]:>6}{summary["throughput"]:>9.1f}'
+    )
+    return '\n'.join(lines)
+
+
+@click.command('loadtest')
+@click.option('--mix', default='mixed', show_default=True,
+              help=f'Traffic mix: {", ".join(MIXES)} or action=weight,... '
+                   f'(actions: {", ".join(ACTIONS)})')
+@click.option('--rate', default=20.0, show_default=True, help='Arrivals per second (open loop)')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds to generate load')
+@click.option('--concurrency', default=64, show_default=True, help='Maximum requests in flight')
+@click.option('--users', default=5, show_default=True, help='Virtual users to sign up and log in')
+@click.option('--documents', default=20, show_default=True, help='Documents created before the run')
+@click.option('--url', help='Base URL of a running server (default: in-process WSGI)')
+@click.option('--seed', default=None, type=int, help='Random seed for a repeatable schedule')
+@click.option('--json', 'as_json', is_flag=True, help='Print the summary as JSON')
+@with_appcontext
+def loadtest_cli(mix, rate, duration, concurrency, users, documents, url, seed, as_json):
+    """Replay a traffic mix and report per-route latency percentiles"""
+    mix = parse_mix(mix)
+    if rate <= 0 or duration <= 0 or users < 1 or concurrency < 1:
+        raise LoadTestError('--rate, --duration, --users and --concurrency must be positive')
+    
+    rng = random.Random(seed)
+    transport = HTTPTransport(url) if url else WSGITransport(current_app._get_current_object())
+    session = Session(transport, users, rng)
+    session.setup(max(documents, 1))
+    
+    if not as_json:
+        click.echo(f'{rate:g} req/s for {duration:g}s against {url or "in-process app"}, mix: '
+                   + ', '.join(f'{action}={weight:g}' for action, weight in mix.items()))
+    recorder, elapsed = run_load(session, mix, rate, duration, concurrency, rng)
+    summary = recorder.summary(elapsed)
+    click.echo(json.dumps(summary, indent=2) if as_json else format_report(summary))
@@ -0,0 +1,121 @@
+"""Prometheus metrics.
+
+With ``METRICS_ENABLED`` set, ``GET /metrics`` serves the Prometheus text
+format. It takes no token, since scrapers cannot log in, so enable it only
+where the network keeps everyone but the scraper away from it:
+
+- ``http_requests_total``: request counts by method, endpoint and status.
+- ``http_request_duration_seconds``: latency histograms.
+- ``http_response_size_bytes``: response size histograms.
+- ``http_request_db_seconds`` and ``http_request_db_queries``: DB time and
+  query count per request, taken from the query stats.
+- ``http_requests_in_progress``: requests currently in flight.
+- ``cache_lookups_total``: hits and misses of the in-process caches. The
+  hit ratio is ``rate(...{result="hit"}) / rate(...)``.
+
+Endpoint labels are Flask endpoint names (``api_v1.get_documents``), so one
+label covers every document id. Requests that match no route share the
+``unmatched`` label.
+
+Under gunicorn, every worker keeps its own counters. Point
+``PROMETHEUS_MULTIPROC_DIR`` at an empty directory before the workers start.
+Each worker then writes its samples to memory-mapped files there, and
+``/metrics`` adds the files together, so any worker answers for all of them.
+``deploy.sh`` and ``gunicorn.conf.py`` set this up.
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+UNMATCHED_ENDPOINT = 'unmatched'
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests handled',
+    ['method', 'endpoint', 'status'],
+)
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request',
+    ['method', 'endpoint'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0),
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Size of response bodies',
+    ['method', 'endpoint'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+DB_TIME = Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request',
+    ['endpoint'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL statements per request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests currently being handled',
+    ['method'],
+    multiprocess_mode='livesum',
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Lookups in in-process caches',
+    ['cache', 'result'],
+)
+
+
+def record_cache_lookup(cache, hit):
+    """Count one lookup in the cache called ``cache``"""
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def metrics_registry():
+    """Registry to expose: merged worker files in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_metrics(app):
+    """Record request metrics, and serve them on ``/metrics`` when ``METRICS_ENABLED`` is set"""
+    
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        IN_PROGRESS.labels(request.method).inc()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        
+        endpoint = request.endpoint or UNMATCHED_ENDPOINT
+        REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+        LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+        if response.content_length is not None:
+            RESPONSE_SIZE.labels(request.method, endpoint).observe(response.content_length)
+        
+        stats = g.get('query_stats')
+        if stats is not None:
+            DB_TIME.labels(endpoint).observe(stats.total)
+            DB_QUERIES.labels(endpoint).observe(stats.count)
+        return response
+    
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            IN_PROGRESS.labels(request.method).dec()
+    
+    if not app.config.get('METRICS_ENABLED', False):
+        return
+    
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus metrics for all workers"""
+        return Response(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
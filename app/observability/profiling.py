@@ -0,0 +1,214 @@
+"""Request-level sampling profiler.
+
+When ``PROFILING_ENABLED`` is set, a WSGI middleware in front of the Flask
+app profiles a random ``PROFILE_SAMPLE_RATE`` fraction of requests, plus any
+request from an admin token that sends an ``X-Profile`` header. A profiled
+request runs as usual while a side thread samples its stack every
+``PROFILE_INTERVAL_MS``. That is cheap enough to leave on in production,
+unlike tracing every call with cProfile.
+
+Each profile is written in collapsed-stack ("folded") format to
+``PROFILE_DIR/<endpoint>/<timestamp>-<pid>.folded``. Only the newest
+``PROFILE_KEEP`` files are kept per endpoint. Render a flamegraph with::
+
+    cat instance/profiles/api_v1.get_documents/*.folded | flamegraph.pl > docs.svg
+
+``GET /admin/profiles/hot`` adds up the most recent profiles from every
+worker and lists the functions where the samples landed.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, jsonify, request
+from flask_jwt_extended import decode_token
+from jwt import InvalidTokenError
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+DEFAULT_INTERVAL_MS = 2
+DEFAULT_KEEP = 50
+DEFAULT_HOT_WINDOW = 200
+UNMATCHED_ENDPOINT = '_unmatched'
+
+
+def frame_label(frame):
+    """``module:function`` for a frame, as it appears in the folded output"""
+    module = frame.f_globals.get('__name__') or frame.f_code.co_filename
+    return f'{module}:{frame.f_code.co_name}'
+
+
+class StackSampler:
+    """Sample one thread's stack below ``root`` until stopped"""
+    
+    def __init__(self, thread_id, root, interval):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            del frame
+            # The request may have finished while we were walking its stack
+            if stack and not self._stop.is_set():
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+class ProfilingMiddleware:
+    """Profile sampled or admin-requested requests of a WSGI app"""
+    
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+    
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+        
+        config = self.flask_app.config
+        interval = config.get('PROFILE_INTERVAL_MS', DEFAULT_INTERVAL_MS) / 1000.0
+        sampler = StackSampler(threading.get_ident(), sys._getframe(), interval).start()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            stacks = sampler.stop()
+            if stacks:
+                write_profile(profile_dir(self.flask_app), self.endpoint(environ), stacks,
+                              keep=config.get('PROFILE_KEEP', DEFAULT_KEEP))
+    
+    def should_profile(self, environ):
+        if environ.get(PROFILE_HEADER) and self.is_admin(environ):
+            return True
+        rate = self.flask_app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        return rate > 0 and random.random() < rate
+    
+    def is_admin(self, environ):
+        """Check the bearer token the way ``role_required('admin')`` would"""
+        from app.security.claims import revocation_list
+        
+        parts = environ.get('HTTP_AUTHORIZATION', '').split()
+        if len(parts) != 2 or parts[0] != 'Bearer':
+            return False
+        with self.flask_app.app_context():
+            try:
+                claims = decode_token(parts[1])
+            except InvalidTokenError:
+                return False
+            if claims.get('type') != 'access' or revocation_list.is_revoked(claims['jti']):
+                return False
+        return (claims.get('sub') or {}).get('role') == 'admin'
+    
+    def endpoint(self, environ):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except Exception:
+            return UNMATCHED_ENDPOINT
+        return endpoint
+
+
+def profile_dir(app):
+    return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def write_profile(directory, endpoint, stacks, keep=DEFAULT_KEEP):
+    """Write one folded profile for ``endpoint`` and prune the oldest"""
+    endpoint_dir = os.path.join(directory, endpoint)
+    os.makedirs(endpoint_dir, exist_ok=True)
+    name = f'{time.time_ns()}-{os.getpid()}.folded'
+    with open(os.path.join(endpoint_dir, name), 'w') as fh:
+        for stack, count in stacks.most_common():
+            fh.write(f'{stack} {count}\n')
+    
+    for stale in sorted(os.listdir(endpoint_dir))[:-keep or None]:
+        try:
+            os.unlink(os.path.join(endpoint_dir, stale))
+        except OSError:
+            pass
+    return name
+
+
+def recent_profiles(directory, endpoint=None, window=DEFAULT_HOT_WINDOW):
+    """Paths of the newest ``window`` profiles, optionally for one endpoint"""
+    if not os.path.isdir(directory):
+        return []
+    endpoints = [os.path.basename(endpoint)] if endpoint else os.listdir(directory)
+    profiles = []
+    for name in endpoints:
+        endpoint_dir = os.path.join(directory, name)
+        if os.path.isdir(endpoint_dir):
+            profiles.extend((entry, os.path.join(endpoint_dir, entry)) for entry in os.listdir(endpoint_dir))
+    profiles.sort(reverse=True)
+    return [path for _, path in profiles[:window]]
+
+
+def hot_functions(paths, limit=20):
+    """Aggregate folded profiles into per-function self and total samples"""
+    self_samples = Counter()
+    total_samples = Counter()
+    samples = 0
+    for path in paths:
+        try:
+            with open(path) as fh:
+                lines = fh.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if not stack or not count.isdigit():
+                continue
+            count = int(count)
+            frames = stack.split(';')
+            samples += count
+            self_samples[frames[-1]] += count
+            for function in set(frames):
+                total_samples[function] += count
+    
+    functions = [
+        {
+            'function': function,
+            'self_samples': count,
+            'total_samples': total_samples[function],
+            'self_percent': round(100.0 * count / samples, 2),
+            'total_percent': round(100.0 * total_samples[function] / samples, 2),
+        }
+        for function, count in self_samples.most_common(limit)
+    ]
+    return {'profiles': len(paths), 'samples': samples, 'functions': functions}
+
+
+def init_profiling(app):
+    """Install the profiling middleware and the admin hot-functions report"""
+    from app.security.claims import role_required
+    
+    if app.config.get('PROFILING_ENABLED'):
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app)
+    
+    @app.route('/admin/profiles/hot')
+    @role_required('admin')
+    def profile_hot_functions():
+        """Functions with the most samples across recent profiles"""
+        paths = recent_profiles(
+            profile_dir(current_app),
+            endpoint=request.args.get('endpoint'),
+            window=request.args.get('window', current_app.config.get('PROFILE_HOT_WINDOW', DEFAULT_HOT_WINDOW), type=int),
+        )
+        return jsonify(hot_functions(paths, limit=request.args.get('limit', 20, type=int)))
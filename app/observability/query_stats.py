@@ -0,0 +1,144 @@
+"""Per-request SQL accounting.
+
+Cursor events on every engine (primary, replicas and shards) count the
+statements a request runs, add up their time and remember the slowest one.
+After the request, the totals go out in a ``Server-Timing`` header::
+
+    Server-Timing: db;dur=12.4;desc="7 queries", app;dur=31.0
+
+and in one JSON line on the ``app.requests`` logger. Browser dev tools show
+the header next to the request. The log line makes N+1 patterns easy to grep
+for. Any statement slower than ``SLOW_QUERY_MS`` is logged with its
+``EXPLAIN`` plan on the ``app.slow_queries`` logger (a negative threshold
+turns this off). Set ``REQUEST_LOG`` to print the request lines to stderr.
+"""
+import json
+import logging
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_QUERY_MS = 200
+STATEMENT_LOG_LENGTH = 500
+
+request_logger = logging.getLogger('app.requests')
+slow_query_logger = logging.getLogger('app.slow_queries')
+
+
+class QueryStats:
+    """Statements run during one request"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+    
+    def record(self, statement, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+
+def current_query_stats():
+    """Stats of the request being handled, if any"""
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution, so a statement that raises leaves nothing behind on the pooled connection
+    context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context.query_start
+    
+    stats = current_query_stats()
+    if stats is not None:
+        stats.record(statement, duration)
+    
+    if has_app_context():
+        threshold = current_app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+        if threshold is not None and 0 <= threshold <= duration * 1000:
+            log_slow_query(conn, statement, parameters, duration, executemany)
+
+
+def explain(conn, statement, parameters):
+    """Plan of ``statement`` on the connection that just ran it"""
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    # A raw DBAPI cursor keeps the EXPLAIN itself out of the cursor events
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def log_slow_query(conn, statement, parameters, duration, executemany):
+    plan = None
+    if not executemany and statement.lstrip().upper().startswith('SELECT'):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as err:
+            plan = [f'EXPLAIN failed: {err}']
+    
+    slow_query_logger.warning(json.dumps({
+        'event': 'slow_query',
+        'duration_ms': round(duration * 1000, 2),
+        'statement': statement[:STATEMENT_LOG_LENGTH],
+        'path': request.path if has_request_context() else None,
+        'plan': plan,
+    }))
+
+
+def server_timing(stats, elapsed):
+    return (
+        f'db;dur={stats.total * 1000:.1f};desc="{stats.count} queries", '
+        f'app;dur={elapsed * 1000:.1f}'
+    )
+
+
+def init_query_stats(app):
+    """Track queries per request and report them on the response"""
+    if app.config.get('REQUEST_LOG') and not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        request_logger.addHandler(handler)
+        request_logger.setLevel(logging.INFO)
+    
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+    
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        
+        elapsed = time.perf_counter() - stats.started
+        response.headers.add('Server-Timing', server_timing(stats, elapsed))
+        
+        request_logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'db_queries': stats.count,
+            'db_ms': round(stats.total * 1000, 2),
+            'slowest_query_ms': round(stats.slowest * 1000, 2),
+            'slowest_query': (stats.slowest_statement or '')[:STATEMENT_LOG_LENGTH] or None,
+        }))
+        return response
@@ -0,0 +1,502 @@
+"""Built-in pure-Python PDF renderer.
+
+Turns document HTML into paginated A4 text. Nothing outside the
+standard library is needed, and identical input always gives identical
+bytes, which keeps the render cache content-addressed.
+
+The layout is simple: block elements start new paragraphs, headings
+are set larger and bold, list items get a bullet, and everything else
+flows as wrapped text.
+
+Text is set in the TrueType font named by ``RENDER_PDF_FONT`` (and
+``RENDER_PDF_BOLD_FONT`` for headings and bold, otherwise the regular
+font is emboldened with a stroke). The whole font file is embedded as a
+CID font, so Thai and any other script the font covers prints as it
+should. Without a font the PDF base fonts (Helvetica) are used; they
+only cover Windows-1252, so a document with other characters raises
+``UnsupportedText`` instead of printing them as ``?``. Deployments that
+need full CSS can plug in another renderer with ``RENDER_PDF_RENDERER``.
+"""
+import functools
+import hashlib
+import struct
+import unicodedata
+import zlib
+from html.parser import HTMLParser
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+BODY_SIZE = 11
+HEADING_SIZES = {'h1': 20, 'h2': 16, 'h3': 14, 'h4': 12, 'h5': 11, 'h6': 11}
+LEADING = 1.4
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'article', 'header', 'footer', 'blockquote', 'pre', 'ul', 'ol', 'li',
+    'table', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'address', 'dl', 'dt', 'dd'
+}
+BOLD_TAGS = {'b', 'strong', 'th'}
+SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+BULLET = '• '
+
+# Helvetica advance widths (1/1000 em) for ' ' through '~'; other characters use DEFAULT_WIDTH
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+]
+DEFAULT_WIDTH = 556
+BOLD_FACTOR = 1.06  # Helvetica-Bold runs about this much wider
+FAKE_BOLD_STROKE = 0.03  # Outline width, in em, that emboldens a regular TrueType font
+
+# RENDER_PDF_FONT and RENDER_PDF_BOLD_FONT; set in the app process before the render pool forks
+font_paths = {'regular': None, 'bold': None}
+
+
+class UnsupportedText(ValueError):
+    """The document has characters the configured fonts cannot print"""
+
+
+class TrueTypeFont:
+    """Metrics and character map of a TrueType (``glyf``) font file"""
+    
+    def __init__(self, data):
+        if data[:4] not in (b'\x00\x01\x00\x00', b'true'):
+            raise ValueError('Not a TrueType font (collections and CFF-based OpenType are not supported)')
+        tables = {}
+        for n in range(struct.unpack('>H', data[4:6])[0]):
+            tag, _, offset, length = struct.unpack('>4sIII', data[12 + 16 * n:28 + 16 * n])
+            tables[tag.decode('latin-1')] = data[offset:offset + length]
+        missing = {'head', 'hhea', 'maxp', 'hmtx', 'cmap'} - set(tables)
+        if missing:
+            raise ValueError(f'TrueType font without {", ".join(sorted(missing))}')
+        head, hhea = tables['head'], tables['hhea']
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        self.units_per_em = struct.unpack('>H', head[18:20])[0]
+        self.bbox = struct.unpack('>4h', head[36:44])
+        self.ascent, self.descent = struct.unpack('>2h', hhea[4:8])
+        # Glyphs past the last long metric share its advance
+        metrics = struct.unpack('>H', hhea[34:36])[0]
+        glyphs = struct.unpack('>H', tables['maxp'][4:6])[0]
+        self.advances = list(struct.unpack('>%dH' % metrics, b''.join(
+            tables['hmtx'][4 * n:4 * n + 2] for n in range(metrics))))
+        self.advances += self.advances[-1:] * (glyphs - metrics)
+        self.cmap = parse_cmap(tables['cmap'])
+        os2 = tables.get('OS/2', b'')
+        self.cap_height = struct.unpack('>h', os2[88:90])[0] if len(os2) >= 90 else self.ascent
+        self.name = postscript_name(tables.get('name', b'')) or 'Embedded'
+    
+    def scale(self, value):
+        """Font units to 1/1000 em"""
+        return round(value * 1000 / self.units_per_em)
+    
+    def glyph(self, char):
+        return self.cmap.get(ord(char), 0)
+    
+    def width(self, glyph):
+        return self.scale(self.advances[glyph] if glyph < len(self.advances) else 0)
+
+
+def parse_cmap(table):
+    """Code point to glyph id, from the best Unicode subtable (format 12, or 4 for the BMP)"""
+    subtables = {}
+    for n in range(struct.unpack('>H', table[2:4])[0]):
+        platform, encoding, offset = struct.unpack('>HHI', table[4 + 8 * n:12 + 8 * n])
+        subtables[platform, encoding] = offset
+    for platform, encoding in ((3, 10), (0, 4), (0, 6), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)):
+        offset = subtables.get((platform, encoding))
+        if offset is None:
+            continue
+        fmt = struct.unpack('>H', table[offset:offset + 2])[0]
+        if fmt == 12:
+            return parse_cmap_format12(table, offset)
+        if fmt == 4:
+            return parse_cmap_format4(table, offset)
+    raise ValueError('TrueType font without a Unicode character map')
+
+
+def parse_cmap_format4(table, offset):
+    segments = struct.unpack('>H', table[offset + 6:offset + 8])[0] // 2
+    ends = offset + 14
+    starts = ends + 2 * segments + 2
+    deltas = starts + 2 * segments
+    range_offsets = deltas + 2 * segments
+    cmap = {}
+    for n in range(segments):
+        end, = struct.unpack('>H', table[ends + 2 * n:ends + 2 * n + 2])
+        start, = struct.unpack('>H', table[starts + 2 * n:starts + 2 * n + 2])
+        delta, = struct.unpack('>h', table[deltas + 2 * n:deltas + 2 * n + 2])
+        range_offset, = struct.unpack('>H', table[range_offsets + 2 * n:range_offsets + 2 * n + 2])
+        for code in range(start, min(end, 0xFFFE) + 1):
+            if range_offset:
+                # The offset is relative to this segment's own idRangeOffset entry
+                position = range_offsets + 2 * n + range_offset + 2 * (code - start)
+                glyph, = struct.unpack('>H', table[position:position + 2])
+                glyph = (glyph + delta) & 0xFFFF if glyph else 0
+            else:
+                glyph = (code + delta) & 0xFFFF
+            if glyph:
+                cmap[code] = glyph
+    return cmap
+
+
+def parse_cmap_format12(table, offset):
+    cmap = {}
+    for n in range(struct.unpack('>I', table[offset + 12:offset + 16])[0]):
+        start, end, glyph = struct.unpack('>3I', table[offset + 16 + 12 * n:offset + 28 + 12 * n])
+        for code in range(start, end + 1):
+            cmap[code] = glyph + code - start
+    return cmap
+
+
+def postscript_name(table):
+    """Name id 6, as a string that is safe in a PDF name"""
+    if len(table) < 6:
+        return None
+    count, strings = struct.unpack('>HH', table[2:6])
+    for n in range(count):
+        platform, _, _, name_id, length, offset = struct.unpack('>6H', table[6 + 12 * n:18 + 12 * n])
+        if name_id == 6:
+            raw = table[strings + offset:strings + offset + length]
+            name = raw.decode('utf-16-be' if platform in (0, 3) else 'latin-1', errors='ignore')
+            name = ''.join(c for c in name if c.isascii() and (c.isalnum() or c == '-'))
+            if name:
+                return name
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path):
+    """Parsed font file, read once per process"""
+    with open(path, 'rb') as font_file:
+        return TrueTypeFont(font_file.read())
+
+
+def configure_fonts(regular=None, bold=None):
+    """Set ``RENDER_PDF_FONT`` and ``RENDER_PDF_BOLD_FONT``; called by ``init_rendering``
+    
+    The files are read here, so a wrong path stops the app from starting
+    rather than failing every render.
+    """
+    for path in (regular, bold):
+        if path:
+            load_font(path)
+    font_paths.update(regular=regular or None, bold=bold or None)
+
+
+class HtmlBlocks(HTMLParser):
+    """Collect ``(style, text)`` paragraphs from HTML; style is 'body', 'bold' or a heading tag"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._text = []
+        self._style = 'body'
+        self._bold = 0
+        self._skipping = 0
+        self._cell = False
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            if tag in HEADING_SIZES:
+                self._style = tag
+            elif tag == 'li':
+                self._text.append(BULLET)
+        elif tag == 'br':
+            self._flush()
+        elif tag in ('td', 'th'):
+            # Cells of one row share a line
+            if self._cell:
+                self._text.append('  ')
+            self._cell = True
+        if tag in BOLD_TAGS:
+            self._bold += 1
+    
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            self._style = 'body'
+            self._cell = False
+        if tag in BOLD_TAGS:
+            self._bold = max(0, self._bold - 1)
+    
+    def handle_data(self, data):
+        if not self._skipping:
+            if self._bold and self._style == 'body' and not ''.join(self._text).strip():
+                self._style = 'bold'
+            self._text.append(data)
+    
+    def close(self):
+        super().close()
+        self._flush()
+        return self.blocks
+    
+    def _flush(self):
+        text = ' '.join(''.join(self._text).split())
+        if text and text != BULLET.strip():
+            self.blocks.append((self._style, text))
+        self._text = []
+
+
+def pdf_string(text):
+    encoded = text.encode('cp1252', errors='replace')
+    return b'(' + encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def info_string(text):
+    """A PDF text string (document metadata): literal if ASCII, otherwise UTF-16 with a byte order mark"""
+    if text.isascii():
+        return pdf_string(text)
+    return b'<FEFF' + text.encode('utf-16-be').hex().upper().encode() + b'>'
+
+
+def stream_object(data, extra=b''):
+    data = zlib.compress(data)
+    return b'<< /Length %d /Filter /FlateDecode%s >>\nstream\n' % (len(data), extra) + data + b'\nendstream'
+
+
+class BaseFace:
+    """A PDF base font; WinAnsiEncoding, so only Windows-1252 text"""
+    
+    objects_needed = 1
+    fake_bold = False
+    
+    def __init__(self, base_font, factor=1.0):
+        self.base_font = base_font
+        self.factor = factor
+    
+    def width(self, text):
+        return self.factor * sum(
+            HELVETICA_WIDTHS[ord(c) - 32] if 32 <= ord(c) <= 126 else DEFAULT_WIDTH for c in text)
+    
+    def unsupported(self, text):
+        return {c for c in text if c.encode('cp1252', errors='ignore') == b''}
+    
+    def encode(self, text):
+        return pdf_string(text)
+    
+    def objects(self, first_id):
+        return {first_id: b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+                          % self.base_font.encode()}
+
+
+class EmbeddedFace:
+    """A TrueType font embedded as a CID font, with text written as glyph ids
+    
+    Also records the glyphs used, for the widths and the ``ToUnicode`` map
+    that keeps the PDF's text searchable and copyable.
+    """
+    
+    objects_needed = 5
+    
+    def __init__(self, font, fake_bold=False, used=None):
+        self.font = font
+        self.fake_bold = fake_bold
+        self.used = {} if used is None else used
+    
+    def width(self, text):
+        return sum(self.font.width(self.font.glyph(c)) for c in text)
+    
+    def encode(self, text):
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyph(char)
+            self.used.setdefault(glyph, char)
+            glyphs.append(b'%04X' % glyph)
+        return b'<' + b''.join(glyphs) + b'>'
+    
+    def objects(self, first_id):
+        font, name = self.font, self.font.name.encode()
+        font_id, cid_id, descriptor_id, file_id, unicode_id = range(first_id, first_id + 5)
+        widths = b' '.join(b'%d [%d]' % (glyph, font.width(glyph)) for glyph in sorted(self.used))
+        pairs = [(glyph, char) for glyph, char in sorted(self.used.items()) if glyph]
+        cmap = [
+            b'/CIDInit /ProcSet findresource begin 12 dict begin begincmap',
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def',
+            b'/CMapName /Adobe-Identity-UCS def /CMapType 2 def',
+            b'1 begincodespacerange <0000> <FFFF> endcodespacerange',
+        ]
+        # At most 100 entries per bfchar block
+        for start in range(0, len(pairs), 100):
+            chunk = pairs[start:start + 100]
+            cmap.append(b'%d beginbfchar' % len(chunk))
+            cmap.extend(b'<%04X> <%s>' % (glyph, char.encode('utf-16-be').hex().upper().encode())
+                        for glyph, char in chunk)
+            cmap.append(b'endbfchar')
+        cmap.append(b'endcmap CMapName currentdict /CMap defineresource pop end end')
+        return {
+            font_id: b'<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H '
+                     b'/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>' % (name, cid_id, unicode_id),
+            cid_id: b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+                    b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+                    b'/FontDescriptor %d 0 R /CIDToGIDMap /Identity /W [%s] >>' % (name, descriptor_id, widths),
+            descriptor_id: b'<< /Type /FontDescriptor /FontName /%s /Flags 32 /FontBBox [%d %d %d %d] '
+                           b'/ItalicAngle 0 /Ascent %d /Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+                           % (name, *map(font.scale, font.bbox), font.scale(font.ascent),
+                              font.scale(font.descent), font.scale(font.cap_height), file_id),
+            file_id: stream_object(font.data, b' /Length1 %d' % len(font.data)),
+            unicode_id: stream_object(b'\n'.join(cmap)),
+        }
+
+
+def base_faces():
+    return {'F1': BaseFace('Helvetica'), 'F2': BaseFace('Helvetica-Bold', BOLD_FACTOR)}
+
+
+def embedded_faces(regular, bold=None):
+    """Faces for TrueType files; without a bold file the regular one is stroked"""
+    face = EmbeddedFace(load_font(regular))
+    if bold:
+        return {'F1': face, 'F2': EmbeddedFace(load_font(bold))}
+    # One set of font objects serves both, so they share the record of glyphs used
+    return {'F1': face, 'F2': EmbeddedFace(face.font, fake_bold=True, used=face.used)}
+
+
+def text_width(text, size, face):
+    return face.width(text) * size / 1000
+
+
+def wrap(text, size, face, max_width):
+    """Greedy word wrap; words longer than a line (or Thai runs, which have no spaces) are split"""
+    lines, line = [], ''
+    for word in text.split(' '):
+        candidate = f'{line} {word}' if line else word
+        if text_width(candidate, size, face) <= max_width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        while text_width(word, size, face) > max_width:
+            cut = len(word) - 1
+            while cut > 1 and text_width(word[:cut], size, face) > max_width:
+                cut -= 1
+            # Never strand a vowel or tone mark at the start of the next line
+            while cut > 1 and unicodedata.category(word[cut]) == 'Mn':
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        line = word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def layout(title, blocks, faces):
+    """Place text lines on pages: a list of pages, each a list of ``(font, size, x, y, text)``"""
+    max_width = PAGE_WIDTH - 2 * MARGIN
+    pages, page = [], []
+    y = PAGE_HEIGHT - MARGIN
+    for style, text in [('h1', title)] + blocks:
+        size = HEADING_SIZES.get(style, BODY_SIZE)
+        font = 'F1' if style == 'body' else 'F2'
+        step = size * LEADING
+        for line in wrap(text, size, faces[font], max_width):
+            if y - step < MARGIN:
+                pages.append(page)
+                page, y = [], PAGE_HEIGHT - MARGIN
+            y -= step
+            page.append((font, size, MARGIN, y, line))
+        y -= BODY_SIZE * (LEADING - 1) * 2  # Paragraph spacing
+    pages.append(page)
+    return pages
+
+
+def show_text(face, font, size, x, y, text):
+    shown = b'BT /%s %d Tf %.2f %.2f Td %s Tj ET' % (font.encode(), size, x, y, face.encode(text))
+    if face.fake_bold:
+        # Fill and stroke the outlines; q/Q restores the rendering mode and line width
+        return b'q 2 Tr %.2f w ' % (size * FAKE_BOLD_STROKE) + shown + b' Q'
+    return shown
+
+
+def write_pdf(title, pages, faces=None):
+    """Serialize laid-out pages as a PDF 1.4 file"""
+    faces = faces or base_faces()
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Title ' + info_string(title) + b' /Producer (doc-template-api) >>',
+    }
+    # Faces sharing a font file (regular and stroked bold) share its objects
+    font_ids, next_id = {}, 4
+    for face in faces.values():
+        key = getattr(face, 'font', face)
+        if key not in font_ids:
+            font_ids[key] = (next_id, face)
+            next_id += face.objects_needed
+    resources = b' '.join(b'/%s %d 0 R' % (font.encode(), font_ids[getattr(face, 'font', face)][0])
+                          for font, face in sorted(faces.items()))
+    kids = []
+    for number, lines in enumerate(pages):
+        page_id, content_id = next_id + 2 * number, next_id + 1 + 2 * number
+        objects[content_id] = stream_object(b'\n'.join(
+            show_text(faces[font], font, size, x, y, text) for font, size, x, y, text in lines))
+        objects[page_id] = (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+            b'/Resources << /Font << %s >> >> >>' % (PAGE_WIDTH, PAGE_HEIGHT, content_id, resources)
+        )
+        kids.append(b'%d 0 R' % page_id)
+    objects[2] = b'<< /Type /Pages /Kids [' + b' '.join(kids) + b'] /Count %d >>' % len(kids)
+    # After the pages, which is when every glyph the text uses is known
+    for first_id, face in font_ids.values():
+        objects.update(face.objects(first_id))
+    
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for object_id in range(1, len(objects) + 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % object_id + objects[object_id] + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class TextPdfRenderer:
+    """Default renderer: HTML text flow onto A4 pages
+    
+    ``font`` and ``bold_font`` are TrueType file paths, by default
+    ``RENDER_PDF_FONT`` and ``RENDER_PDF_BOLD_FONT``.
+    """
+    
+    name = 'text-pdf'
+    
+    def __init__(self, font=None, bold_font=None):
+        self.font = font
+        self.bold_font = bold_font
+    
+    def _fonts(self):
+        if self.font:
+            return self.font, self.bold_font
+        return font_paths['regular'], font_paths['bold']
+    
+    @property
+    def version(self):
+        """Changes with the font files, so a new font renders documents again"""
+        regular, bold = self._fonts()
+        if not regular:
+            return '1'
+        return '2:' + ':'.join(load_font(path).digest for path in (regular, bold) if path)
+    
+    def render(self, title, html):
+        parser = HtmlBlocks()
+        parser.feed(html or '')
+        blocks = parser.close()
+        regular, bold = self._fonts()
+        if regular:
+            faces = embedded_faces(regular, bold)
+        else:
+            faces = base_faces()
+            unsupported = set().union(*(faces['F1'].unsupported(text) for _, text in [('h1', title)] + blocks))
+            if unsupported:
+                raise UnsupportedText(
+                    f'The built-in PDF fonts cannot print {"".join(sorted(unsupported))[:20]!r}; '
+                    f'set RENDER_PDF_FONT to a TrueType font that covers them')
+        return write_pdf(title, layout(title, blocks, faces), faces)
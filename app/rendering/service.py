@@ -0,0 +1,239 @@
+"""Document rendering: renderer plug-in, process pool and on-disk cache.
+
+``GET /api/v1/documents/<id>/render.pdf`` goes through ``render_document``:
+
+- The output is stored under ``RENDER_CACHE_DIR`` by a SHA-256 key over
+  the renderer, the template version (its id and ``updated_at``) and the
+  document's name and content. Unchanged documents are never rendered
+  twice, and an edit to either the document or its template yields a new
+  key. The old file simply stops being used until ``flask render prune``
+  removes it.
+- Cache misses render on a process pool of ``RENDER_PROCESSES`` workers,
+  so a large document does not hold the GIL of a web worker. Concurrent
+  requests for the same key in one process share a single render. A
+  render that times out has its pool terminated and replaced, so a stuck
+  renderer cannot keep holding pool processes.
+- Cache hits are sent as the file itself, which WSGI servers with
+  ``wsgi.file_wrapper`` (gunicorn) copy to the socket with ``sendfile``.
+
+``RENDER_PDF_RENDERER`` names the renderer as ``module:attribute``, an
+object or class with ``name``, ``version`` and ``render(title, html)``
+returning PDF bytes. The default is the pure-Python ``TextPdfRenderer``,
+which needs ``RENDER_PDF_FONT`` for text outside Windows-1252 (Thai).
+"""
+import hashlib
+import importlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.rendering.pdf import configure_fonts
+
+DEFAULT_RENDERER = 'app.rendering.pdf:TextPdfRenderer'
+DEFAULT_PROCESSES = 2
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class RenderTimeout(Exception):
+    """The renderer did not finish within ``RENDER_TIMEOUT_SECONDS``"""
+
+
+_renderers = {}
+
+
+def load_renderer(path):
+    """Renderer instance named by ``module:attribute``, loaded once per process"""
+    renderer = _renderers.get(path)
+    if renderer is None:
+        module_name, _, attribute = path.partition(':')
+        renderer = getattr(importlib.import_module(module_name), attribute)
+        if isinstance(renderer, type):
+            renderer = renderer()
+        _renderers[path] = renderer
+    return renderer
+
+
+def _render(path, title, html):
+    # Runs in a pool process
+    return load_renderer(path).render(title, html)
+
+
+class RenderPool:
+    """Process pool for renders, created lazily in each process that uses it
+    
+    Gunicorn forks workers after ``--preload``. A pool inherited from the
+    master would be unusable in the children, so the pool is tied to the
+    pid that created it. With zero processes, renders run inline.
+    """
+    
+    def __init__(self):
+        self.processes = DEFAULT_PROCESSES
+        self._executor = None
+        self._pid = None
+        self._pending = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, processes):
+        self.shutdown()
+        self.processes = processes
+    
+    def _current_executor(self):
+        # Called with the lock held
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            self._pid = os.getpid()
+        return self._executor
+    
+    def render(self, key, renderer_path, title, html, timeout):
+        """PDF bytes for ``key``; a render already running in this process for the same key is reused"""
+        if not self.processes:
+            return _render(renderer_path, title, html)
+        deadline = time.monotonic() + timeout
+        # A second try covers renders lost when another render's timeout recycled the pool
+        for attempt in range(2):
+            # Looked up and submitted under one lock, so two requests for a key never both submit
+            with self._lock:
+                entry = self._pending.get(key)
+                owner = entry is None
+                if owner:
+                    executor = self._current_executor()
+                    entry = (executor.submit(_render, renderer_path, title, html), executor)
+                    self._pending[key] = entry
+            future, executor = entry
+            if owner:
+                # Outside the lock: a future that is already done runs the callback at once
+                future.add_done_callback(lambda done: self._forget(key, done))
+            try:
+                return future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                self._recycle(executor)
+                raise RenderTimeout(key)
+            except BrokenProcessPool:
+                self._recycle(executor)
+                if attempt or time.monotonic() >= deadline:
+                    raise
+    
+    def _forget(self, key, future):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None and entry[0] is future:
+                del self._pending[key]
+    
+    def _recycle(self, executor):
+        """Terminate ``executor``'s processes, whatever they are running, and start afresh"""
+        with self._lock:
+            if self._executor is not executor:
+                # Already replaced by another thread
+                return
+            self._executor = None
+            for key in [key for key, (_, owner) in self._pending.items() if owner is executor]:
+                del self._pending[key]
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+    
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pending.clear()
+
+
+render_pool = RenderPool()
+
+
+def cache_dir(app):
+    return app.config.get('RENDER_CACHE_DIR') or os.path.join(app.instance_path, 'renders')
+
+
+def cache_path(app, key):
+    """Cached file for ``key``, fanned out over 256 directories"""
+    return os.path.join(cache_dir(app), key[:2], f'{key}.pdf')
+
+
+def render_key(renderer, document, template):
+    """Content address of a document's rendering"""
+    digest = hashlib.sha256()
+    template_version = f'{template.public_id}@{template.updated_at}' if template else ''
+    for part in (renderer.name, renderer.version, template_version, document.name, document.content):
+        value = (part or '').encode('utf-8')
+        # Length-prefixed, so no two different inputs hash the same byte string
+        digest.update(b'%d:' % len(value) + value)
+    return digest.hexdigest()
+
+
+def store(path, data):
+    """Write ``data`` to ``path`` atomically; readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def render_document(app, document):
+    """Render ``document`` (or reuse the cached file); returns ``(path, key)``"""
+    from app.observability.metrics import record_cache_lookup
+    
+    renderer_path = app.config.get('RENDER_PDF_RENDERER') or DEFAULT_RENDERER
+    key = render_key(load_renderer(renderer_path), document, document.template)
+    path = cache_path(app, key)
+    hit = os.path.exists(path)
+    record_cache_lookup('render', hit=hit)
+    if not hit:
+        data = render_pool.render(key, renderer_path, document.name, document.content,
+                                  app.config.get('RENDER_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS))
+        store(path, data)
+    return path, key
+
+
+def init_rendering(app):
+    # Before any pool process forks, so they inherit the font settings
+    configure_fonts(app.config.get('RENDER_PDF_FONT'), app.config.get('RENDER_PDF_BOLD_FONT'))
+    render_pool.configure(app.config.get('RENDER_PROCESSES', DEFAULT_PROCESSES))
+
+
+@click.group('render')
+def render_cli():
+    """Document rendering commands"""
+
+
+@render_cli.command('prune')
+@click.option('--max-bytes', type=int, default=None, help='defaults to RENDER_CACHE_MAX_BYTES')
+@with_appcontext
+def prune_command(max_bytes):
+    """Delete the least recently used rendered files until the cache fits"""
+    if max_bytes is None:
+        max_bytes = current_app.config.get('RENDER_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+    files = []
+    for root, _, names in os.walk(cache_dir(current_app)):
+        for name in names:
+            if name.endswith('.part'):
+                continue
+            stat = os.stat(os.path.join(root, name))
+            files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, os.path.join(root, name)))
+    size = sum(file_size for _, file_size, _ in files)
+    removed = 0
+    for _, file_size, path in sorted(files):
+        if size <= max_bytes:
+            break
+        os.unlink(path)
+        size -= file_size
+        removed += 1
+    click.echo(f'Removed {removed} rendered files, {size} bytes left')
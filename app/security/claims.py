@@ -0,0 +1,117 @@
+"""Claims-based authorization backed by a cached token deny-list.
+
+Access tokens carry the user's id, username, email and role, so handlers that
+only need to know *who* is calling can read the signed claims instead of
+loading the ``User`` row. Revoked tokens are recorded in the
+``revoked_tokens`` table by ``jti``; every worker keeps an in-memory copy of
+the unexpired entries and re-reads them at most every
+``JWT_REVOCATION_REFRESH_SECONDS``, so a revocation reaches all workers within
+that window without a query per request. The whole unexpired set is re-read
+rather than the rows after an id watermark: ids are assigned before commit,
+so a row committed late can have a lower id than one already seen. Entries
+leave the table when their token expires, which keeps the set small.
+"""
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, jsonify
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from app import db
+
+DEFAULT_REFRESH_SECONDS = 5
+
+
+class RevocationList:
+    """Per-process cache of revoked token ids"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = {}
+        self._loaded_at = 0.0
+    
+    def _refresh(self):
+        """Re-read every unexpired revocation"""
+        from app.api.v1.models.models import RevokedToken
+        
+        now = datetime.utcnow()
+        rows = db.session.query(RevokedToken.jti, RevokedToken.expires_at) \
+            .filter(RevokedToken.expires_at > now).all()
+        # Merged rather than replaced, so revocations added locally survive a lagging replica
+        self._expires.update(rows)
+        
+        # Tokens past their expiry are rejected by the signature check anyway
+        self._expires = {jti: exp for jti, exp in self._expires.items() if exp > now}
+    
+    def is_revoked(self, jti):
+        """Check a token id against the deny-list, refreshing it if stale"""
+        refresh = current_app.config.get('JWT_REVOCATION_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= refresh:
+                self._refresh()
+                self._loaded_at = time.monotonic()
+            return jti in self._expires
+    
+    def add(self, jti, expires_at):
+        """Record a revocation locally so this worker sees it immediately"""
+        with self._lock:
+            self._expires[jti] = expires_at
+    
+    def clear(self):
+        """Forget all cached state"""
+        with self._lock:
+            self._expires = {}
+            self._loaded_at = 0.0
+
+
+revocation_list = RevocationList()
+
+
+def revoke_token(jti, expires_at):
+    """Add a token to the deny-list and drop entries that have expired"""
+    from app.api.v1.models.models import RevokedToken
+    
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete()
+    RevokedToken(jti=jti, expires_at=expires_at).save()
+    revocation_list.add(jti, expires_at)
+
+
+def register_token_callbacks(jwt_manager):
+    """Hook the deny-list into flask_jwt_extended"""
+    revocation_list.clear()
+    
+    @jwt_manager.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return revocation_list.is_revoked(jwt_payload['jti'])
+
+
+def current_claims():
+    """Get the identity claims of the current token"""
+    return get_jwt_identity()
+
+
+def current_user_id():
+    """Get the current user's database id, preferring the token claim"""
+    identity = get_jwt_identity()
+    if 'id' in identity:
+        return identity['id']
+    
+    # Tokens issued before the id claim existed
+    from app.api.v1.models.models import User
+    user = User.query.filter_by(public_id=identity['sub']).first()
+    return user.id if user else None
+
+
+def role_required(*roles):
+    """Require a valid token whose role claim is one of ``roles``"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            verify_jwt_in_request()
+            if get_jwt_identity().get('role') not in roles:
+                return jsonify({"error": "Insufficient permissions"}), 403
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+"""Password hashing on a bounded process pool.
+
+PBKDF2 and scrypt are deliberately CPU bound, so running them on the request
+thread stalls a sync worker for the whole computation. Hashing is handed to a
+small per-process ``ProcessPoolExecutor`` instead; a semaphore caps how many
+jobs may be running or queued so an overloaded pool fails fast with
+``PasswordHasherBusy`` (mapped to 503 by the auth routes) rather than piling
+up requests behind it.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:260000'
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 8
+DEFAULT_TIMEOUT = 10
+
+SALT_CHARS = string.ascii_letters + string.digits
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_pool_pid = None
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool has no free slot"""
+
+
+def _scrypt_hash(password, method, salt=None):
+    """Hash a password with scrypt using the ``scrypt:n:r:p$salt$hash`` format"""
+    _, n, r, p = method.split(':')
+    n, r, p = int(n), int(r), int(p)
+    if salt is None:
+        salt = ''.join(secrets.choice(SALT_CHARS) for _ in range(16))
+    digest = hashlib.scrypt(
+        password.encode('utf-8'), salt=salt.encode('utf-8'),
+        n=n, r=r, p=p, maxmem=132 * n * r * p
+    )
+    return f'{method}${salt}${digest.hex()}'
+
+
+def _hash(password, method):
+    """Hash a password (runs inside the pool)"""
+    if method.startswith('scrypt:'):
+        return _scrypt_hash(password, method)
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    """Check a password against a stored hash (runs inside the pool)"""
+    if pwhash.startswith('scrypt:'):
+        try:
+            method, salt, _ = pwhash.split('$', 2)
+        except ValueError:
+            return False
+        return hmac.compare_digest(_scrypt_hash(password, method, salt), pwhash)
+    return check_password_hash(pwhash, password)
+
+
+def _get_pool(config):
+    """Return this process's pool, creating it after a fork if needed"""
+    global _pool, _slots, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+            depth = config.get('PASSWORD_HASH_QUEUE_DEPTH', DEFAULT_QUEUE_DEPTH)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _slots = threading.BoundedSemaphore(workers + depth)
+            _pool_pid = os.getpid()
+        return _pool, _slots
+
+
+def _reset_pool(pool):
+    """Shut down a broken pool so the next call starts a fresh one"""
+    global _pool
+    with _lock:
+        if _pool is not pool:
+            # Already replaced by another thread
+            return
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(func, *args):
+    """Run ``func`` on the hashing pool, or inline when the pool is disabled"""
+    config = current_app.config
+    if not config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS):
+        return func(*args)
+    
+    pool, slots = _get_pool(config)
+    if not slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    
+    try:
+        future = pool.submit(func, *args)
+    except BrokenProcessPool:
+        slots.release()
+        _reset_pool(pool)
+        raise PasswordHasherBusy()
+    
+    # The slot is held until the job finishes, even if we stop waiting for it
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT))
+    except FutureTimeoutError:
+        raise PasswordHasherBusy()
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise PasswordHasherBusy()
+
+
+def current_method():
+    """Get the configured hashing method"""
+    return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+
+def hash_password(password):
+    """Hash a password with the configured method"""
+    return _run(_hash, password, current_method())
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash"""
+    return _run(_verify, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Check if a stored hash was made with a different method than configured"""
+    return pwhash.split('$', 1)[0] != current_method()
+
+
+@click.group('passwords')
+def passwords_cli():
+    """Password hashing commands"""
+
+
+@passwords_cli.command('benchmark')
+@click.option('--method', 'methods', multiple=True,
+              help='Method to time, e.g. scrypt:32768:8:1 (repeatable)')
+@click.option('--rounds', default=5, show_default=True, help='Hashes per method')
+@with_appcontext
+def benchmark_command(methods, rounds):
+    """Time hashing methods to pick PASSWORD_HASH_METHOD"""
+    methods = methods or (current_method(), DEFAULT_METHOD, 'scrypt:32768:8:1')
+    for method in dict.fromkeys(methods):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            _hash('benchmark-password', method)
+        elapsed = (time.perf_counter() - start) / rounds
+        marker = ' (configured)' if method == current_method() else ''
+        click.echo(f'{method}: {elapsed * 1000:.1f} ms/hash{marker}')
@@ -0,0 +1,100 @@
+"""Cache of verified JWTs for hot, polling-heavy endpoints.
+
+``@jwt_required()`` decodes the bearer token and verifies its HMAC signature
+on every request. Polling clients present the same token thousands of times,
+so ``CachingJWTManager`` remembers the decoded claims of tokens it has already
+verified, keyed by a digest of the raw token. Entries are bounded (LRU) and a
+cached token is re-verified once its ``exp`` has passed, so expiry still
+produces the normal ``ExpiredSignatureError`` path. Revocation is unaffected:
+the blocklist callback runs after decoding either way.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask_jwt_extended import JWTManager
+
+from app.observability.metrics import record_cache_lookup
+
+DEFAULT_CACHE_SIZE = 1024
+
+
+class TokenCache:
+    """Bounded LRU mapping of token digest to decoded claims"""
+    
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+    
+    @staticmethod
+    def key(encoded_token):
+        """Digest a raw token so the cache never holds bearer credentials"""
+        return hashlib.sha256(encoded_token.encode('utf-8')).digest()
+    
+    def get(self, key):
+        """Get cached claims, dropping them once the token has expired"""
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None:
+                self.misses += 1
+                record_cache_lookup('jwt_decode', hit=False)
+                return None
+            
+            exp = claims.get('exp')
+            if exp is not None and exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                record_cache_lookup('jwt_decode', hit=False)
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache_lookup('jwt_decode', hit=True)
+            return claims
+    
+    def put(self, key, claims):
+        """Cache verified claims, evicting the least recently used entry"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all entries and counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager that skips signature verification for recently verified tokens"""
+    
+    def __init__(self, app=None, add_context_processor=False):
+        self.token_cache = TokenCache()
+        super().__init__(app, add_context_processor)
+    
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+        # A new app may use a different secret, so start from scratch
+        self.token_cache.clear()
+        self.token_cache.maxsize = app.config.get('JWT_DECODE_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        # CSRF and expired-token decodes are rare and have extra checks; don't cache them
+        if csrf_value is not None or allow_expired or self.token_cache.maxsize <= 0:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        
+        key = self.token_cache.key(encoded_token)
+        claims = self.token_cache.get(key)
+        if claims is None:
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+            self.token_cache.put(key, claims)
+        return dict(claims)
@@ -0,0 +1,8 @@
+from dotenv import load_dotenv
+from app.asgi import create_asgi_app
+
+# Load environment variables
+load_dotenv()
+
+# Create ASGI application instance (run with: uvicorn asgi:app)
+app = create_asgi_app()
@@ -0,0 +1,510 @@
+"""Latency of every API route against a large seeded database.
+
+Seeds the database given by ``--db`` with ``benchmarks.seed`` if it does not
+exist yet. Then runs one scenario per route in ``app/api/v1/routes/``
+through the Flask test client and reports these timings per route:
+min/median/mean/p95/max, plus the SQL statement count from the
+``Server-Timing`` header. Any setup a scenario needs, such as a fresh row
+to delete, a fresh token to log out or a finished job to fetch, is done
+outside the timed call.
+
+Some routes do their work outside the request, so only the request is timed.
+``POST /documents/export`` and ``POST /documents/bulk-transition`` are timed
+up to the queued job's ``202``. ``GET /stations/<id>/events`` is timed up to
+the first line of the stream. ``GET /documents/<id>/render.pdf`` is timed
+twice: once for a cached file and once for a fresh document that has to be
+rendered. Rendered files and job results go to a temporary directory.
+
+Results are written as JSON and tagged with the git commit. Compare two runs
+with ``--compare``; the exit status is 1 when a route's median regressed by
+more than ``--fail-threshold`` percent.
+
+Usage (from the project root):
+    python -m benchmarks.bench_routes --db /tmp/bench.db [--scale 0.01] [--iterations 50]
+        [--only documents] [--heavy] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from app import db
+from app.api.v1.models.models import Document, Flow, FlowStep, Job, Station, Template
+from app.jobs.queue import run_job
+from benchmarks.seed import BENCH_PASSWORD, BENCH_USERNAME, build_app, seed
+
+API = '/api/v1'
+SAMPLE_SIZE = 1000
+
+SCENARIOS = []
+
+
+def scenario(name, heavy=False):
+    """Register ``func(ctx) -> (method, url, json)`` as the benchmark for ``name``"""
+    def decorator(func):
+        SCENARIOS.append((name, heavy, func))
+        return func
+    return decorator
+
+
+class Context:
+    """Seeded ids and helpers shared by the scenarios"""
+    
+    def __init__(self, app, client, rng):
+        self.app = app
+        self.client = client
+        self.rng = rng
+        self.counter = itertools.count()
+        self.token = self.login()
+        self.headers = {'Authorization': f'Bearer {self.token}'}
+        
+        with app.app_context():
+            self.ids = {
+                'documents': self.sample(Document),
+                'templates': self.sample(Template),
+                'stations': self.sample(Station),
+                'flows': self.sample(Flow),
+            }
+            self.station_ids = [row.id for row in Station.query.with_entities(Station.id)]
+            self.template_ids = [row.id for row in Template.query.with_entities(Template.id).limit(SAMPLE_SIZE)]
+            self.steps = [
+                (flow_public_id, step_public_id)
+                for flow_public_id, step_public_id in db.session.query(Flow.public_id, FlowStep.public_id)
+                .join(FlowStep, FlowStep.flow_id == Flow.id).limit(SAMPLE_SIZE)
+            ]
+    
+    def sample(self, model):
+        rows = model.query.with_entities(model.public_id).order_by(model.id).limit(SAMPLE_SIZE * 10).all()
+        return [row.public_id for row in self.rng.sample(rows, min(len(rows), SAMPLE_SIZE))]
+    
+    def login(self, username=BENCH_USERNAME, password=BENCH_PASSWORD):
+        response = self.client.post(f'{API}/auth/login', json={'username': username, 'password': password})
+        return response.get_json()['access_token']
+    
+    def pick(self, kind):
+        return self.rng.choice(self.ids[kind])
+    
+    def unique(self, prefix):
+        return f'{prefix}-{os.getpid()}-{next(self.counter)}'
+    
+    def create(self, url, body):
+        """Create a row through the API (untimed) and return its public id"""
+        response = self.client.post(url, json=body, headers=self.headers)
+        return response.get_json()['public_id']
+    
+    def new_document(self):
+        return self.create(f'{API}/documents', {
+            'name': self.unique('bench-doc'), 'content': '<p>bench</p>',
+            'template_id': self.rng.choice(self.template_ids),
+        })
+    
+    def new_station(self):
+        return self.create(f'{API}/stations', {'name': self.unique('bench-station'), 'type': 'review'})
+    
+    def new_flow(self):
+        return self.create(f'{API}/flows', {'name': self.unique('bench-flow')})
+    
+    def new_template(self):
+        return self.create(f'{API}/templates/', {'name': self.unique('bench-template'), 'content': '<p>x</p>'})
+    
+    def new_step(self):
+        flow_id = self.new_flow()
+        step_id = self.create(f'{API}/flows/{flow_id}/steps', self.step_body(flow_id))
+        return flow_id, step_id
+    
+    def step_body(self, flow_public_id):
+        from_id, to_id = self.rng.sample(self.station_ids, 2)
+        return {'flow_id': 0, 'from_station_id': from_id, 'to_station_id': to_id}
+    
+    def new_job(self):
+        """Queue a small export through the API and return the job's public id"""
+        return self.create(f'{API}/documents/export', {'station_id': self.pick('stations')})
+    
+    def finished_job(self):
+        """Public id of an export that has run, queued and run once per benchmark"""
+        if not hasattr(self, '_finished_job'):
+            public_id = self.new_job()
+            with self.app.app_context():
+                run_job(self.app, Job.query.filter_by(public_id=public_id).one())
+            self._finished_job = public_id
+        return self._finished_job
+    
+    def rendered_document(self):
+        """Public id of a document whose PDF is in the render cache"""
+        if not hasattr(self, '_rendered_document'):
+            public_id = self.pick('documents')
+            self.client.get(f'{API}/documents/{public_id}/render.pdf', headers=self.headers).close()
+            self._rendered_document = public_id
+        return self._rendered_document
+
+
+# Auth
+
+@scenario('POST /auth/register')
+def auth_register(ctx):
+    name = ctx.unique('bench-user')
+    return 'POST', f'{API}/auth/register', {'username': name, 'email': f'{name}@example.com',
+                                           'password': BENCH_PASSWORD}
+
+
+@scenario('POST /auth/login')
+def auth_login(ctx):
+    return 'POST', f'{API}/auth/login', {'username': BENCH_USERNAME, 'password': BENCH_PASSWORD}
+
+
+@scenario('GET /auth/me')
+def auth_me(ctx):
+    return 'GET', f'{API}/auth/me', None
+
+
+@scenario('POST /auth/logout')
+def auth_logout(ctx):
+    return 'POST', f'{API}/auth/logout', None, {'Authorization': f'Bearer {ctx.login()}'}
+
+
+# Documents
+
+@scenario('GET /documents', heavy=True)
+def documents_list(ctx):
+    return 'GET', f'{API}/documents', None
+
+
+@scenario('GET /documents?status&station_id')
+def documents_list_filtered(ctx):
+    return 'GET', f'{API}/documents?status=submitted&station_id={ctx.pick("stations")}', None
+
+
+@scenario('GET /documents/<id>')
+def documents_get(ctx):
+    return 'GET', f'{API}/documents/{ctx.pick("documents")}', None
+
+
+@scenario('POST /documents')
+def documents_create(ctx):
+    return 'POST', f'{API}/documents', {'name': ctx.unique('bench-doc'), 'content': '<p>bench</p>',
+                                        'template_id': ctx.rng.choice(ctx.template_ids)}
+
+
+@scenario('PUT /documents/<id>')
+def documents_update(ctx):
+    return 'PUT', f'{API}/documents/{ctx.pick("documents")}', {'name': ctx.unique('bench-doc')}
+
+
+@scenario('PUT /documents/<id> (advance station)')
+def documents_advance(ctx):
+    return 'PUT', f'{API}/documents/{ctx.pick("documents")}', {'current_station_id': ctx.rng.choice(ctx.station_ids)}
+
+
+@scenario('DELETE /documents/<id>')
+def documents_delete(ctx):
+    return 'DELETE', f'{API}/documents/{ctx.new_document()}', None
+
+
+@scenario('GET /documents/<id>/history')
+def documents_history(ctx):
+    return 'GET', f'{API}/documents/{ctx.pick("documents")}/history', None
+
+
+@scenario('GET /documents/<id>/render.pdf (cached)')
+def documents_render_cached(ctx):
+    return 'GET', f'{API}/documents/{ctx.rendered_document()}/render.pdf', None
+
+
+@scenario('GET /documents/<id>/render.pdf (render)')
+def documents_render(ctx):
+    return 'GET', f'{API}/documents/{ctx.new_document()}/render.pdf', None
+
+
+@scenario('POST /documents/export')
+def documents_export(ctx):
+    return 'POST', f'{API}/documents/export', {'station_id': ctx.pick('stations')}
+
+
+@scenario('POST /documents/bulk-transition')
+def documents_bulk_transition(ctx):
+    return 'POST', f'{API}/documents/bulk-transition', {
+        'document_ids': ctx.rng.sample(ctx.ids['documents'], min(10, len(ctx.ids['documents']))),
+        'status': 'submitted',
+    }
+
+
+# Flows
+
+@scenario('GET /flows')
+def flows_list(ctx):
+    return 'GET', f'{API}/flows', None
+
+
+@scenario('GET /flows/<id>')
+def flows_get(ctx):
+    return 'GET', f'{API}/flows/{ctx.pick("flows")}', None
+
+
+@scenario('POST /flows')
+def flows_create(ctx):
+    return 'POST', f'{API}/flows', {'name': ctx.unique('bench-flow')}
+
+
+@scenario('PUT /flows/<id>')
+def flows_update(ctx):
+    return 'PUT', f'{API}/flows/{ctx.pick("flows")}', {'description': ctx.unique('bench')}
+
+
+@scenario('DELETE /flows/<id>')
+def flows_delete(ctx):
+    return 'DELETE', f'{API}/flows/{ctx.new_flow()}', None
+
+
+@scenario('GET /flows/<id>/steps')
+def flow_steps_list(ctx):
+    return 'GET', f'{API}/flows/{ctx.pick("flows")}/steps', None
+
+
+@scenario('POST /flows/<id>/steps')
+def flow_steps_create(ctx):
+    flow_id = ctx.pick('flows')
+    return 'POST', f'{API}/flows/{flow_id}/steps', ctx.step_body(flow_id)
+
+
+@scenario('PUT /flows/<id>/steps/<step_id>')
+def flow_steps_update(ctx):
+    flow_id, step_id = ctx.rng.choice(ctx.steps)
+    return 'PUT', f'{API}/flows/{flow_id}/steps/{step_id}', {'condition': ctx.unique('bench')}
+
+
+@scenario('DELETE /flows/<id>/steps/<step_id>')
+def flow_steps_delete(ctx):
+    flow_id, step_id = ctx.new_step()
+    return 'DELETE', f'{API}/flows/{flow_id}/steps/{step_id}', None
+
+
+# Stations
+
+@scenario('GET /stations')
+def stations_list(ctx):
+    return 'GET', f'{API}/stations', None
+
+
+@scenario('GET /stations/<id>')
+def stations_get(ctx):
+    return 'GET', f'{API}/stations/{ctx.pick("stations")}', None
+
+
+@scenario('POST /stations')
+def stations_create(ctx):
+    return 'POST', f'{API}/stations', {'name': ctx.unique('bench-station'), 'type': 'review'}
+
+
+@scenario('PUT /stations/<id>')
+def stations_update(ctx):
+    return 'PUT', f'{API}/stations/{ctx.pick("stations")}', {'description': ctx.unique('bench')}
+
+
+@scenario('DELETE /stations/<id>')
+def stations_delete(ctx):
+    return 'DELETE', f'{API}/stations/{ctx.new_station()}', None
+
+
+@scenario('GET /stations/<id>/documents')
+def stations_documents(ctx):
+    return 'GET', f'{API}/stations/{ctx.pick("stations")}/documents', None
+
+
+@scenario('GET /stations/<id>/events')
+def stations_events(ctx):
+    return 'GET', f'{API}/stations/{ctx.pick("stations")}/events', None
+
+
+# Templates
+
+@scenario('GET /templates')
+def templates_list(ctx):
+    return 'GET', f'{API}/templates/', None
+
+
+@scenario('GET /templates/<id>')
+def templates_get(ctx):
+    return 'GET', f'{API}/templates/{ctx.pick("templates")}', None
+
+
+@scenario('POST /templates')
+def templates_create(ctx):
+    return 'POST', f'{API}/templates/', {'name': ctx.unique('bench-template'), 'content': '<p>x</p>'}
+
+
+@scenario('PUT /templates/<id>')
+def templates_update(ctx):
+    return 'PUT', f'{API}/templates/{ctx.pick("templates")}', {'description': ctx.unique('bench')}
+
+
+@scenario('DELETE /templates/<id>')
+def templates_delete(ctx):
+    return 'DELETE', f'{API}/templates/{ctx.new_template()}', None
+
+
+# Change log, jobs and analytics
+
+@scenario('GET /changes')
+def changes_list(ctx):
+    return 'GET', f'{API}/changes', None
+
+
+@scenario('GET /jobs')
+def jobs_list(ctx):
+    return 'GET', f'{API}/jobs', None
+
+
+@scenario('GET /jobs/<id>')
+def jobs_get(ctx):
+    return 'GET', f'{API}/jobs/{ctx.finished_job()}', None
+
+
+@scenario('GET /jobs/<id>/result')
+def jobs_result(ctx):
+    return 'GET', f'{API}/jobs/{ctx.finished_job()}/result', None
+
+
+@scenario('POST /jobs/<id>/cancel')
+def jobs_cancel(ctx):
+    return 'POST', f'{API}/jobs/{ctx.new_job()}/cancel', None
+
+
+@scenario('GET /analytics/stations')
+def analytics_stations(ctx):
+    return 'GET', f'{API}/analytics/stations', None
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def query_count(response):
+    """Statement count from the ``Server-Timing`` db metric"""
+    timing = response.headers.get('Server-Timing', '')
+    if 'desc="' not in timing:
+        return None
+    return int(timing.split('desc="', 1)[1].split(' ', 1)[0])
+
+
+def run_scenario(ctx, func, iterations, warmup):
+    timings, queries, statuses = [], [], set()
+    for index in range(warmup + iterations):
+        method, url, body, *headers = func(ctx)
+        headers = headers[0] if headers else ctx.headers
+        started = time.perf_counter()
+        response = ctx.client.open(url, method=method, json=body, headers=headers)
+        elapsed = time.perf_counter() - started
+        # Ends event streams and releases sent files
+        response.close()
+        if index >= warmup:
+            timings.append(elapsed * 1000)
+            queries.append(query_count(response))
+            statuses.add(response.status_code)
+    
+    timings.sort()
+    counted = [count for count in queries if count is not None]
+    return {
+        'iterations': iterations,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'max_ms': round(timings[-1], 3),
+        'stdev_ms': round(statistics.stdev(timings), 3) if len(timings) > 1 else 0.0,
+        'queries': max(counted) if counted else None,
+        'statuses': sorted(statuses),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print median changes against a previous run; return regressed routes"""
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)['results']
+    regressed = []
+    print(f'\n{"route":<45}{"before":>10}{"after":>10}{"change":>9}')
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+        flag = ' !' if change > threshold else ''
+        print(f'{name:<45}{before["median_ms"]:>10.2f}{result["median_ms"]:>10.2f}{change:>8.1f}%{flag}')
+        if flag:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite path or SQLAlchemy URL; seeded if the file is missing')
+    parser.add_argument('--scale', type=float, default=1.0, help='dataset scale used when seeding')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', help='run scenarios whose name contains this text')
+    parser.add_argument('--heavy', action='store_true', help='include unpaginated full-table listings')
+    parser.add_argument('--output', default='bench-routes.json')
+    parser.add_argument('--compare', help='previous results file to compare medians against')
+    parser.add_argument('--fail-threshold', type=float, default=20.0, help='percent median slowdown that fails')
+    args = parser.parse_args()
+    
+    db_url = args.db if '://' in args.db else f'sqlite:///{args.db}'
+    if '://' not in args.db and not os.path.exists(args.db):
+        print(f'seeding {args.db} at scale {args.scale}...')
+        seed(db_url, args.scale, args.seed)
+    
+    app = build_app(db_url)
+    scratch = tempfile.mkdtemp(prefix='bench-routes-')
+    app.config.update(RENDER_CACHE_DIR=os.path.join(scratch, 'renders'), JOBS_DIR=os.path.join(scratch, 'jobs'))
+    ctx = Context(app, app.test_client(), random.Random(args.seed))
+    
+    results = {}
+    print(f'{"route":<45}{"median":>10}{"p95":>10}{"queries":>9}')
+    for name, heavy, func in SCENARIOS:
+        if (heavy and not args.heavy) or (args.only and args.only not in name):
+            continue
+        result = run_scenario(ctx, func, args.iterations, args.warmup)
+        results[name] = result
+        print(f'{name:<45}{result["median_ms"]:>10.2f}{result["p95_ms"]:>10.2f}{str(result["queries"]):>9}')
+    shutil.rmtree(scratch, ignore_errors=True)
+    
+    with app.app_context():
+        dataset = {table: db.session.execute(db.text(f'SELECT COUNT(*) FROM {table}')).scalar()
+                   for table in ('documents', 'document_history', 'templates', 'flows', 'stations', 'users')}
+    with open(args.output, 'w') as fh:
+        json.dump({
+            'meta': {
+                'commit': git_commit(),
+                'created_at': datetime.utcnow().isoformat() + 'Z',
+                'python': platform.python_version(),
+                'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[0],
+                'dataset': dataset,
+                'iterations': args.iterations,
+            },
+            'results': results,
+        }, fh, indent=2, sort_keys=True)
+    print(f'\nwrote {args.output}')
+    
+    if args.compare and compare(results, args.compare, args.fail_threshold):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Concurrent read/write throughput on SQLite, default vs production profile.
+
+Starts several worker processes against one SQLite file, each running a mix
+of reads and ``Base.save`` writes for a fixed time, and reports operations
+per second and "database is locked" failures for each profile.
+
+Usage (from the project root):
+    python -m benchmarks.bench_sqlite_profile [--workers 8] [--seconds 5] [--write-ratio 0.2]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.api.v1.models.models import Template
+
+
+def build_app(db_path, profile):
+    return create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'bench-key',
+        'JWT_SECRET_KEY': 'jwt-bench-key',
+        'SQLITE_PROFILE': profile,
+        'PASSWORD_HASH_WORKERS': 0
+    })
+
+
+def worker(db_path, profile, seconds, write_ratio, results):
+    """Run the read/write mix and report (reads, writes, errors)"""
+    app = build_app(db_path, profile)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    with app.app_context():
+        while time.monotonic() < deadline:
+            try:
+                if random.random() < write_ratio:
+                    Template(name=f'bench-{os.getpid()}-{writes}', content='<p>x</p>').save()
+                    writes += 1
+                else:
+                    Template.query.order_by(Template.id.desc()).limit(20).all()
+                    db.session.commit()
+                    reads += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+    results.put((reads, writes, errors))
+
+
+def run_profile(profile, workers, seconds, write_ratio):
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    try:
+        # Create the schema once before the workers race for it
+        build_app(db_path, profile)
+        
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker, args=(db_path, profile, seconds, write_ratio, results))
+            for _ in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        totals = [sum(values) for values in zip(*(results.get() for _ in procs))]
+        for proc in procs:
+            proc.join()
+        return totals
+    finally:
+        os.close(db_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+    
+    print(f'{"profile":<12}{"reads/s":>10}{"writes/s":>10}{"locked":>8}')
+    for profile in ('default', 'production'):
+        reads, writes, errors = run_profile(profile, args.workers, args.seconds, args.write_ratio)
+        print(f'{profile:<12}{reads / args.seconds:>10.0f}{writes / args.seconds:>10.0f}{errors:>8}')
+
+
+if __name__ == '__main__':
+    main()
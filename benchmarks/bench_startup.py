@@ -0,0 +1,111 @@
+"""Worker start-up cost: imports, create_app and forking a preloaded app.
+
+Every measurement runs in a fresh interpreter, as a newly spawned worker
+would:
+
+- ``import``: importing the ``app`` package.
+- ``create_app``: building the app, with and without ``AUTO_CREATE_SCHEMA``.
+- ``first request``: serving ``/health`` straight after start-up.
+- ``preload fork``: time from ``os.fork()`` of an app built in the parent
+  (``gunicorn --preload``) to the child's first query and response.
+
+The slowest imports, from ``python -X importtime``, are listed at the end.
+
+Usage (from the project root):
+    python -m benchmarks.bench_startup [--runs 5] [--top 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+COLD_START = '''
+import json, os, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/health')
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first request': served - created,
+}))
+'''
+
+PRELOAD_FORK = '''
+import json, os, time
+from sqlalchemy import text
+from app import create_app, db
+app = create_app()
+app.test_client().get('/health')
+read_fd, write_fd = os.pipe()
+forked = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    with app.app_context():
+        db.session.execute(text('SELECT 1'))  # on a fresh pool, not the parent's connection
+    app.test_client().get('/health')
+    os.write(write_fd, str(time.perf_counter() - forked).encode())
+    os._exit(0)
+os.waitpid(pid, 0)
+print(json.dumps({'preload fork': float(os.read(read_fd, 64))}))
+'''
+
+
+def run_snippet(code, env):
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    """``(cumulative seconds, module)`` of the slowest top-level imports"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'from app import create_app; create_app()'],
+                            env=env, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Top-level imports and what they pull in directly, not deeper internals
+        if not name.startswith('     '):
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    base_env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', PYTHONDONTWRITEBYTECODE='1')
+    try:
+        scenarios = [
+            ('cold start, schema on boot', COLD_START, dict(base_env, AUTO_CREATE_SCHEMA='true')),
+            ('cold start', COLD_START, dict(base_env, AUTO_CREATE_SCHEMA='false')),
+            ('preload', PRELOAD_FORK, dict(base_env, AUTO_CREATE_SCHEMA='true')),
+        ]
+        print(f'{"scenario":<28}{"step":<16}{"median ms":>10}{"min ms":>10}')
+        for label, code, env in scenarios:
+            runs = [run_snippet(code, env) for _ in range(args.runs)]
+            for step in runs[0]:
+                values = [run[step] * 1000 for run in runs]
+                print(f'{label:<28}{step:<16}{statistics.median(values):>10.1f}{min(values):>10.1f}')
+        
+        print('\nslowest imports during start-up:')
+        for seconds, name in slowest_imports(base_env, args.top):
+            print(f'{seconds * 1000:>8.1f} ms  {name}')
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+if __name__ == '__main__':
+    main()
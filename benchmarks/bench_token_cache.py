@@ -0,0 +1,79 @@
+"""Micro-benchmark for JWT verification overhead per request.
+
+Times ``decode_token`` and a full request to a ``@jwt_required()`` endpoint
+with the verified-token cache disabled and enabled.
+
+Usage (from the project root):
+    python -m benchmarks.bench_token_cache [--iterations 5000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from flask_jwt_extended import create_access_token, decode_token, jwt_required
+
+from app import create_app, db, jwt
+
+
+def build_app(db_path, cache_size):
+    """Create an app with one protected endpoint"""
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'bench-key',
+        'JWT_SECRET_KEY': 'jwt-bench-key-with-enough-length-for-hs256',
+        'JWT_DECODE_CACHE_SIZE': cache_size,
+        'PASSWORD_HASH_WORKERS': 0
+    })
+    
+    @app.route('/_bench/protected')
+    @jwt_required()
+    def protected():
+        return {"ok": True}
+    
+    return app
+
+
+def time_per_call(func, iterations):
+    """Mean wall time of ``func`` in microseconds"""
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(iterations):
+    db_fd, db_path = tempfile.mkstemp()
+    results = {}
+    try:
+        for label, cache_size in (('uncached', 0), ('cached', 1024)):
+            app = build_app(db_path, cache_size)
+            with app.app_context():
+                db.create_all()
+                token = create_access_token(identity={
+                    "sub": "bench", "id": 1, "username": "bench", "email": "bench@example.com", "role": "user"
+                })
+                decode_us = time_per_call(lambda: decode_token(token), iterations)
+            
+            client = app.test_client()
+            headers = {'Authorization': f'Bearer {token}'}
+            request_us = time_per_call(lambda: client.get('/_bench/protected', headers=headers), iterations)
+            results[label] = (decode_us, request_us, jwt.token_cache.hits)
+    finally:
+        os.close(db_fd)
+        os.unlink(db_path)
+    
+    print(f'{"mode":<10}{"decode (us)":>14}{"request (us)":>16}{"cache hits":>12}')
+    for label, (decode_us, request_us, hits) in results.items():
+        print(f'{label:<10}{decode_us:>14.1f}{request_us:>16.1f}{hits:>12}')
+    saved = results['uncached'][1] - results['cached'][1]
+    print(f'auth overhead saved per request: {saved:.1f} us')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=5000)
+    run(parser.parse_args().iterations)
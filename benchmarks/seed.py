@@ -0,0 +1,212 @@
+"""Seeded generator for large, realistic benchmark databases.
+
+Fills a database with users, templates, stations, flows with steps,
+documents and document history. The default volumes match a large
+deployment: 1M documents, 10M history rows, 500 templates and 50 flows.
+Everything is drawn from one ``random.Random(seed)``, so the same seed and
+scale always give the same rows and the same public ids. Results from
+different commits can then be compared.
+
+Rows go in as Core bulk inserts in chunks, so the full dataset is practical
+to build. ``--scale`` shrinks or grows the document and history tables
+for quicker or bigger runs.
+
+Usage (from the project root):
+    python -m benchmarks.seed --db /tmp/bench.db [--scale 0.01] [--seed 42]
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.api.v1.models.models import (Document, DocumentHistory, Flow, FlowStep, Station, Template,
+                                      User)
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench-password'
+
+DEFAULT_VOLUMES = {
+    'users': 200,
+    'templates': 500,
+    'stations': 40,
+    'flows': 50,
+    'documents': 1_000_000,
+    'history': 10_000_000,
+}
+SCALED_TABLES = ('documents', 'history')
+
+CHUNK_SIZE = 10_000
+EPOCH = datetime(2024, 1, 1)
+FIELD_TYPES = ('text', 'number', 'date', 'select')
+DOCUMENT_STATUSES = ('draft', 'submitted', 'approved', 'rejected')
+TEMPLATE_STATUSES = ('draft', 'active', 'active', 'active', 'archived')
+STATION_TYPES = ('approval', 'signature', 'review', 'archive')
+HISTORY_ACTIONS = ('created', 'updated', 'moved', 'moved', 'commented')
+
+
+def build_app(db_url):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': db_url,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'bench-key',
+        'JWT_SECRET_KEY': 'jwt-bench-key-with-enough-length-for-hs256',
+        'PASSWORD_HASH_WORKERS': 0
+    })
+
+
+def scaled_volumes(scale):
+    """Volumes for ``scale``; only the document tables shrink or grow"""
+    return {
+        table: max(1, int(count * scale)) if table in SCALED_TABLES else count
+        for table, count in DEFAULT_VOLUMES.items()
+    }
+
+
+class Seeder:
+    """Deterministic row factory for one dataset"""
+    
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+    
+    def public_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+    
+    def timestamp(self, after=EPOCH, days=365):
+        return after + timedelta(seconds=self.rng.randrange(days * 86400))
+    
+    def words(self, count):
+        return ' '.join(f'w{self.rng.randrange(5000)}' for _ in range(count))
+    
+    def base_row(self, row_id, created_at=None):
+        created_at = created_at or self.timestamp()
+        return {
+            'id': row_id,
+            'public_id': self.public_id(),
+            'created_at': created_at,
+            'updated_at': created_at + timedelta(seconds=self.rng.randrange(30 * 86400)),
+        }
+    
+    def users(self, count, password_hash):
+        rows = [dict(self.base_row(1), username=BENCH_USERNAME, email='bench@example.com',
+                     password_hash=password_hash, role='admin', is_active=True)]
+        for row_id in range(2, count + 1):
+            rows.append(dict(self.base_row(row_id), username=f'user{row_id}', email=f'user{row_id}@example.com',
+                             password_hash=password_hash, role='user', is_active=True))
+        return rows
+    
+    def templates(self, count, users):
+        rows = []
+        for row_id in range(1, count + 1):
+            fields = [
+                {'name': f'field_{n}', 'type': self.rng.choice(FIELD_TYPES), 'required': self.rng.random() < 0.5}
+                for n in range(self.rng.randint(3, 12))
+            ]
+            content = ''.join(f'<p>{self.words(8)} {{{{{field["name"]}}}}}</p>' for field in fields)
+            rows.append(dict(self.base_row(row_id), name=f'Template {row_id}', description=self.words(12),
+                             content=content, editable_fields=json.dumps(fields),
+                             status=self.rng.choice(TEMPLATE_STATUSES), created_by=self.rng.randint(1, users)))
+        return rows
+    
+    def stations(self, count):
+        return [
+            dict(self.base_row(row_id), name=f'Station {row_id}', description=self.words(10),
+                 type=self.rng.choice(STATION_TYPES), responsible_role=self.rng.choice(('user', 'admin', None)))
+            for row_id in range(1, count + 1)
+        ]
+    
+    def flows(self, count, users, stations):
+        flows, steps = [], []
+        for row_id in range(1, count + 1):
+            flows.append(dict(self.base_row(row_id), name=f'Flow {row_id}', description=self.words(10),
+                              is_active=self.rng.random() < 0.9, created_by=self.rng.randint(1, users)))
+            path = self.rng.sample(range(1, stations + 1), min(stations, self.rng.randint(3, 8)))
+            for order, (from_id, to_id) in enumerate(zip(path, path[1:])):
+                steps.append(dict(self.base_row(len(steps) + 1), flow_id=row_id, from_station_id=from_id,
+                                  to_station_id=to_id, condition=None, order=order))
+        return flows, steps
+    
+    def documents(self, start, stop, users, templates, stations):
+        for row_id in range(start, stop):
+            yield dict(self.base_row(row_id), name=f'Document {row_id}', content=f'<p>{self.words(40)}</p>',
+                       template_id=self.rng.randint(1, templates), status=self.rng.choice(DOCUMENT_STATUSES),
+                       current_station_id=self.rng.randint(1, stations) if self.rng.random() < 0.8 else None,
+                       created_by=self.rng.randint(1, users), tenant_id=None)
+    
+    def history(self, start, stop, users, documents, stations):
+        for row_id in range(start, stop):
+            yield dict(self.base_row(row_id), document_id=self.rng.randint(1, documents),
+                       action=self.rng.choice(HISTORY_ACTIONS), description=self.words(6),
+                       user_id=self.rng.randint(1, users), station_id=self.rng.randint(1, stations),
+                       tenant_id=None)
+
+
+def insert_chunks(conn, table, rows):
+    """Bulk insert an iterable of rows ``CHUNK_SIZE`` at a time"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            conn.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+
+
+def seed(db_url, scale=1.0, seed_value=42, progress=print):
+    """Create and fill the schema; returns the volumes written"""
+    from app.security.passwords import hash_password
+    
+    volumes = scaled_volumes(scale)
+    seeder = Seeder(seed_value)
+    app = build_app(db_url)
+    with app.app_context():
+        password_hash = hash_password(BENCH_PASSWORD)
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+        
+        with engine.begin() as conn:
+            insert_chunks(conn, User.__table__, seeder.users(volumes['users'], password_hash))
+            insert_chunks(conn, Template.__table__, seeder.templates(volumes['templates'], volumes['users']))
+            insert_chunks(conn, Station.__table__, seeder.stations(volumes['stations']))
+            flows, steps = seeder.flows(volumes['flows'], volumes['users'], volumes['stations'])
+            insert_chunks(conn, Flow.__table__, flows)
+            insert_chunks(conn, FlowStep.__table__, steps)
+        
+        for table, total, rows in (
+            (Document.__table__, volumes['documents'],
+             lambda start, stop: seeder.documents(start, stop, volumes['users'], volumes['templates'],
+                                                  volumes['stations'])),
+            (DocumentHistory.__table__, volumes['history'],
+             lambda start, stop: seeder.history(start, stop, volumes['users'], volumes['documents'],
+                                                volumes['stations'])),
+        ):
+            step = CHUNK_SIZE * 10
+            for start in range(1, total + 1, step):
+                stop = min(total + 1, start + step)
+                with engine.begin() as conn:
+                    insert_chunks(conn, table, rows(start, stop))
+                progress(f'{table.name}: {stop - 1}/{total}')
+    return volumes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite path or SQLAlchemy URL of an empty database')
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the default volumes')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    db_url = args.db if '://' in args.db else f'sqlite:///{args.db}'
+    started = time.perf_counter()
+    volumes = seed(db_url, args.scale, args.seed)
+    print(json.dumps(volumes))
+    print(f'seeded in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
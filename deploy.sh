@@ -38,6 +38,38 @@ fi
 # กำหนดจำนวน worker ตามจำนวน CPU
 WORKERS=$(python -c "import multiprocessing; print(multiprocessing.cpu_count() * 2 + 1)")
 
+# สร้างตารางที่ยังไม่มีก่อนเริ่ม worker (worker จะไม่ตรวจ schema ตอนเริ่มทำงาน)
+flask schema create
+
+# ไฟล์ metrics ที่ใช้ร่วมกันระหว่าง worker (ล้างทุกครั้งที่เริ่มใหม่)
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-$PROJECT_DIR/instance/prometheus}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# event ของ station ใช้ร่วมกันระหว่าง worker ผ่านไฟล์นี้
+export STATION_EVENTS_FILE="${STATION_EVENTS_FILE:-$PROJECT_DIR/instance/station-events.ndjson}"
+
+# ฟอนต์ไทยสำหรับ PDF (apt install fonts-tlwg-garuda-ttf) ถ้าไม่มี เอกสารภาษาไทยจะ render ไม่ได้
+GARUDA_DIR=/usr/share/fonts/truetype/tlwg
+if [ -z "$RENDER_PDF_FONT" ] && [ -f "$GARUDA_DIR/Garuda.ttf" ]; then
+    export RENDER_PDF_FONT="$GARUDA_DIR/Garuda.ttf"
+    if [ -f "$GARUDA_DIR/Garuda-Bold.ttf" ]; then
+        export RENDER_PDF_BOLD_FONT="${RENDER_PDF_BOLD_FONT:-$GARUDA_DIR/Garuda-Bold.ttf}"
+    fi
+fi
+
+# โหมด ASGI (./deploy.sh asgi) ใช้ uvicorn และ async SQLAlchemy สำหรับ endpoint อ่านเอกสาร
+if [ "$1" = "asgi" ]; then
+    echo "Starting Document Template API with Uvicorn (ASGI) on port 8531 with $WORKERS workers..."
+    uvicorn asgi:app --host 0.0.0.0 --port 8531 --workers $WORKERS --log-level info
+    exit $?
+fi
+
 # รัน Gunicorn
 echo "Starting Document Template API with Gunicorn on port 8531 with $WORKERS workers..."
-gunicorn --bind 0.0.0.0:8531 --workers $WORKERS --log-level info 'app:create_app()'
+# --preload สร้าง app ครั้งเดียวใน master แล้ว fork ไปยัง worker (connection pool ถูกแยกให้แต่ละ worker อัตโนมัติ)
+# worker แบบ gthread ให้ stream /stations/<id>/events แต่ละ connection ใช้แค่ thread เดียว ไม่กิน worker ทั้งตัว
+# แต่ stream ถือ thread ไว้ได้ถึง STATION_EVENTS_MAX_SECONDS จึงจำกัดไว้ที่ STATION_EVENTS_MAX_STREAMS (ค่าเริ่มต้น 8) ต่อ worker
+# ถ้าเพิ่มค่านี้ ให้เพิ่ม GUNICORN_THREADS ตาม เพื่อให้ยังเหลือ thread สำหรับ request ปกติ
+gunicorn --bind 0.0.0.0:8531 --workers $WORKERS --preload --log-level info \
+    --worker-class "${GUNICORN_WORKER_CLASS:-gthread}" --threads "${GUNICORN_THREADS:-16}" 'app:create_app()'
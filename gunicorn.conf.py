@@ -0,0 +1,9 @@
+"""Gunicorn settings picked up automatically from the project directory."""
+import os
+
+
+def child_exit(server, worker):
+    """Drop an exited worker's live gauges from the shared metrics files"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
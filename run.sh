@@ -29,6 +29,9 @@ if [ ! -f ".env" ]; then
     echo "DEBUG=True" >> .env
 fi
 
+# สร้างตารางที่ยังไม่มี
+flask schema create
+
 # รันแอพพลิเคชัน
 echo "Running Document Template API on port 8531..."
 python run.py
@@ -47,7 +47,7 @@ fi
 
 # จัดการฐานข้อมูล
 echo "🗄️ Setting up database..."
-python -c "from app import create_app, db; app = create_app(); app.app_context().push(); db.create_all()"
+flask schema create
 
 echo "✨ Project setup complete! ✨"
 echo "📝 API Documentation: http://localhost:8531/apidocs/"
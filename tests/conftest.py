@@ -0,0 +1,142 @@
+import pytest
+import os
+import shutil
+import tempfile
+from app import create_app, db
+from app.api.v1.models.models import Document, Flow, FlowStep, Station, Template, User
+
+@pytest.fixture
+def app():
+    """Create and configure a Flask app for testing"""
+    # Create a temporary file to isolate the database for each test
+    db_fd, db_path = tempfile.mkstemp()
+    
+    # Create the app with test config
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-key',
+        'JWT_SECRET_KEY': 'jwt-test-key',
+        'METRICS_ENABLED': True
+    })
+    
+    # Create the database and the tables
+    with app.app_context():
+        db.create_all()
+    
+    yield app
+    
+    # Close and remove the temporary database
+    os.close(db_fd)
+    os.unlink(db_path)
+
+@pytest.fixture
+def sharded_app():
+    """App with the primary database plus one tenant shard"""
+    tmpdir = tempfile.mkdtemp()
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmpdir}/primary.db',
+        'SQLALCHEMY_BINDS': {'shard_b': f'sqlite:///{tmpdir}/shard_b.db'},
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-key',
+        'JWT_SECRET_KEY': 'jwt-test-key',
+        'TENANT_SHARD_REFRESH_SECONDS': 0
+    })
+    yield app
+    shutil.rmtree(tmpdir)
+
+@pytest.fixture
+def client(app):
+    """A test client for the app"""
+    return app.test_client()
+
+@pytest.fixture
+def runner(app):
+    """A test CLI runner for the app"""
+    return app.test_cli_runner()
+
+class AuthActions:
+    """Class to help with authentication in tests"""
+    def __init__(self, client):
+        self._client = client
+    
+    def register(self, username='test', email='test@example.com', password='test-password'):
+        """Register a test user"""
+        return self._client.post(
+            '/api/v1/auth/register',
+            json={'username': username, 'email': email, 'password': password}
+        )
+    
+    def login(self, username='test', password='test-password'):
+        """Login as test user"""
+        return self._client.post(
+            '/api/v1/auth/login',
+            json={'username': username, 'password': password}
+        )
+    
+    def get_token(self, username='test', password='test-password'):
+        """Get token for test user"""
+        response = self.login(username, password)
+        return response.get_json()['access_token']
+
+@pytest.fixture
+def auth(client):
+    """Authentication fixture"""
+    return AuthActions(client)
+
+@pytest.fixture
+def user_headers():
+    """Register users with a role and organization; call as ``user_headers(client, app, username, ...)``"""
+    def register(client, app, username, role='user', tenant=None):
+        client.post('/api/v1/auth/register', json={
+            'username': username, 'email': f'{username}@example.com', 'password': 'test-password'
+        })
+        with app.app_context():
+            user = User.query.filter_by(username=username).first()
+            user.role = role
+            user.tenant_id = tenant
+            user.save()
+        token = client.post('/api/v1/auth/login', json={
+            'username': username, 'password': 'test-password'
+        }).get_json()['access_token']
+        return {'Authorization': f'Bearer {token}'}
+    return register
+
+@pytest.fixture
+def setup_flow():
+    """Add flows; call as ``setup_flow(app, steps, stations=None)``
+    
+    The steps cycle over ``stations`` new stations (one more than the steps by
+    default) and a document is put at the first station. Returns the flow's
+    and the first station's public ids.
+    """
+    def create(app, steps, stations=None):
+        with app.app_context():
+            count = stations or steps + 1
+            created = [Station(name=f'Station {n}', type='review', description='long text') for n in range(count)]
+            db.session.add_all(created)
+            flow = Flow(name='Approval')
+            db.session.add(flow)
+            db.session.flush()
+            db.session.add_all([
+                FlowStep(flow_id=flow.id, from_station_id=created[n % count].id,
+                         to_station_id=created[(n + 1) % count].id, order=n)
+                for n in range(steps)
+            ])
+            template = Template(name='Invoice', content='<p></p>', status='active')
+            db.session.add(template)
+            db.session.flush()
+            db.session.add(Document(name='Invoice 1', content='<p></p>', template_id=template.id,
+                                    current_station_id=created[0].id))
+            db.session.commit()
+            return flow.public_id, created[0].public_id
+    return create
+
+@pytest.fixture
+def query_count():
+    """Read the query count from a response's Server-Timing header"""
+    def count(response):
+        return int(response.headers['Server-Timing'].split('desc="')[1].split(' ')[0])
+    return count
@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.api.v1.models.models import (Document, DocumentHistory, Flow, FlowStep, Job, Station, StationDwellRollup,
+                                     StationVisit, Template)
+from app.database.station_dwell import REFRESH_ROLLUPS, bucket_for, bucket_value, rebuild, refresh, summarize
+from app.jobs.queue import SUCCEEDED, run_next
+
+START = datetime(2024, 1, 1, 9, 0)
+
+def setup_stations(app):
+    """Add stations A, B and C, a flow A -> B and three documents; returns ``(station ids, document ids)``"""
+    with app.app_context():
+        stations = [Station(name=name, type='review') for name in ('A', 'B', 'C')]
+        db.session.add_all(stations)
+        db.session.flush()
+        flow = Flow(name='Approval')
+        db.session.add(flow)
+        db.session.flush()
+        db.session.add(FlowStep(flow_id=flow.id, from_station_id=stations[0].id, to_station_id=stations[1].id))
+        template = Template(name='Invoice', content='<p></p>', status='active')
+        db.session.add(template)
+        db.session.flush()
+        documents = [Document(name=f'Invoice {n}', content='<p></p>', template_id=template.id) for n in range(3)]
+        db.session.add_all(documents)
+        db.session.commit()
+        return [station.id for station in stations], [document.id for document in documents]
+
+def add_history(app, *entries):
+    """Add ``(document_id, station_id, seconds after START)`` history rows"""
+    with app.app_context():
+        db.session.add_all([
+            DocumentHistory(document_id=document_id, action='moved', station_id=station_id,
+                            created_at=START + timedelta(seconds=seconds))
+            for document_id, station_id, seconds in entries
+        ])
+        db.session.commit()
+
+def by_name(rows):
+    return {row['name']: row for row in rows}
+
+def test_summary_reads_percentiles_from_the_histogram():
+    """Test means are exact and percentiles are within the bucket resolution"""
+    seconds = [30, 60, 90, 120, 600, 3600]
+    buckets = {}
+    for value in seconds:
+        count, total = buckets.get(bucket_for(value), (0, 0.0))
+        buckets[bucket_for(value)] = (count + 1, total + value)
+    summary = summarize([(bucket, count, total) for bucket, (count, total) in buckets.items()])
+    assert summary['completed'] == 6
+    assert summary['mean_seconds'] == 750.0
+    assert summary['p50_seconds'] == pytest.approx(90, rel=0.1)
+    assert summary['p90_seconds'] == pytest.approx(3600, rel=0.1)
+    assert summarize([]) == {'completed': 0, 'mean_seconds': None, 'p50_seconds': None, 'p90_seconds': None}
+    assert bucket_value(bucket_for(0.2)) == pytest.approx(1, rel=0.1)
+
+def test_station_analytics_are_maintained_incrementally(app, client, runner, user_headers):
+    """Test dwell times per station and flow, and that later history is folded in on refresh"""
+    (a, b, c), (first, second, third) = setup_stations(app)
+    add_history(app, (first, a, 0), (first, a, 10), (first, b, 100), (first, c, 400),
+                (second, a, 0), (second, b, 200), (third, a, 0))
+    headers = user_headers(client, app, 'alice')
+    
+    # Never refreshed: served empty as is, with one refresh queued however often it is read
+    for _ in range(2):
+        data = client.get('/api/v1/analytics/stations', headers=headers).get_json()
+        assert by_name(data['stations'])['A']['completed'] == 0 and data['refreshed_at'] is None
+    with app.app_context():
+        assert Job.query.filter_by(kind=REFRESH_ROLLUPS).count() == 1
+        job = run_next(app, 'test')
+        assert (job.status, job.get_result()) == (SUCCEEDED, {'primary': 3})
+    
+    response = client.get('/api/v1/analytics/stations', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    stations = by_name(data['stations'])
+    assert stations['A']['completed'] == 2
+    assert stations['A']['mean_seconds'] == 150.0
+    assert stations['A']['p90_seconds'] == pytest.approx(200, rel=0.1)
+    assert stations['A']['in_station'] == 1
+    assert (stations['B']['completed'], stations['B']['in_station']) == (1, 1)
+    assert (stations['C']['completed'], stations['C']['in_station']) == (0, 1)
+    flow = by_name(data['flows'])['Approval']
+    assert (flow['stations'], flow['completed'], flow['in_flow'], flow['mean_seconds']) == (2, 3, 2, 200.0)
+    assert data['refreshed_at'] is not None
+    
+    add_history(app, (second, c, 260), (third, a, 50))
+    # Served from the rollups until the next refresh
+    assert by_name(client.get('/api/v1/analytics/stations', headers=headers).get_json()['stations'])['B'] \
+        ['completed'] == 1
+    result = runner.invoke(args=['analytics', 'refresh'])
+    assert result.exit_code == 0, result.output
+    assert 'primary: 1 finished station visits added' in result.output
+    stations = by_name(client.get('/api/v1/analytics/stations', headers=headers).get_json()['stations'])
+    assert (stations['B']['completed'], stations['B']['mean_seconds'], stations['B']['in_station']) == (2, 180.0, 0)
+    assert stations['A']['completed'] == 2
+    
+    with app.app_context():
+        assert rebuild(db.engine) == 4
+        assert refresh(db.engine) == 0
+        DocumentHistory.query.filter_by(document_id=third).delete()
+        db.session.delete(Document.query.get(third))
+        db.session.commit()
+        refresh(db.engine)
+        assert StationVisit.query.count() == 2
+
+def test_refresh_batches_over_history_id_gaps(app):
+    """Test a batch is a number of rows, so a gap in the ids does not stop the refresh"""
+    (a, b, c), (first, _, _) = setup_stations(app)
+    with app.app_context():
+        db.session.add_all([
+            DocumentHistory(id=history_id, document_id=first, action='moved', station_id=station_id,
+                            created_at=START + timedelta(seconds=seconds))
+            for history_id, station_id, seconds in ((1, a, 0), (2, b, 10), (200, c, 30), (201, a, 60))
+        ])
+        db.session.commit()
+        assert refresh(db.engine, batch_size=50) == 3
+        assert rebuild(db.engine, batch_size=1) == 3
+        assert StationVisit.query.one().station_id == a
+
+def test_refresh_folds_in_history_that_commits_late(app):
+    """Test a history row whose id was passed over before it committed is still counted"""
+    (a, b, c), (first, second, _) = setup_stations(app)
+    with app.app_context():
+        db.session.add_all([
+            DocumentHistory(id=history_id, document_id=document_id, action='moved', station_id=station_id,
+                            created_at=START + timedelta(seconds=seconds))
+            for history_id, document_id, station_id, seconds in ((1, first, a, 0), (2, first, b, 10),
+                                                                 (3, second, a, 0))
+        ])
+        db.session.commit()
+        assert refresh(db.engine) == 1
+        
+        # Id 4 was handed out before id 5 but its transaction commits after the refresh read past it
+        db.session.add(DocumentHistory(id=5, document_id=first, action='moved', station_id=c,
+                                       created_at=START + timedelta(seconds=40)))
+        db.session.commit()
+        assert refresh(db.engine) == 1
+        db.session.add(DocumentHistory(id=4, document_id=second, action='moved', station_id=b,
+                                       created_at=START + timedelta(seconds=20)))
+        db.session.commit()
+        assert refresh(db.engine) == 1
+        assert refresh(db.engine) == 0
+        assert rebuild(db.engine) == 3
+
+def test_late_history_does_not_reopen_a_station_the_document_left(app):
+    """Test a late row older than a document's already counted moves is skipped"""
+    (a, b, c), (first, _, _) = setup_stations(app)
+    with app.app_context():
+        db.session.add_all([
+            DocumentHistory(id=history_id, document_id=first, action='moved', station_id=station_id,
+                            created_at=START + timedelta(seconds=seconds))
+            for history_id, station_id, seconds in ((1, a, 0), (3, c, 300))
+        ])
+        db.session.commit()
+        assert refresh(db.engine) == 1
+        
+        # The move to B happened in between but committed after the refresh read past it
+        db.session.add(DocumentHistory(id=2, document_id=first, action='moved', station_id=b,
+                                       created_at=START + timedelta(seconds=100)))
+        db.session.commit()
+        assert refresh(db.engine) == 0
+        visit = StationVisit.query.one()
+        assert (visit.station_id, visit.entered_at) == (c, START + timedelta(seconds=300))
+        assert [(row.station_id, row.count) for row in StationDwellRollup.query.all()] == [(a, 1)]
+
+def test_station_analytics_are_tenant_scoped(app, client, user_headers):
+    """Test another organization's history does not count"""
+    (a, b, _), (first, _, _) = setup_stations(app)
+    add_history(app, (first, a, 0), (first, b, 100))
+    with app.app_context():
+        refresh(db.engine)
+    headers = user_headers(client, app, 'mallory', tenant='other')
+    stations = by_name(client.get('/api/v1/analytics/stations', headers=headers).get_json()['stations'])
+    assert (stations['A']['completed'], stations['B']['in_station']) == (0, 0)
+    assert client.get('/api/v1/analytics/stations').status_code == 401
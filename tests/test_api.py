@@ -1,72 +1,4 @@
-import pytest
-import os
-import tempfile
-from app import create_app, db
-from app.api.v1.models.models import User, Template, Station, Flow, FlowStep
-
-@pytest.fixture
-def app():
-    """Create and configure a Flask app for testing"""
-    # Create a temporary file to isolate the database for each test
-    db_fd, db_path = tempfile.mkstemp()
-    
-    # Create the app with test config
-    app = create_app({
-        'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
-        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-        'SECRET_KEY': 'test-key',
-        'JWT_SECRET_KEY': 'jwt-test-key'
-    })
-    
-    # Create the database and the tables
-    with app.app_context():
-        db.create_all()
-    
-    yield app
-    
-    # Close and remove the temporary database
-    os.close(db_fd)
-    os.unlink(db_path)
-
-@pytest.fixture
-def client(app):
-    """A test client for the app"""
-    return app.test_client()
-
-@pytest.fixture
-def runner(app):
-    """A test CLI runner for the app"""
-    return app.test_cli_runner()
-
-class AuthActions:
-    """Class to help with authentication in tests"""
-    def __init__(self, client):
-        self._client = client
-    
-    def register(self, username='test', email='test@example.com', password='test-password'):
-        """Register a test user"""
-        return self._client.post(
-            '/api/v1/auth/register',
-            json={'username': username, 'email': email, 'password': password}
-        )
-    
-    def login(self, username='test', password='test-password'):
-        """Login as test user"""
-        return self._client.post(
-            '/api/v1/auth/login',
-            json={'username': username, 'password': password}
-        )
-    
-    def get_token(self, username='test', password='test-password'):
-        """Get token for test user"""
-        response = self.login(username, password)
-        return response.get_json()['access_token']
-
-@pytest.fixture
-def auth(client):
-    """Authentication fixture"""
-    return AuthActions(client)
+from app.api.v1.models.models import Template, Station, Flow
 
 def test_health_check(client):
     """Test health check endpoint"""
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.asgi import create_asgi_app
+from app.database.sharding import shard_map
+from app.security.claims import revocation_list
+from app.api.v1.models.models import Document, Template
+
+@pytest.fixture
+def asgi_app():
+    """Create the ASGI app with one document"""
+    db_fd, db_path = tempfile.mkstemp()
+    asgi_app = create_asgi_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-key',
+        'JWT_SECRET_KEY': 'jwt-test-key'
+    })
+    
+    with asgi_app.flask_app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        Document(name='Invoice 1', content='<p>10</p>', template_id=template.id).save()
+        asgi_app.token = create_access_token(identity={'sub': 'abc', 'id': 1, 'username': 'test', 'role': 'user'})
+    
+    yield asgi_app
+    
+    asyncio.run(asgi_app.engine.dispose())
+    asgi_app.executor.shutdown()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+def call(asgi_app, path, token=None, query=''):
+    """Send one GET request through the ASGI app"""
+    headers = [(b'authorization', f'Bearer {token}'.encode())] if token else []
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'headers': headers}
+    messages = []
+    
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    
+    async def send(message):
+        messages.append(message)
+    
+    asyncio.run(asgi_app(scope, receive, send))
+    status = messages[0]['status']
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return status, json.loads(body)
+
+def test_async_document_list(asgi_app):
+    """Test documents are listed through the async engine"""
+    status, body = call(asgi_app, '/api/v1/documents', asgi_app.token)
+    assert status == 200
+    assert body[0]['name'] == 'Invoice 1'
+    assert body[0]['template']['name'] == 'Invoice'
+
+def test_async_document_get(asgi_app):
+    """Test fetching one document and a missing one"""
+    _, documents = call(asgi_app, '/api/v1/documents', asgi_app.token)
+    status, body = call(asgi_app, f"/api/v1/documents/{documents[0]['public_id']}", asgi_app.token)
+    assert status == 200
+    assert body['content'] == '<p>10</p>'
+    
+    status, _ = call(asgi_app, '/api/v1/documents/missing', asgi_app.token)
+    assert status == 404
+
+def test_async_document_list_applies_field_filters(asgi_app):
+    """Test ``field.`` filters narrow the async list as they do the sync one"""
+    with asgi_app.flask_app.app_context():
+        template = Template(name='Order', content='<p></p>', status='active')
+        template.set_editable_fields([{'name': 'amount', 'type': 'number'}])
+        template.save()
+        for name, amount in (('Order 1', 500), ('Order 2', 20000)):
+            document = Document(name=name, content='<p></p>', template_id=template.id)
+            document.set_field_values({'amount': ('number', amount)})
+            document.save()
+    
+    status, body = call(asgi_app, '/api/v1/documents', asgi_app.token, 'field.amount__gt=10000')
+    assert status == 200
+    assert [document['name'] for document in body] == ['Order 2']
+    status, body = call(asgi_app, '/api/v1/documents', asgi_app.token, 'field.amount__between=1')
+    assert status == 400 and 'error' in body
+
+def test_async_documents_honour_fieldsets(asgi_app):
+    """Test ``fields[...]`` and ``expand`` shape async responses as they do sync ones"""
+    status, body = call(asgi_app, '/api/v1/documents', asgi_app.token, 'fields[document]=name,status')
+    assert status == 200
+    assert body == [{'name': 'Invoice 1', 'status': 'draft'}]
+    
+    _, documents = call(asgi_app, '/api/v1/documents', asgi_app.token, 'expand=')
+    assert 'template' not in documents[0] and 'current_station' not in documents[0]
+    status, body = call(asgi_app, f"/api/v1/documents/{documents[0]['public_id']}", asgi_app.token,
+                        'expand=template&fields[template]=name')
+    assert status == 200
+    assert body['template'] == {'name': 'Invoice'} and 'current_station' not in body
+    
+    status, body = call(asgi_app, '/api/v1/documents', asgi_app.token, 'expand=owner')
+    assert status == 400 and 'error' in body
+
+def test_async_requires_token(asgi_app):
+    """Test the async routes enforce authentication"""
+    status, body = call(asgi_app, '/api/v1/documents')
+    assert status == 401
+    assert body['msg'] == 'Missing Authorization Header'
+
+def test_async_lookups_run_off_the_event_loop(asgi_app, monkeypatch):
+    """Test the deny-list and shard map, which may query the database, are not read on the loop's thread"""
+    threads = []
+    
+    def record(real):
+        def lookup(*args):
+            threads.append(threading.current_thread())
+            return real(*args)
+        return lookup
+    
+    monkeypatch.setattr(revocation_list, 'is_revoked', record(revocation_list.is_revoked))
+    monkeypatch.setattr(shard_map, 'lookup', record(shard_map.lookup))
+    status, _ = call(asgi_app, '/api/v1/documents', asgi_app.token)
+    assert status == 200
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+def test_flask_routes_run_in_parallel(asgi_app):
+    """Test requests passed through to Flask do not wait for each other"""
+    asgi_app.flask_app.add_url_rule('/slow', 'slow', lambda: (time.sleep(0.5), 'done')[1])
+    scope = {'type': 'http', 'method': 'GET', 'path': '/slow', 'query_string': b'', 'headers': [],
+             'http_version': '1.1'}
+    statuses = []
+    
+    async def request():
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+        
+        await asgi_app(dict(scope), receive, send)
+    
+    async def requests():
+        await asyncio.gather(*(request() for _ in range(4)))
+    
+    started = time.monotonic()
+    asyncio.run(requests())
+    assert statuses == [200] * 4
+    assert time.monotonic() - started < 1.5
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.api.v1.models.models import ChangeLog, ChangeLogCounter, Template, TenantShard
+from app.database.change_log import compact
+
+def read_all(client, headers, after=None, limit=2):
+    """Follow the cursor until the log is drained; returns ``(changes, cursor, pages)``"""
+    changes, pages = [], 0
+    while True:
+        query = f'/api/v1/changes?limit={limit}' + (f'&after={after}' if after else '')
+        page = client.get(query, headers=headers).get_json()
+        changes += page['changes']
+        after = page['next']
+        pages += 1
+        if not page['has_more']:
+            return changes, after, pages
+
+def test_mutations_are_logged_in_order(app, client, user_headers):
+    """Test document inserts, updates and deletes show up in the log, oldest first"""
+    admin = user_headers(client, app, 'root', role='admin')
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        template_id = template.id
+    
+    created = client.post('/api/v1/documents', headers=admin, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id
+    }).get_json()
+    path = f'/api/v1/documents/{created["public_id"]}'
+    client.put(path, headers=admin, json={'status': 'submitted'})
+    client.delete(path, headers=admin)
+    
+    changes, cursor, pages = read_all(client, admin)
+    assert [(c['entity'], c['op']) for c in changes] == [
+        ('template', 'insert'), ('document', 'insert'), ('document', 'update'), ('document', 'delete')
+    ]
+    assert pages == 2
+    assert changes[2]['data']['status'] == 'submitted'
+    assert changes[3]['data'] is None
+    assert [c['seq'] for c in changes] == sorted(c['seq'] for c in changes)
+    
+    # Only what changed since the cursor comes back
+    assert read_all(client, admin, after=cursor)[0] == []
+    with app.app_context():
+        Template.query.get(template_id).name = 'Invoice v2'
+        db.session.commit()
+    newer, _, _ = read_all(client, admin, after=cursor)
+    assert [(c['entity'], c['op'], c['data']['name']) for c in newer] == [('template', 'update', 'Invoice v2')]
+
+def test_rolled_back_changes_are_not_logged(app):
+    """Test change rows are written with the commit, and not at all on rollback"""
+    with app.app_context():
+        db.session.add(Template(name='Draft', content='<p></p>'))
+        db.session.flush()
+        assert ChangeLog.query.count() == 0
+        db.session.rollback()
+        db.session.commit()
+        assert ChangeLog.query.count() == 0
+        
+        Template(name='Draft', content='<p></p>').save()
+        assert ChangeLog.query.count() == 1
+
+def test_seqs_are_handed_out_at_commit(app):
+    """Test seqs come from the counter when committing and continue after rows logged before it existed"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(ChangeLog.__table__.insert().values(
+                seq=41, entity='template', entity_id='x', op='delete', changed_at=datetime.utcnow()
+            ))
+            conn.execute(ChangeLogCounter.__table__.delete())
+        
+        first = Template(name='First', content='<p></p>')
+        second = Template(name='Second', content='<p></p>')
+        db.session.add(first)
+        db.session.flush()
+        db.session.add(second)
+        db.session.commit()
+        
+        rows = ChangeLog.query.filter(ChangeLog.seq > 41).order_by(ChangeLog.seq).all()
+        assert [(row.seq, row.entity_id) for row in rows] == [(42, first.public_id), (43, second.public_id)]
+        assert ChangeLogCounter.query.get(1).value == 43
+
+def test_changes_require_admin_and_valid_cursor(client, app, user_headers):
+    """Test regular users are refused and malformed cursors rejected"""
+    user = user_headers(client, app, 'alice')
+    assert client.get('/api/v1/changes', headers=user).status_code == 403
+    admin = user_headers(client, app, 'root', role='admin')
+    assert client.get('/api/v1/changes?after=nope', headers=admin).status_code == 400
+    assert client.get('/api/v1/changes?after=x:1', headers=admin).status_code == 400
+
+def test_sharded_changes_use_a_cursor_per_database(sharded_app, user_headers):
+    """Test a shard's changes are logged on the shard and merged into one feed"""
+    client = sharded_app.test_client()
+    with sharded_app.app_context():
+        TenantShard(tenant_id='acme', shard='b').save()
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        template_id = template.id
+    acme = user_headers(client, sharded_app, 'acme_user', tenant='acme')
+    admin = user_headers(client, sharded_app, 'root', role='admin')
+    
+    client.post('/api/v1/documents', headers=acme, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id
+    })
+    with sharded_app.app_context():
+        with db.get_engine(sharded_app, 'shard_b').connect() as conn:
+            shard_changes = conn.execute(ChangeLog.__table__.select()).all()
+    assert [(row.entity, row.tenant_id) for row in shard_changes] == [('document', 'acme')]
+    
+    changes, cursor, _ = read_all(client, admin)
+    assert [(c['source'], c['entity']) for c in changes] == [
+        ('primary', 'template'), ('b', 'document')
+    ]
+    assert cursor == f'primary:{changes[0]["seq"]},b:{changes[1]["seq"]}'
+    assert read_all(client, admin, after=cursor)[0] == []
+
+def test_compaction_keeps_the_latest_change_per_row(app):
+    """Test superseded changes are dropped while the newest change and deletes stay"""
+    with app.app_context():
+        template = Template(name='Invoice', content='<p></p>')
+        template.save()
+        other = Template(name='Receipt', content='<p></p>')
+        other.save()
+        for n in range(3):
+            template.name = f'Invoice v{n}'
+            db.session.commit()
+        other.delete()
+        
+        assert compact(db.engine, datetime.utcnow() + timedelta(seconds=1), batch_size=2) == 4
+        remaining = [(c.entity_id, c.op) for c in ChangeLog.query.order_by(ChangeLog.seq)]
+        assert remaining == [(template.public_id, 'update'), (other.public_id, 'delete')]
+        latest = ChangeLog.query.filter_by(entity_id=template.public_id).one()
+        assert '"Invoice v2"' in latest.data
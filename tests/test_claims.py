@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.api.v1.models.models import RevokedToken, User
+from app.security.claims import revocation_list
+
+def test_profile_served_from_claims(client, auth, app):
+    """Test /auth/me answers from the token even without the user row"""
+    auth.register()
+    token = auth.get_token()
+    
+    with app.app_context():
+        User.query.filter_by(username='test').delete()
+        db.session.commit()
+    
+    response = client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'test'
+    assert response.get_json()['role'] == 'user'
+
+def test_logout_revokes_token(client, auth):
+    """Test a logged out token is rejected"""
+    auth.register()
+    token = auth.get_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    assert client.post('/api/v1/auth/logout', headers=headers).status_code == 200
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 401
+    
+    # A fresh login still works
+    other = auth.get_token()
+    assert client.get('/api/v1/auth/me', headers={'Authorization': f'Bearer {other}'}).status_code == 200
+
+def test_revocations_committed_out_of_id_order_are_seen(app):
+    """Test a revocation whose id is lower than one already loaded still reaches the cache"""
+    app.config['JWT_REVOCATION_REFRESH_SECONDS'] = 0
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(RevokedToken.__table__.insert().values(id=10, jti='late-id', expires_at=expires_at))
+        assert revocation_list.is_revoked('late-id')
+        # Another worker's transaction took id 5 earlier but committed only now
+        with db.engine.begin() as conn:
+            conn.execute(RevokedToken.__table__.insert().values(id=5, jti='early-id', expires_at=expires_at))
+        assert revocation_list.is_revoked('early-id')
@@ -0,0 +1,93 @@
+import gzip
+import json
+import zlib
+
+from flask import Response
+
+from app.middleware.compression import CompressionMiddleware, GzipEncoder, negotiate
+
+PAYLOAD = {'content': '<p>' + 'Dear {{name}}, please sign the attached form. ' * 200 + '</p>'}
+
+def add_routes(app):
+    @app.route('/test/large')
+    def large():
+        return PAYLOAD
+    
+    @app.route('/test/ndjson')
+    def ndjson():
+        rows = (json.dumps({'row': n, 'content': PAYLOAD['content']}) + '\n' for n in range(5))
+        return Response(rows, mimetype='application/x-ndjson')
+    
+    @app.route('/test/events')
+    def events():
+        return Response(iter(['data: ' + PAYLOAD['content'] + '\n\n']), mimetype='text/event-stream')
+
+def compression_middleware(app):
+    middleware = app.wsgi_app
+    while not isinstance(middleware, CompressionMiddleware):
+        middleware = middleware.wsgi_app
+    return middleware
+
+def test_negotiate_respects_quality_values():
+    """Test the encoding with the highest q-value wins and q=0 refuses it"""
+    encoders = [GzipEncoder()]
+    assert negotiate('gzip, deflate', encoders).name == 'gzip'
+    assert negotiate('br;q=1.0, gzip;q=0.5', encoders).name == 'gzip'
+    assert negotiate('*', encoders).name == 'gzip'
+    assert negotiate('gzip;q=0', encoders) is None
+    assert negotiate('identity', encoders) is None
+    assert negotiate(None, encoders) is None
+
+def test_large_json_is_gzipped(app, client):
+    """Test large JSON bodies are compressed and identical after decoding"""
+    add_routes(app)
+    response = client.get('/test/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert json.loads(gzip.decompress(response.data)) == PAYLOAD
+    
+    plain = client.get('/test/large')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    assert len(response.data) < len(plain.data) / 10
+
+def test_small_responses_are_not_compressed(client):
+    """Test bodies under COMPRESSION_MIN_SIZE are sent as they are"""
+    response = client.get('/health', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['status'] == 'healthy'
+
+def test_compressed_bodies_are_cached(app, client):
+    """Test a repeated body is compressed once and then served from the cache"""
+    add_routes(app)
+    cache = compression_middleware(app).cache
+    cache.clear()
+    first = client.get('/test/large', headers={'Accept-Encoding': 'gzip'})
+    assert len(cache) == 1
+    second = client.get('/test/large', headers={'Accept-Encoding': 'gzip'})
+    assert len(cache) == 1
+    assert first.data == second.data
+
+def test_streamed_responses_are_compressed_per_chunk(app, client):
+    """Test NDJSON streams are compressed incrementally, one flushed block per row"""
+    add_routes(app)
+    response = client.get('/test/ndjson', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    
+    decompressor = zlib.decompressobj(31)
+    chunks = list(response.response)
+    # Each flushed chunk decodes to whole rows without waiting for the end of the stream
+    first_rows = decompressor.decompress(chunks[0]).decode()
+    assert first_rows.endswith('\n') and json.loads(first_rows)['row'] == 0
+    rows = (first_rows + ''.join(decompressor.decompress(chunk).decode() for chunk in chunks[1:])).splitlines()
+    assert [json.loads(row)['row'] for row in rows] == list(range(5))
+    response.close()
+
+def test_event_streams_are_not_compressed(app, client):
+    """Test server-sent event streams pass through untouched"""
+    add_routes(app)
+    response = client.get('/test/events', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True).startswith('data: <p>')
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+from marshmallow import ValidationError
+
+from app import db
+from app.api.v1.models.models import DocumentField, Template
+from app.api.v1.schemas.schemas import TemplateSchema
+from app.api.v1.utils.template_fields import template_fields
+
+FIELDS = [
+    {'name': 'amount', 'type': 'number', 'required': True},
+    {'name': 'due_date', 'type': 'date'},
+    {'name': 'paid', 'type': 'boolean'},
+    {'name': 'region', 'type': 'select', 'options': ['north', 'south']},
+    {'name': 'note', 'type': 'text'}
+]
+
+def setup_template(app):
+    """Add a template with typed editable fields; returns its id"""
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.set_editable_fields(FIELDS)
+        template.save()
+        return template.id
+
+def create(client, headers, template_id, name, **values):
+    return client.post('/api/v1/documents', headers=headers, json={
+        'name': name, 'content': f'<p>{name}</p>', 'template_id': template_id, 'fields': values
+    })
+
+def names(response):
+    return sorted(document['name'] for document in response.get_json())
+
+def test_field_values_are_validated_and_stored_typed(client, auth, app):
+    """Test field values are checked against the template and returned with the document"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    template_id = setup_template(app)
+    
+    response = create(client, headers, template_id, 'Invoice 1', amount=12500, due_date='2024-07-31',
+                      paid=False, region='north')
+    assert response.status_code == 201
+    document = response.get_json()
+    assert document['fields'] == {'amount': 12500, 'due_date': '2024-07-31', 'paid': False, 'region': 'north'}
+    with app.app_context():
+        amount = DocumentField.query.filter_by(name='amount').one()
+        assert (amount.value_type, amount.number_value, amount.text_value) == ('number', 12500.0, None)
+    
+    bad = create(client, headers, template_id, 'Invoice 2', amount='lots', due_date='31/07/2024',
+                 region='west', colour='red')
+    assert bad.status_code == 400
+    assert set(bad.get_json()['messages']['fields']) == {'amount', 'due_date', 'region', 'colour'}
+    missing = create(client, headers, template_id, 'Invoice 3', note='no amount')
+    assert missing.get_json()['messages']['fields'] == {'amount': ['Field is required']}
+    legacy = client.post('/api/v1/documents', headers=headers, json={
+        'name': 'Invoice 4', 'content': '<p></p>', 'template_id': template_id
+    })
+    assert legacy.status_code == 201 and legacy.get_json()['fields'] == {}
+    
+    path = f'/api/v1/documents/{document["public_id"]}'
+    updated = client.put(path, headers=headers, json={'fields': {'amount': 99.5, 'region': None}}).get_json()
+    assert updated['fields'] == {'amount': 99.5, 'due_date': '2024-07-31', 'paid': False}
+    assert client.put(path, headers=headers, json={'fields': {'amount': None}}).status_code == 400
+    assert client.delete(path, headers=headers).status_code == 200
+    with app.app_context():
+        assert DocumentField.query.count() == 0
+
+def test_documents_can_be_filtered_by_field(client, auth, app):
+    """Test ``field.<name>__<op>`` filters compare by the field's type"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    template_id = setup_template(app)
+    create(client, headers, template_id, 'Small', amount=900, due_date='2024-01-15', paid=True, region='north')
+    create(client, headers, template_id, 'Large', amount=15000, due_date='2024-03-01', region='south')
+    create(client, headers, template_id, 'Huge', amount=120000, paid=False, note='urgent')
+    
+    def query(params):
+        response = client.get(f'/api/v1/documents?{params}', headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return names(response)
+    
+    assert query('field.amount__gt=10000') == ['Huge', 'Large']
+    assert query('field.amount__gt=10000&field.amount__lte=15000') == ['Large']
+    assert query('field.amount=900') == ['Small']
+    assert query('field.due_date__lt=2024-02-01') == ['Small']
+    assert query('field.paid=false') == ['Huge']
+    assert query('field.region__in=north,south') == ['Large', 'Small']
+    assert query('field.note__ne=urgent') == []
+    assert query('field.missing__gt=1') == []
+    
+    assert client.get('/api/v1/documents?field.amount__between=1', headers=headers).status_code == 400
+    assert client.get('/api/v1/documents?field.bad-name=1', headers=headers).status_code == 400
+
+def test_field_definitions_are_compiled_once_per_template_version(app):
+    """Test templates share compiled validators until they are edited"""
+    template_id = setup_template(app)
+    with app.app_context():
+        template = Template.query.get(template_id)
+        compiled = template_fields(template)
+        assert template_fields(Template.query.get(template_id)) is compiled
+        fields = template.get_editable_fields()
+        assert fields == FIELDS
+        # Changing the returned list leaves the shared definitions alone
+        fields.pop(0)
+        assert template.get_editable_fields() == FIELDS
+        assert compiled.required == ('amount',)
+        
+        # Edits are seen before the flush that bumps updated_at
+        template.set_editable_fields(FIELDS[1:])
+        assert 'amount' not in template_fields(template).validators
+        db.session.commit()
+        assert template_fields(template) is not compiled
+        assert template_fields(template).required == ()
+
+def test_template_schema_parses_editable_fields_once(app):
+    """Test JSON text input is stored as the parsed definitions and bad definitions are rejected"""
+    data = TemplateSchema().load({'name': 'Invoice', 'content': '<p></p>', 'editable_fields': json.dumps(FIELDS)})
+    assert data['editable_fields'] == FIELDS
+    for bad in ('{not json', [{'type': 'number'}], [{'name': 'region', 'options': 'north'}]):
+        with pytest.raises(ValidationError):
+            TemplateSchema().load({'name': 'Invoice', 'content': '<p></p>', 'editable_fields': bad})
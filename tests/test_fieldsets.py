@@ -0,0 +1,93 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.api.v1.utils.fieldsets import InvalidFieldset, fieldset_cache, parse_fieldset_args
+
+def test_sparse_fieldsets_trim_documents(client, auth, app, setup_flow):
+    """Test fields[...] and expand choose what a document response contains"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    setup_flow(app, 1)
+    
+    default = client.get('/api/v1/documents', headers=headers).get_json()[0]
+    assert {'template', 'current_station', 'fields', 'content'} <= set(default)
+    
+    trimmed = client.get('/api/v1/documents?fields[document]=name,status', headers=headers).get_json()[0]
+    assert trimmed == {'name': 'Invoice 1', 'status': 'draft'}
+    
+    expanded = client.get('/api/v1/documents?expand=template&fields[template]=name', headers=headers).get_json()[0]
+    assert expanded['template'] == {'name': 'Invoice'}
+    assert 'current_station' not in expanded and 'content' in expanded
+    
+    bare = client.get('/api/v1/documents?expand=', headers=headers).get_json()[0]
+    assert 'template' not in bare and 'current_station' not in bare and bare['fields'] == {}
+    
+    public_id = default['public_id']
+    single = client.get(f'/api/v1/documents/{public_id}?fields[document]=public_id,fields', headers=headers)
+    assert single.get_json() == {'public_id': public_id, 'fields': {}}
+    
+    for params in ('fields[document]=colour', 'fields[widget]=name', 'expand=owner', 'expand=template.creator'):
+        response = client.get(f'/api/v1/documents?{params}', headers=headers)
+        assert response.status_code == 400, params
+        assert 'error' in response.get_json()
+
+def test_expansion_drives_eager_loading(client, auth, app, setup_flow, query_count):
+    """Test embedded relationships cost a fixed number of queries and unrequested ones cost none"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    small, _ = setup_flow(app, 2)
+    large, _ = setup_flow(app, 8)
+    # The first request of a worker does one-off lookups
+    client.get(f'/api/v1/flows/{small}?fields[flow]=name', headers=headers)
+    
+    responses = {public_id: client.get(f'/api/v1/flows/{public_id}', headers=headers) for public_id in (small, large)}
+    assert len(responses[large].get_json()['steps']) == 8
+    assert responses[large].get_json()['steps'][0]['from_station']['name'] == 'Station 0'
+    assert query_count(responses[small]) == query_count(responses[large])
+    
+    bare = client.get(f'/api/v1/flows/{large}?expand=', headers=headers)
+    assert 'steps' not in bare.get_json()
+    assert query_count(bare) < query_count(responses[large])
+    
+    steps_only = client.get(f'/api/v1/flows/{large}?expand=steps.to_station&fields[station]=name'
+                            f'&fields[step]=order,to_station', headers=headers).get_json()
+    assert steps_only['steps'][0] == {'order': 0, 'to_station': {'name': 'Station 1'}}
+    assert steps_only['name'] == 'Approval'
+    
+    listed = client.get('/api/v1/flows?fields[flow]=name', headers=headers).get_json()
+    assert listed == [{'name': 'Approval'}, {'name': 'Approval'}]
+
+def test_sparse_fieldsets_trim_templates(client, auth):
+    """Test the template resource leaves out content when asked"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    body = {'name': 'Invoice', 'content': '<p>{{amount}}</p>'}
+    
+    created = client.post('/api/v1/templates/?fields[template]=public_id', json=body, headers=headers)
+    assert created.status_code == 201
+    public_id = created.get_json()['public_id']
+    assert created.get_json() == {'public_id': public_id}
+    
+    listed = client.get('/api/v1/templates/?fields[template]=name,status', headers=headers).get_json()
+    assert listed == [{'name': 'Invoice', 'status': 'draft'}]
+    assert 'content' in client.get(f'/api/v1/templates/{public_id}', headers=headers).get_json()
+    single = client.get(f'/api/v1/templates/{public_id}?fields[template]=name', headers=headers)
+    assert single.get_json() == {'name': 'Invoice'}
+    updated = client.put(f'/api/v1/templates/{public_id}?fields[template]=status', json={'status': 'active'},
+                         headers=headers)
+    assert updated.get_json() == {'status': 'active'}
+    
+    assert client.get('/api/v1/templates/?fields[template]=colour', headers=headers).status_code == 400
+    assert client.get(f'/api/v1/templates/{public_id}?expand=steps', headers=headers).status_code == 400
+
+def test_fieldsets_are_cached_per_parameter_set(app):
+    """Test identical parameters share one set of schemas and invalid ones are not cached"""
+    fieldset_cache.clear()
+    fields, expand = parse_fieldset_args(MultiDict({'fields[station]': 'type, name', 'expand': 'steps'}))
+    assert (fields, expand) == ({'station': ('name', 'type')}, ('steps',))
+    first = fieldset_cache.get('flow', fields, expand)
+    assert fieldset_cache.get('flow', {'station': ('name', 'type')}, ('steps',)) is first
+    assert fieldset_cache.get('flow', fields, None) is not first
+    with pytest.raises(InvalidFieldset):
+        fieldset_cache.get('flow', {'station': ('colour',)}, None)
+    assert len(fieldset_cache._entries) == 2
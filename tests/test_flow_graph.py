@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from app.api.v1.models.models import ChangeLog, Station
+from app.api.v1.utils.fieldsets import fieldset_cache
+from app.api.v1.utils.flow_graph import flow_graph_cache, load_flow_graph
+
+def test_flow_graph_loads_in_three_queries(app, setup_flow):
+    """Test a 40-step flow is loaded and dumped with one query each for flow, steps and stations"""
+    public_id, _ = setup_flow(app, 40, stations=4)
+    with app.app_context():
+        view = fieldset_cache.get('flow', {}, None)
+        statements = []
+        
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            graph = view.schema.dump(load_flow_graph(public_id, view))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert len(statements) == 3
+        assert [step['order'] for step in graph['steps']] == list(range(40))
+        assert graph['steps'][5]['from_station']['name'] == 'Station 1'
+        assert graph['steps'][5]['to_station']['name'] == 'Station 2'
+        
+        bare = fieldset_cache.get('flow', {}, ())
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            assert 'steps' not in bare.schema.dump(load_flow_graph(public_id, bare))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert len(statements) == 1
+
+def test_flow_graph_is_memoized_until_a_change(client, auth, app, setup_flow, query_count):
+    """Test repeat reads skip the database and edits through the API are seen at once"""
+    flow_graph_cache.clear()
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    public_id, station_id = setup_flow(app, 10, stations=4)
+    path = f'/api/v1/flows/{public_id}'
+    
+    first = client.get(path, headers=headers)
+    second = client.get(path, headers=headers)
+    assert second.get_json() == first.get_json()
+    assert query_count(second) <= query_count(first) - 3
+    
+    assert client.put(f'/api/v1/stations/{station_id}', headers=headers, json={'name': 'Intake'}).status_code == 200
+    assert client.get(path, headers=headers).get_json()['steps'][0]['from_station']['name'] == 'Intake'
+    assert client.put(path, headers=headers, json={'name': 'Approval v2'}).status_code == 200
+    assert client.get(path, headers=headers).get_json()['name'] == 'Approval v2'
+    assert client.get(f'{path}?fields[flow]=name', headers=headers).get_json() == {'name': 'Approval v2'}
+    
+    assert client.delete(path, headers=headers).status_code == 200
+    assert client.get(path, headers=headers).status_code == 404
+
+def test_flow_graph_sees_changes_from_other_workers(client, auth, app, setup_flow):
+    """Test a change logged by another process clears the cache on the next check"""
+    flow_graph_cache.clear()
+    app.config.update(FLOW_GRAPH_REFRESH_SECONDS=0)
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    public_id, station_id = setup_flow(app, 2, stations=4)
+    path = f'/api/v1/flows/{public_id}'
+    assert client.get(path, headers=headers).get_json()['steps'][0]['from_station']['name'] == 'Station 0'
+    
+    # Written outside this worker's session, as another worker's commit would be
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(Station.__table__.update().where(Station.public_id == station_id).values(name='Intake'))
+            conn.execute(ChangeLog.__table__.insert().values(
+                entity='station', entity_id=station_id, op='update',
+                changed_at=datetime.utcnow() - timedelta(seconds=1)
+            ))
+    assert client.get(path, headers=headers).get_json()['steps'][0]['from_station']['name'] == 'Intake'
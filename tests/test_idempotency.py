@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.api.v1.models.models import IdempotencyKey, Station, Template
+
+def test_retry_with_same_key_replays_response(client, auth, app):
+    """Test a retried POST returns the first response without a second write"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}', 'Idempotency-Key': 'station-1'}
+    body = {'name': 'Approval', 'type': 'approval'}
+    
+    first = client.post('/api/v1/stations', json=body, headers=headers)
+    second = client.post('/api/v1/stations', json=body, headers=headers)
+    
+    assert first.status_code == second.status_code == 201
+    assert first.get_json()['public_id'] == second.get_json()['public_id']
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    with app.app_context():
+        assert Station.query.count() == 1
+
+def test_key_reused_for_different_request(client, auth):
+    """Test a key cannot be reused with a different body"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}', 'Idempotency-Key': 'station-2'}
+    
+    client.post('/api/v1/stations', json={'name': 'Approval', 'type': 'approval'}, headers=headers)
+    response = client.post('/api/v1/stations', json={'name': 'Signing', 'type': 'signature'}, headers=headers)
+    assert response.status_code == 422
+
+def test_keys_are_scoped_per_user(client, auth, app):
+    """Test two users sending the same key both get their writes"""
+    auth.register()
+    auth.register(username='other', email='other@example.com')
+    body = {'name': 'Approval', 'type': 'approval'}
+    
+    for username in ('test', 'other'):
+        token = auth.get_token(username=username)
+        headers = {'Authorization': f'Bearer {token}', 'Idempotency-Key': 'same-key'}
+        assert client.post('/api/v1/stations', json=body, headers=headers).status_code == 201
+    
+    with app.app_context():
+        assert Station.query.count() == 2
+
+def test_resource_endpoints_are_idempotent(client, auth, app):
+    """Test the template resource replays retried creates"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}', 'Idempotency-Key': 'template-1'}
+    body = {'name': 'Invoice', 'content': '<p>{{amount}}</p>'}
+    
+    first = client.post('/api/v1/templates/', json=body, headers=headers)
+    second = client.post('/api/v1/templates/', json=body, headers=headers)
+    assert first.status_code == second.status_code == 201
+    assert first.get_json() == second.get_json()
+    with app.app_context():
+        assert Template.query.count() == 1
+
+def test_replay_repeats_response_headers(client, auth, app):
+    """Test a replayed 202 still points at the job it queued"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}', 'Idempotency-Key': 'export-1'}
+    
+    first = client.post('/api/v1/documents/export', json={}, headers=headers)
+    second = client.post('/api/v1/documents/export', json={}, headers=headers)
+    assert first.status_code == second.status_code == 202
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.headers['Location'] == first.headers['Location']
+
+def test_abandoned_claim_is_taken_over(client, auth, app):
+    """Test a key left claimed by a worker that died is only blocked while its lease is fresh"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}', 'Idempotency-Key': 'station-3'}
+    body = {'name': 'Approval', 'type': 'approval'}
+    
+    first = client.post('/api/v1/stations', json=body, headers=headers)
+    # Leave the claim behind as a worker killed mid-request would
+    with app.app_context():
+        record = IdempotencyKey.query.one()
+        record.status_code = None
+        record.response_body = None
+        db.session.commit()
+    
+    retry = client.post('/api/v1/stations', json=body, headers=headers)
+    assert retry.status_code == 409
+    assert int(retry.headers['Retry-After']) > 0
+    
+    with app.app_context():
+        record = IdempotencyKey.query.one()
+        record.claimed_at = datetime.utcnow() - timedelta(seconds=app.config.get('IDEMPOTENCY_CLAIM_SECONDS', 120) + 1)
+        db.session.commit()
+    
+    retry = client.post('/api/v1/stations', json=body, headers=headers)
+    assert retry.status_code == 201
+    assert retry.get_json()['public_id'] != first.get_json()['public_id']
+    replay = client.post('/api/v1/stations', json=body, headers=headers)
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.get_json() == retry.get_json()
@@ -0,0 +1,165 @@
+import json
+from datetime import datetime, timedelta
+
+from app import db
+from app.api.v1.models.models import Document, DocumentHistory, Job, Station, Template
+from app.jobs.queue import (CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, cancel, claim_next, enqueue, job_handler,
+                            run_job, run_next)
+
+calls = []
+
+@job_handler('test.flaky')
+def flaky(context, fail_times=0):
+    calls.append(context.attempt)
+    if context.attempt <= fail_times:
+        raise RuntimeError('temporary failure')
+    return {'attempt': context.attempt}
+
+@job_handler('test.slow')
+def slow(context):
+    context.progress(0.5, 'half way')
+    return {'done': True}
+
+@job_handler('test.stalled')
+def stalled(context, report=False):
+    """Runs past its lease, and another worker claims the job before it finishes"""
+    Job.query.filter_by(id=context.job_id).update({'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert claim_next('other').id == context.job_id
+    if report:
+        context.progress(0.5, 'half way')
+    return {'worker': context.worker_id}
+
+def create_documents(app, count, **fields):
+    """Add ``count`` documents under one template; returns their public ids"""
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        documents = [Document(name=f'Invoice {n}', content=f'<p>{n}</p>', template_id=template.id, **fields)
+                     for n in range(count)]
+        db.session.add_all(documents)
+        db.session.commit()
+        return [document.public_id for document in documents]
+
+def test_export_runs_in_the_background(app, client, tmp_path, user_headers):
+    """Test an export is queued with 202, run by a worker and downloaded as NDJSON"""
+    app.config['JOBS_DIR'] = str(tmp_path)
+    headers = user_headers(client, app, 'alice')
+    create_documents(app, 3, status='approved')
+    create_documents(app, 2, status='draft')
+    
+    response = client.post('/api/v1/documents/export', headers=headers, json={'status': 'approved'})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == QUEUED
+    assert response.headers['Location'].endswith(job['links']['self'])
+    assert client.get(job['links']['result'], headers=headers).status_code == 409
+    
+    with app.app_context():
+        assert run_next(app, 'test').status == SUCCEEDED
+    
+    status = client.get(job['links']['self'], headers=headers).get_json()
+    assert status['status'] == SUCCEEDED
+    assert status['progress'] == 1.0
+    result = client.get(job['links']['result'], headers=headers)
+    assert result.status_code == 200
+    assert result.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in result.data.decode().splitlines()]
+    assert [line['status'] for line in lines] == ['approved'] * 3
+    
+    other = user_headers(client, app, 'bob')
+    assert client.get(job['links']['self'], headers=other).status_code == 404
+
+def test_bulk_transition_moves_documents(app, client, user_headers):
+    """Test a bulk transition updates documents, writes history and skips unchanged ones"""
+    headers = user_headers(client, app, 'alice')
+    public_ids = create_documents(app, 3)
+    with app.app_context():
+        station = Station(name='Review', type='review')
+        station.save()
+        station_id = station.id
+        Document.query.filter_by(public_id=public_ids[0]).one().current_station_id = station_id
+        db.session.commit()
+    
+    assert client.post('/api/v1/documents/bulk-transition', headers=headers,
+                       json={'document_ids': public_ids}).status_code == 400
+    assert client.post('/api/v1/documents/bulk-transition', headers=headers,
+                       json={'document_ids': [public_ids[0]] * 2, 'status': 'submitted'}).status_code == 400
+    response = client.post('/api/v1/documents/bulk-transition', headers=headers, json={
+        'document_ids': public_ids + ['missing'], 'current_station_id': station_id
+    })
+    assert response.status_code == 202
+    
+    with app.app_context():
+        job = run_next(app, 'test')
+        assert job.status == SUCCEEDED
+        assert job.get_result() == {'updated': 2, 'unchanged': 1, 'missing': ['missing']}
+        assert {document.current_station_id for document in Document.query} == {station_id}
+        assert [history.action for history in DocumentHistory.query] == ['moved', 'moved']
+
+def test_failed_jobs_retry_with_backoff(app):
+    """Test a failing job is queued again later and fails once its attempts are used up"""
+    app.config['JOBS_RETRY_BACKOFF_SECONDS'] = 60
+    calls.clear()
+    with app.app_context():
+        job = enqueue('test.flaky', {'fail_times': 5}, max_attempts=2)
+        
+        job = run_next(app, 'test')
+        assert job.status == QUEUED
+        assert job.run_after > datetime.utcnow()
+        assert 'temporary failure' in job.error
+        # Not due yet
+        assert run_next(app, 'test') is None
+        
+        Job.query.get(job.id).run_after = datetime.utcnow()
+        db.session.commit()
+        job = run_next(app, 'test')
+        assert job.status == FAILED
+        assert job.attempts == 2
+        assert calls == [1, 2]
+
+def test_retry_succeeds(app):
+    """Test a job that fails once succeeds on its second attempt"""
+    app.config['JOBS_RETRY_BACKOFF_SECONDS'] = 0
+    with app.app_context():
+        enqueue('test.flaky', {'fail_times': 1})
+        assert run_next(app, 'test').status == QUEUED
+        job = run_next(app, 'test')
+        assert job.status == SUCCEEDED
+        assert job.get_result() == {'attempt': 2}
+
+def test_cancel_queued_and_running_jobs(app, client, user_headers):
+    """Test cancelling a queued job stops it at once and a running one at its next progress report"""
+    headers = user_headers(client, app, 'alice')
+    response = client.post('/api/v1/documents/export', headers=headers, json={})
+    link = response.get_json()['links']['cancel']
+    assert client.post(link, headers=headers).status_code == 202
+    assert client.get(response.headers['Location'], headers=headers).get_json()['status'] == CANCELLED
+    assert client.post(link, headers=headers).status_code == 409
+    
+    with app.app_context():
+        assert run_next(app, 'test') is None
+        enqueue('test.slow')
+        job = claim_next('test')
+        assert cancel(job)
+        assert run_job(app, job).status == CANCELLED
+
+def test_worker_that_lost_its_lease_records_nothing(app):
+    """Test the outcome and progress of a worker whose job was claimed by another are dropped"""
+    with app.app_context():
+        for report in (False, True):
+            enqueue('test.stalled', {'report': report})
+            job = run_next(app, 'test')
+            assert (job.status, job.locked_by, job.result, job.progress_message) == (RUNNING, 'other', None, None)
+            assert job.locked_until > datetime.utcnow()
+
+def test_worker_command_drains_the_queue(app, runner):
+    """Test ``flask jobs worker --burst`` runs queued jobs and exits"""
+    with app.app_context():
+        enqueue('test.flaky')
+        enqueue('test.flaky')
+    
+    result = runner.invoke(args=['jobs', 'worker', '--burst'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert [job.status for job in Job.query] == [SUCCEEDED, SUCCEEDED]
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from app.observability.loadtest import LoadTestError, MIXES, parse_mix
+
+def test_parse_mix():
+    """Test named and custom traffic mixes"""
+    assert parse_mix('polling') == MIXES['polling']
+    assert parse_mix('poll_document=3, login=1') == {'poll_document': 3.0, 'login': 1.0}
+    with pytest.raises(LoadTestError):
+        parse_mix('poll_document=3,teleport=1')
+    with pytest.raises(LoadTestError):
+        parse_mix('login=0')
+
+def test_loadtest_in_process(runner):
+    """Test the CLI replays a mix in-process and reports percentiles per route"""
+    result = runner.invoke(args=[
+        'loadtest', '--mix', 'mixed', '--rate', '40', '--duration', '1',
+        '--users', '2', '--documents', '3', '--seed', '7', '--json'
+    ])
+    assert result.exit_code == 0, result.output
+    
+    summary = json.loads(result.output)
+    assert summary['requests'] > 10
+    assert summary['errors'] == 0
+    assert set(summary['routes']) <= {
+        'GET /documents/<id>', 'GET /stations/<id>/documents', 'POST /documents',
+        'PUT /documents/<id>', 'POST /auth/login'
+    }
+    for stats in summary['routes'].values():
+        assert stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms'] <= stats['max_ms']
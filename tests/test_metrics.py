@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from prometheus_client.parser import text_string_to_metric_families
+
+def sample_value(text, name, **labels):
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value
+    return None
+
+def test_metrics_endpoint_reports_routes(client, auth):
+    """Test /metrics exposes per-endpoint counts, latency, DB time and cache lookups"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    endpoint = 'api_v1.get_stations'
+    before = sample_value(client.get('/metrics').get_data(as_text=True),
+                          'http_requests_total', endpoint=endpoint, status='200') or 0
+    
+    client.get('/api/v1/stations', headers=headers)
+    client.get('/api/v1/stations', headers=headers)
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.get_data(as_text=True)
+    assert sample_value(text, 'http_requests_total', endpoint=endpoint, status='200') == before + 2
+    assert sample_value(text, 'http_request_duration_seconds_count', endpoint=endpoint) >= 2
+    assert sample_value(text, 'http_request_db_queries_sum', endpoint=endpoint) >= 2
+    assert sample_value(text, 'http_response_size_bytes_count', endpoint=endpoint) >= 2
+    assert sample_value(text, 'cache_lookups_total', cache='jwt_decode', result='hit') >= 1
+    assert sample_value(text, 'http_requests_in_progress', method='GET') == 1
+
+def test_metrics_endpoint_is_off_unless_enabled(sharded_app):
+    """Test /metrics is not served without METRICS_ENABLED"""
+    assert sharded_app.test_client().get('/metrics').status_code == 404
+
+def test_metrics_aggregate_across_processes(tmp_path):
+    """Test samples written by separate worker processes are summed"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    worker = (
+        "from app.observability.metrics import REQUESTS;"
+        "REQUESTS.labels('GET', 'health_check', 200).inc()"
+    )
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', worker], env=env, check=True)
+    
+    reader = (
+        "from prometheus_client import generate_latest;"
+        "from app.observability.metrics import metrics_registry;"
+        "print(generate_latest(metrics_registry()).decode())"
+    )
+    text = subprocess.run([sys.executable, '-c', reader], env=env, check=True,
+                          capture_output=True, text=True).stdout
+    assert sample_value(text, 'http_requests_total', endpoint='health_check', status='200') == 2
@@ -0,0 +1,63 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.api.v1.models import models
+from app.api.v1.models.models import User
+from app.security import passwords
+from app.security.passwords import PasswordHasherBusy
+
+def test_scrypt_hash_roundtrip():
+    """Test scrypt hashes verify and reject wrong passwords"""
+    pwhash = passwords._hash('secret-password', 'scrypt:16384:8:1')
+    assert pwhash.startswith('scrypt:16384:8:1$')
+    assert passwords._verify(pwhash, 'secret-password')
+    assert not passwords._verify(pwhash, 'wrong-password')
+
+def test_login_rehashes_to_configured_method(client, auth, app):
+    """Test login moves an outdated hash onto the configured method"""
+    auth.register()
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:16384:8:1'
+    
+    assert auth.login().status_code == 200
+    with app.app_context():
+        user = User.query.filter_by(username='test').first()
+        assert user.password_hash.startswith('scrypt:16384:8:1$')
+    
+    # The new hash still verifies
+    assert auth.login().status_code == 200
+    assert auth.login(password='wrong-password').status_code == 401
+
+def test_register_busy_pool_returns_503(client, auth, monkeypatch):
+    """Test registration fails fast when the hashing pool is saturated"""
+    def busy(password):
+        raise PasswordHasherBusy()
+    monkeypatch.setattr(models, 'hash_password', busy)
+    
+    response = auth.register()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_broken_pool_is_shut_down_and_replaced(app, monkeypatch):
+    """Test a pool whose processes died is shut down, not just dropped"""
+    class BrokenPool:
+        shut_down = False
+        
+        def submit(self, func, *args):
+            raise BrokenProcessPool()
+        
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.shut_down = True
+    
+    broken = BrokenPool()
+    monkeypatch.setattr(passwords, '_pool', broken)
+    monkeypatch.setattr(passwords, '_pool_pid', os.getpid())
+    monkeypatch.setattr(passwords, '_slots', threading.BoundedSemaphore(1))
+    with app.app_context():
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        with pytest.raises(PasswordHasherBusy):
+            passwords.hash_password('secret-password')
+    assert broken.shut_down
+    assert passwords._pool is None
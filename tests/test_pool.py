@@ -0,0 +1,47 @@
+from app import db
+from app.database.pool import dispose_inherited_pools, engine_options_from_env, pool_registry
+
+def test_engine_options_from_env():
+    """Test pool settings are read from the environment"""
+    options = engine_options_from_env({
+        'SQLALCHEMY_ENGINE_OPTIONS': '{"pool_size": 5, "echo": true}',
+        'DB_POOL_SIZE': '20',
+        'DB_MAX_OVERFLOW': '10',
+        'DB_POOL_PRE_PING': 'false'
+    })
+    assert options['pool_size'] == 20
+    assert options['max_overflow'] == 10
+    assert options['pool_pre_ping'] is False
+    assert options['echo'] is True
+    assert options['pool_recycle'] == 1800
+
+def test_pool_metrics(client, app, user_headers):
+    """Test pool checkouts are reported to admins, by bind name rather than URL"""
+    admin = user_headers(client, app, 'root', role='admin')
+    user = user_headers(client, app, 'alice')
+    
+    assert client.get('/metrics/pool').status_code == 401
+    assert client.get('/metrics/pool', headers=user).status_code == 403
+    response = client.get('/metrics/pool', headers=admin)
+    assert response.status_code == 200
+    assert '://' not in response.get_data(as_text=True)
+    stats = response.get_json()['pools']['primary']
+    assert stats['checkouts'] >= 2
+    assert stats['in_use'] == 0
+    assert stats['checkout_wait_max_seconds'] >= 0
+
+def test_forked_worker_gets_fresh_pool(app):
+    """Test a forked child drops the parent's pool and starts from zero"""
+    with app.app_context():
+        engine = db.engine
+        with engine.connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
+        parent_pool = engine.pool
+        
+        dispose_inherited_pools()
+        
+        assert engine.pool is not parent_pool
+        stats = [s for s in pool_registry.values() if s.engine is engine][-1]
+        assert stats.snapshot()['checkouts'] == 0
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT 1').scalar() == 1
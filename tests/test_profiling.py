@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from app import create_app
+
+def busy_view():
+    deadline = time.monotonic() + 0.05
+    while time.monotonic() < deadline:
+        pass
+    return {"done": True}
+
+@pytest.fixture
+def profiled_app():
+    """Factory for an app with profiling on and a deliberately slow route"""
+    tmpdir = tempfile.mkdtemp()
+    
+    def make(sample_rate):
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmpdir}/app.db',
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+            'SECRET_KEY': 'test-key',
+            'JWT_SECRET_KEY': 'jwt-test-key',
+            'PROFILING_ENABLED': True,
+            'PROFILE_SAMPLE_RATE': sample_rate,
+            'PROFILE_INTERVAL_MS': 1,
+            'PROFILE_DIR': f'{tmpdir}/profiles'
+        })
+        app.add_url_rule('/busy', 'busy', busy_view)
+        return app
+    
+    yield make
+    shutil.rmtree(tmpdir)
+
+def profiles(app, endpoint='busy'):
+    directory = os.path.join(app.config['PROFILE_DIR'], endpoint)
+    return [os.path.join(directory, name) for name in os.listdir(directory)] if os.path.isdir(directory) else []
+
+def test_sampled_request_writes_folded_profile(profiled_app):
+    """Test a sampled request leaves a collapsed-stack file under its endpoint"""
+    app = profiled_app(1.0)
+    
+    assert app.test_client().get('/busy').status_code == 200
+    
+    files = profiles(app)
+    assert len(files) == 1
+    with open(files[0]) as fh:
+        lines = fh.read().splitlines()
+    assert any(line.split(' ')[0].endswith('test_profiling:busy_view') for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+def test_profile_header_requires_admin(profiled_app, user_headers):
+    """Test X-Profile is ignored for regular users and honoured for admins"""
+    app = profiled_app(0.0)
+    client = app.test_client()
+    
+    client.get('/busy', headers={'X-Profile': '1', **user_headers(client, app, 'alice')})
+    assert profiles(app) == []
+    
+    client.get('/busy', headers={'X-Profile': '1', **user_headers(client, app, 'root', role='admin')})
+    assert len(profiles(app)) == 1
+
+def test_hot_functions_report(profiled_app, user_headers):
+    """Test admins get the hottest functions across recent profiles"""
+    app = profiled_app(1.0)
+    client = app.test_client()
+    client.get('/busy')
+    client.get('/busy')
+    
+    user = user_headers(client, app, 'alice')
+    assert client.get('/admin/profiles/hot', headers=user).status_code == 403
+    
+    admin = user_headers(client, app, 'root', role='admin')
+    report = client.get('/admin/profiles/hot?endpoint=busy', headers=admin).get_json()
+    assert report['profiles'] == 2
+    assert report['samples'] > 0
+    assert any(f['function'].endswith('test_profiling:busy_view') for f in report['functions'])
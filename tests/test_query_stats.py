@@ -0,0 +1,58 @@
+import json
+import logging
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.api.v1.models.models import Station
+
+def test_server_timing_reports_queries(client, auth):
+    """Test responses carry the request's DB time and query count"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    
+    response = client.get('/api/v1/stations', headers=headers)
+    
+    db_metric, app_metric = response.headers['Server-Timing'].split(', ')
+    assert db_metric.startswith('db;dur=')
+    assert int(db_metric.split('desc="')[1].split(' ')[0]) >= 1
+    assert app_metric.startswith('app;dur=')
+
+def test_request_log_line(client, auth, caplog):
+    """Test each request logs one JSON line with its query totals"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    
+    with caplog.at_level(logging.INFO, logger='app.requests'):
+        client.get('/api/v1/stations', headers=headers)
+    
+    lines = [json.loads(r.getMessage()) for r in caplog.records if r.name == 'app.requests']
+    assert len(lines) == 1
+    assert lines[0]['path'] == '/api/v1/stations'
+    assert lines[0]['status'] == 200
+    assert lines[0]['db_queries'] >= 1
+    assert lines[0]['slowest_query'].startswith('SELECT')
+
+def test_slow_query_logged_with_plan(app, caplog):
+    """Test statements over SLOW_QUERY_MS are logged with their EXPLAIN plan"""
+    app.config['SLOW_QUERY_MS'] = 0
+    
+    with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+        with app.app_context():
+            Station.query.filter_by(name='Approval').all()
+    
+    entries = [json.loads(r.getMessage()) for r in caplog.records if r.name == 'app.slow_queries']
+    select = [e for e in entries if 'FROM stations' in e['statement']]
+    assert select and select[0]['plan']
+    assert 'stations' in ' '.join(select[0]['plan'])
+
+def test_failed_statements_leave_no_timer_behind(app):
+    """Test a statement that raises leaves no start time on the pooled connection"""
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.exec_driver_sql('SELECT * FROM no_such_table')
+            assert conn.exec_driver_sql('SELECT 1').scalar() == 1
+            assert not conn.info.get('query_start')
@@ -0,0 +1,245 @@
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from app import db
+from app.api.v1.models.models import Document, Template
+from app.rendering import pdf as pdf_module
+from app.rendering.pdf import TextPdfRenderer, UnsupportedText
+from app.rendering.service import RenderTimeout, render_pool
+
+class CountingRenderer:
+    """Test renderer that records what it was asked to render"""
+    name = 'counting'
+    version = '1'
+    calls = []
+    
+    def render(self, title, html):
+        self.calls.append(title)
+        return TextPdfRenderer().render(title, html)
+
+class SleepingRenderer:
+    """Test renderer that takes ``seconds`` to render"""
+    name = 'sleeping'
+    version = '1'
+    seconds = 60
+    
+    def render(self, title, html):
+        time.sleep(self.seconds)
+        return TextPdfRenderer().render(title, html)
+
+class SlowRenderer(SleepingRenderer):
+    """Slow enough that every racing request arrives while the render runs"""
+    seconds = 0.5
+
+def truetype_font(chars, advance=600):
+    """Smallest TrueType file the renderer reads: glyph ``n`` is the ``n``-th of the sorted ``chars``"""
+    codes = sorted({ord(char) for char in chars})
+    glyphs = len(codes) + 1
+    segments = [(code, code, n + 1 - code) for n, code in enumerate(codes)] + [(0xFFFF, 0xFFFF, 1)]
+    subtable = b''.join([
+        struct.pack('>7H', 4, 16 + 8 * len(segments), 0, 2 * len(segments), 0, 0, 0),
+        struct.pack('>%dH' % len(segments), *(end for _, end, _ in segments)), b'\0\0',
+        struct.pack('>%dH' % len(segments), *(start for start, _, _ in segments)),
+        struct.pack('>%dh' % len(segments), *(delta for _, _, delta in segments)),
+        struct.pack('>%dH' % len(segments), *[0] * len(segments)),
+    ])
+    name = 'Test Thai'.encode('utf-16-be')
+    tables = {
+        b'OS/2': bytes(88) + struct.pack('>h', 700),
+        b'cmap': struct.pack('>HHHHI', 0, 1, 3, 1, 12) + subtable,
+        b'head': struct.pack('>4I2H', 0x10000, 0x10000, 0, 0x5F0F3CF5, 0, 1000) + bytes(16)
+                 + struct.pack('>4h', 0, -200, 1000, 800) + bytes(10),
+        b'hhea': struct.pack('>I3h', 0x10000, 800, -200, 0) + bytes(24) + struct.pack('>H', glyphs),
+        b'hmtx': struct.pack('>Hh', advance, 0) * glyphs,
+        b'maxp': struct.pack('>IH', 0x5000, glyphs),
+        b'name': struct.pack('>3H6H', 0, 1, 18, 3, 1, 0x409, 6, len(name), 0) + name,
+    }
+    offset = 12 + 16 * len(tables)
+    directory, data = [], b''
+    for tag, table in tables.items():
+        directory.append(struct.pack('>4s3I', tag, 0, offset + len(data), len(table)))
+        data += table + bytes(-len(table) % 4)
+    return struct.pack('>I4H', 0x10000, len(tables), 0, 0, 0) + b''.join(directory) + data
+
+def pdf_streams(pdf):
+    return [zlib.decompress(stream) for stream in re.findall(rb'stream\n(.*?)\nendstream', pdf, re.DOTALL)]
+
+def create_document(app, content='<h2>Total</h2><p>Amount: <b>10</b> (paid)</p>'):
+    """Add a template and a document using it; returns the document's public id"""
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        document = Document(name='Invoice 1', content=content, template_id=template.id)
+        document.save()
+        return document.public_id
+
+def test_pdf_writer_produces_a_valid_file():
+    """Test the built-in renderer output has a catalog, pages and a correct xref table"""
+    html = '<h1>Heading</h1>' + '<p>' + 'word ' * 2000 + '</p><ul><li>One</li></ul><script>skip()</script>'
+    pdf = TextPdfRenderer().render('Title (draft)', html)
+    assert pdf.startswith(b'%PDF-1.4') and pdf.endswith(b'%%EOF\n')
+    assert b'/Count 3 ' in pdf
+    assert TextPdfRenderer().render('Title (draft)', html) == pdf
+    
+    xref = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+    assert pdf[xref:].startswith(b'xref\n')
+    offsets = [int(line[:10]) for line in pdf[xref:].split(b'\n')[3:] if line.endswith(b' n ')]
+    assert [pdf[offset:].split(b' ', 1)[0] for offset in offsets] == [b'%d' % n for n in range(1, len(offsets) + 1)]
+
+def test_embedded_font_prints_thai(tmp_path):
+    """Test text is written as glyphs of the configured TrueType font, which is embedded with a Unicode map"""
+    title, body = 'ใบแจ้งหนี้', 'เลขที่ 12 (ชำระแล้ว)'
+    path = tmp_path / 'thai.ttf'
+    path.write_bytes(truetype_font(title + body))
+    renderer = TextPdfRenderer(font=str(path))
+    pdf = renderer.render(title, f'<p>{body}</p>')
+    assert b'/Subtype /CIDFontType2' in pdf and b'/FontFile2' in pdf and b'/BaseFont /TestThai' in pdf
+    assert renderer.render(title, f'<p>{body}</p>') == pdf
+    
+    glyphs = {char: n + 1 for n, char in enumerate(sorted(set(title + body)))}
+    font_file, to_unicode, content = pdf_streams(pdf)
+    assert b'?' not in content
+    assert b'<%s>' % ''.join('%04X' % glyphs[char] for char in title).encode() in content
+    # Headings use the regular font, stroked, when there is no bold font file
+    assert content.startswith(b'q 2 Tr')
+    assert font_file == path.read_bytes()
+    for char in title + body:
+        assert b'<%04X> <%04X>' % (glyphs[char], ord(char)) in to_unicode
+    # Another font is another rendering
+    assert renderer.version != TextPdfRenderer().version
+
+def test_base_fonts_refuse_text_they_cannot_print(app, client, tmp_path, user_headers, monkeypatch):
+    """Test Thai without RENDER_PDF_FONT is an error naming the setting, not a PDF full of ``?``"""
+    with pytest.raises(UnsupportedText, match='RENDER_PDF_FONT'):
+        TextPdfRenderer().render('ใบแจ้งหนี้', '')
+    
+    app.config['RENDER_CACHE_DIR'] = str(tmp_path)
+    render_pool.configure(0)
+    public_id = create_document(app, content='<p>ชำระแล้ว</p>')
+    headers = user_headers(client, app, 'alice')
+    response = client.get(f'/api/v1/documents/{public_id}/render.pdf', headers=headers)
+    assert response.status_code == 501
+    assert 'RENDER_PDF_FONT' in response.get_json()['error']
+    
+    font = tmp_path / 'thai.ttf'
+    font.write_bytes(truetype_font('Invoice 1ชำระแล้ว'))
+    monkeypatch.setitem(pdf_module.font_paths, 'regular', str(font))
+    response = client.get(f'/api/v1/documents/{public_id}/render.pdf', headers=headers)
+    assert response.status_code == 200
+    assert b'/FontFile2' in response.data
+
+def test_render_is_cached_by_content(app, client, tmp_path, user_headers):
+    """Test re-downloads come from the cache and edits to the document or template render again"""
+    app.config.update(RENDER_CACHE_DIR=str(tmp_path), RENDER_PDF_RENDERER=f'{__name__}:CountingRenderer')
+    render_pool.configure(0)
+    CountingRenderer.calls.clear()
+    headers = user_headers(client, app, 'alice')
+    public_id = create_document(app)
+    path = f'/api/v1/documents/{public_id}/render.pdf'
+    
+    first = client.get(path, headers=headers)
+    assert first.status_code == 200
+    assert first.mimetype == 'application/pdf'
+    assert first.data.startswith(b'%PDF')
+    assert 'no-cache' in first.headers['Cache-Control']
+    second = client.get(path, headers=headers)
+    assert second.data == first.data
+    assert CountingRenderer.calls == ['Invoice 1']
+    
+    etag = first.headers['ETag']
+    assert os.path.exists(os.path.join(tmp_path, etag.strip('"')[:2], etag.strip('"') + '.pdf'))
+    assert client.get(path, headers={**headers, 'If-None-Match': etag}).status_code == 304
+    assert 'attachment' in client.get(f'{path}?download=1', headers=headers).headers['Content-Disposition']
+    
+    with app.app_context():
+        Document.query.filter_by(public_id=public_id).one().content = '<p>Amount: 20</p>'
+        db.session.commit()
+    edited = client.get(path, headers=headers)
+    assert edited.headers['ETag'] != etag
+    with app.app_context():
+        Template.query.first().content = '<p>{{amount}} THB</p>'
+        db.session.commit()
+    assert client.get(path, headers=headers).headers['ETag'] != edited.headers['ETag']
+    assert len(CountingRenderer.calls) == 3
+
+def test_render_runs_on_the_process_pool(app, client, tmp_path, user_headers):
+    """Test a cache miss is rendered by a pool process"""
+    app.config['RENDER_CACHE_DIR'] = str(tmp_path)
+    render_pool.configure(1)
+    try:
+        headers = user_headers(client, app, 'alice')
+        public_id = create_document(app)
+        response = client.get(f'/api/v1/documents/{public_id}/render.pdf', headers=headers)
+        assert response.status_code == 200
+        assert response.data.startswith(b'%PDF')
+    finally:
+        render_pool.configure(0)
+
+def test_concurrent_renders_of_a_key_submit_once(monkeypatch):
+    """Test requests racing on the same key share one pool render"""
+    submitted = []
+    submit = ProcessPoolExecutor.submit
+    
+    def counting_submit(executor, *args):
+        submitted.append(args)
+        return submit(executor, *args)
+    
+    monkeypatch.setattr(ProcessPoolExecutor, 'submit', counting_submit)
+    render_pool.configure(1)
+    try:
+        start = threading.Barrier(8)
+        results = []
+        
+        def request():
+            start.wait()
+            results.append(render_pool.render('same-key', f'{__name__}:SlowRenderer', 'Invoice', '<p>1</p>', 30))
+        
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 8 and len(set(results)) == 1
+        assert len(submitted) == 1
+    finally:
+        render_pool.configure(0)
+
+def test_timed_out_render_recycles_the_pool():
+    """Test a stuck render's process is terminated, so the next render gets a free one"""
+    render_pool.configure(1)
+    try:
+        with pytest.raises(RenderTimeout):
+            render_pool.render('stuck', f'{__name__}:SleepingRenderer', 'Slow', '', 0.5)
+        data = render_pool.render('next', 'app.rendering.pdf:TextPdfRenderer', 'Invoice', '<p>1</p>', 10)
+        assert data.startswith(b'%PDF')
+    finally:
+        render_pool.configure(0)
+
+def test_render_is_tenant_scoped(app, client, tmp_path, user_headers):
+    """Test another organization's document cannot be rendered"""
+    app.config['RENDER_CACHE_DIR'] = str(tmp_path)
+    render_pool.configure(0)
+    public_id = create_document(app)
+    headers = user_headers(client, app, 'mallory', tenant='other')
+    assert client.get(f'/api/v1/documents/{public_id}/render.pdf', headers=headers).status_code == 404
+
+def test_prune_removes_least_recently_used(app, runner, tmp_path):
+    """Test ``flask render prune`` deletes the oldest files first"""
+    app.config['RENDER_CACHE_DIR'] = str(tmp_path)
+    for age, name in enumerate(['new', 'old']):
+        directory = tmp_path / name[:2]
+        directory.mkdir()
+        (directory / f'{name}.pdf').write_bytes(b'x' * 100)
+        os.utime(directory / f'{name}.pdf', (1000 - age, 1000 - age))
+    
+    result = runner.invoke(args=['render', 'prune', '--max-bytes', '150'])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / 'ne' / 'new.pdf').exists()
+    assert not (tmp_path / 'ol' / 'old.pdf').exists()
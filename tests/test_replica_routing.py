@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from app import create_app, db
+from app.api.v1.models.models import Station
+
+@pytest.fixture
+def replica_app():
+    """App whose replica is a stale copy of the primary file"""
+    tmpdir = tempfile.mkdtemp()
+    primary = os.path.join(tmpdir, 'primary.db')
+    replica = os.path.join(tmpdir, 'replica.db')
+    
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}',
+        'SQLALCHEMY_BINDS': {'replica_0': f'sqlite:///{replica}'},
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-key',
+        'JWT_SECRET_KEY': 'jwt-test-key'
+    })
+    
+    with app.app_context():
+        Station(name='Replicated', type='review').save()
+        db.engine.dispose()
+    shutil.copyfile(primary, replica)
+    with app.app_context():
+        Station(name='Primary only', type='review').save()
+    
+    @app.route('/_stations', methods=['GET', 'POST'])
+    def count_stations():
+        return {"count": Station.query.count()}
+    
+    yield app
+    shutil.rmtree(tmpdir)
+
+def test_reads_go_to_replica(replica_app):
+    """Test GET requests read the replica and other methods the primary"""
+    client = replica_app.test_client()
+    assert client.get('/_stations').get_json()['count'] == 1
+    assert client.post('/_stations').get_json()['count'] == 2
+
+def test_read_your_writes_after_write(replica_app):
+    """Test a client that just wrote reads from the primary"""
+    client = replica_app.test_client()
+    client.post('/_stations')
+    assert client.get('/_stations').get_json()['count'] == 2
+    
+    # Another client is still served by the replica
+    assert replica_app.test_client().get('/_stations').get_json()['count'] == 1
+
+def test_writes_in_safe_requests_use_primary(replica_app):
+    """Test flushes never go to the replica"""
+    with replica_app.test_request_context('/_stations', method='GET'):
+        replica_app.preprocess_request()
+        Station(name='Written during GET', type='review').save()
+        db.session.remove()
+    
+    with replica_app.app_context():
+        assert Station.query.count() == 3
+
+def test_reads_after_a_flush_use_primary(replica_app):
+    """Test a safe request that wrote reads its own write back"""
+    with replica_app.test_request_context('/_stations', method='GET'):
+        replica_app.preprocess_request()
+        assert Station.query.count() == 1
+        db.session.add(Station(name='Written during GET', type='review'))
+        db.session.flush()
+        assert Station.query.filter_by(name='Written during GET').count() == 1
+        db.session.commit()
+        assert Station.query.count() == 3
+        db.session.remove()
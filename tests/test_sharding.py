@@ -0,0 +1,123 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect, select
+
+from app import db
+from app.database import sharding
+from app.database.sharding import create_shard_tables, move_tenant
+from app.api.v1.models.models import Document, DocumentHistory, Template, TenantShard
+
+def create_template(app):
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        return template.id
+
+def shard_count(app, bind, table=Document.__table__):
+    with app.app_context():
+        with db.get_engine(app, bind).connect() as conn:
+            return len(conn.execute(table.select()).all())
+
+def test_documents_routed_to_tenant_shard(sharded_app, user_headers):
+    """Test a sharded tenant's documents live on its shard and stay private"""
+    client = sharded_app.test_client()
+    template_id = create_template(sharded_app)
+    with sharded_app.app_context():
+        TenantShard(tenant_id='acme', shard='b').save()
+    
+    acme = user_headers(client, sharded_app, 'acme_user', tenant='acme')
+    other = user_headers(client, sharded_app, 'other_user', tenant='globex')
+    
+    response = client.post('/api/v1/documents', headers=acme, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id
+    })
+    assert response.status_code == 201
+    
+    assert shard_count(sharded_app, 'shard_b') == 1
+    assert shard_count(sharded_app, None) == 0
+    assert len(client.get('/api/v1/documents', headers=acme).get_json()) == 1
+    assert client.get('/api/v1/documents', headers=other).get_json() == []
+
+def test_move_tenant_between_shards(sharded_app, user_headers):
+    """Test moving a tenant copies documents and history, then purges the source"""
+    client = sharded_app.test_client()
+    template_id = create_template(sharded_app)
+    acme = user_headers(client, sharded_app, 'acme_user', tenant='acme')
+    
+    for n in range(3):
+        client.post('/api/v1/documents', headers=acme, json={
+            'name': f'Invoice {n}', 'content': '<p>10</p>', 'template_id': template_id
+        })
+    public_id = client.get('/api/v1/documents', headers=acme).get_json()[0]['public_id']
+    assert shard_count(sharded_app, None) == 3
+    
+    result = sharded_app.test_cli_runner().invoke(args=['tenants', 'move', 'acme', 'b', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    
+    assert shard_count(sharded_app, None) == 0
+    assert shard_count(sharded_app, 'shard_b') == 3
+    assert shard_count(sharded_app, 'shard_b', DocumentHistory.__table__) == 3
+    
+    # Same public ids, history still attached
+    response = client.get(f'/api/v1/documents/{public_id}/history', headers=acme)
+    assert response.status_code == 200
+    assert response.get_json()[0]['action'] == 'created'
+
+def test_shard_tables_only_reference_tables_on_the_shard(sharded_app):
+    """Test shard copies keep foreign keys between shard tables and drop those to primary-only tables"""
+    with sharded_app.app_context():
+        engine = db.get_engine(sharded_app, 'shard_b')
+        create_shard_tables(engine)
+        create_shard_tables(engine)
+        inspector = inspect(engine)
+        assert 'templates' not in inspector.get_table_names()
+        assert inspector.get_foreign_keys('documents') == []
+        assert {fk['referred_table'] for fk in inspector.get_foreign_keys('document_history')} == {'documents'}
+        assert {index['name'] for index in inspector.get_indexes('documents')} >= \
+            {index.name for index in Document.__table__.indexes}
+
+def commit_late_document(template_id):
+    """Insert a document that was flushed long ago and committed only now: its updated_at predates every pass"""
+    with db.engine.begin() as conn:
+        if conn.execute(select(Document.__table__).where(Document.public_id == 'late')).first():
+            return
+        conn.execute(Document.__table__.insert().values(
+            public_id='late', name='Late', content='<p></p>', template_id=template_id, tenant_id='acme',
+            status='draft', created_at=datetime(2000, 1, 1), updated_at=datetime(2000, 1, 1)
+        ))
+
+def test_move_copies_writes_committed_after_their_pass(sharded_app, user_headers, monkeypatch):
+    """Test the frozen final pass picks up a row whose updated_at predates the catch-up passes"""
+    client = sharded_app.test_client()
+    template_id = create_template(sharded_app)
+    acme = user_headers(client, sharded_app, 'acme_user', tenant='acme')
+    client.post('/api/v1/documents', headers=acme, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id
+    })
+    monkeypatch.setattr(sharding.time, 'sleep', lambda seconds: commit_late_document(template_id))
+    
+    with sharded_app.app_context():
+        move_tenant('acme', 'b', log=lambda message: None)
+    
+    assert shard_count(sharded_app, None) == 0
+    assert shard_count(sharded_app, 'shard_b') == 2
+    assert client.get('/api/v1/documents/late', headers=acme).status_code == 200
+
+def test_move_is_abandoned_when_counts_differ(sharded_app, user_headers, monkeypatch):
+    """Test a move that cannot account for every row leaves the tenant on its source shard"""
+    client = sharded_app.test_client()
+    template_id = create_template(sharded_app)
+    acme = user_headers(client, sharded_app, 'acme_user', tenant='acme')
+    client.post('/api/v1/documents', headers=acme, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id
+    })
+    monkeypatch.setattr(sharding.time, 'sleep', lambda seconds: commit_late_document(template_id))
+    monkeypatch.setattr(sharding.TenantMover, 'reconcile', lambda self: 0)
+    
+    with sharded_app.app_context():
+        with pytest.raises(RuntimeError):
+            move_tenant('acme', 'b', log=lambda message: None)
+        mapping = TenantShard.query.filter_by(tenant_id='acme').one()
+        assert (mapping.shard, mapping.state) == ('primary', 'active')
+    assert shard_count(sharded_app, None) == 2
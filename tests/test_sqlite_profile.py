@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.api.v1.models.models import Station
+
+@pytest.fixture
+def production_app():
+    """App on a SQLite file with the production profile"""
+    db_fd, db_path = tempfile.mkstemp()
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': 'test-key',
+        'JWT_SECRET_KEY': 'jwt-test-key',
+        'SQLITE_PROFILE': 'production'
+    })
+    yield app
+    os.close(db_fd)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
+
+def test_pragmas_applied(production_app):
+    """Test every connection runs in WAL mode with the tuned settings"""
+    with production_app.app_context():
+        assert db.session.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert db.session.execute('PRAGMA synchronous').scalar() == 1  # NORMAL
+        assert db.session.execute('PRAGMA busy_timeout').scalar() == 5000
+
+def test_save_retries_locked_database(production_app, monkeypatch):
+    """Test a locked commit is retried without losing the pending change"""
+    with production_app.app_context():
+        station = Station(name='Review', type='review')
+        station.save()
+        
+        real_commit = db.session.commit
+        calls = []
+        
+        def flaky_commit():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('UPDATE stations', {}, Exception('database is locked'))
+            real_commit()
+        
+        monkeypatch.setattr(db.session, 'commit', flaky_commit)
+        station.name = 'Final review'
+        station.save()
+        
+        assert len(calls) == 2
+        db.session.expire_all()
+        assert Station.query.get(station.id).name == 'Final review'
+
+def test_save_does_not_retry_other_pending_writes(production_app, monkeypatch):
+    """Test a locked commit is not retried when a rollback would lose other writes of the transaction"""
+    with production_app.app_context():
+        Station(name='Intake', type='review').save()
+        calls = []
+        
+        def locked_commit():
+            calls.append(1)
+            raise OperationalError('UPDATE stations', {}, Exception('database is locked'))
+        
+        monkeypatch.setattr(db.session, 'commit', locked_commit)
+        Station.query.filter_by(name='Intake').delete()
+        with pytest.raises(OperationalError):
+            Station(name='Review', type='review').save()
+        assert len(calls) == 1
+        
+        db.session.add(Station(name='Archive', type='review'))
+        with pytest.raises(OperationalError):
+            Station(name='Review', type='review').save()
+        assert len(calls) == 2
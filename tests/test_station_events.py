@@ -0,0 +1,166 @@
+import json
+import os
+
+from app.api.v1.models.models import Station, Template
+from app.api.v1.utils import station_events as station_events_module
+from app.api.v1.utils.station_events import StationEventBus, event_stream, station_events
+
+def parse_event(chunk):
+    """``(id, event, data)`` of one SSE message"""
+    fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines() if not line.startswith(':'))
+    return fields.get('id'), fields.get('event'), json.loads(fields['data']) if 'data' in fields else None
+
+def create_fixtures(app):
+    with app.app_context():
+        template = Template(name='Invoice', content='<p>{{amount}}</p>', status='active')
+        template.save()
+        stations = [Station(name=name, type='review') for name in ('Intake', 'Approval')]
+        for station in stations:
+            station.save()
+        return template.id, [(station.id, station.public_id) for station in stations]
+
+def test_station_stream_pushes_document_events(app, client, auth):
+    """Test documents arriving, changing and leaving a station are streamed to it"""
+    app.config['STATION_EVENTS_MAX_SECONDS'] = 5
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    template_id, [(intake_id, intake), (approval_id, _)] = create_fixtures(app)
+    
+    response = client.get(f'/api/v1/stations/{intake}/events', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    stream = iter(response.response)
+    assert next(stream).decode().startswith('retry:')
+    
+    created = client.post('/api/v1/documents', headers=headers, json={
+        'name': 'Invoice 1', 'content': '<p>10</p>', 'template_id': template_id, 'current_station_id': intake_id
+    }).get_json()
+    path = f'/api/v1/documents/{created["public_id"]}'
+    client.put(path, headers=headers, json={'status': 'submitted'})
+    client.put(path, headers=headers, json={'current_station_id': approval_id})
+    
+    events = [parse_event(next(stream).decode()) for _ in range(3)]
+    assert [event for _, event, _ in events] == ['arrive', 'update', 'leave']
+    assert {data['public_id'] for _, _, data in events} == {created['public_id']}
+    assert events[1][2]['status'] == 'submitted'
+    assert 'content' not in events[0][2]
+    response.close()
+
+def test_station_stream_unknown_station(client, auth):
+    """Test streaming a missing station returns 404"""
+    auth.register()
+    response = client.get('/api/v1/stations/missing/events',
+                          headers={'Authorization': f'Bearer {auth.get_token()}'})
+    assert response.status_code == 404
+
+def test_stream_resumes_from_last_event_id():
+    """Test a reconnect gets missed events, or a reset once they left the buffer"""
+    station_events.configure(size=3)
+    for n in range(3):
+        station_events.publish({'type': 'update', 'station_id': 1, 'tenant_id': None, 'document': {'n': n}})
+    
+    stream = event_stream(1, None, last_event_id='1', heartbeat=0.05, max_seconds=0.2)
+    chunks = [chunk for chunk in stream if not chunk.startswith((':', 'retry'))]
+    assert [parse_event(chunk)[2]['n'] for chunk in chunks] == [1, 2]
+    
+    stream = event_stream(1, None, last_event_id='999', heartbeat=0.05, max_seconds=0.2)
+    chunks = [chunk for chunk in stream if not chunk.startswith((':', 'retry'))]
+    assert [parse_event(chunk)[1] for chunk in chunks] == ['reset']
+    station_events.configure()
+
+def test_file_backed_bus_shares_events_between_workers(tmp_path):
+    """Test an event published by one worker reaches another through the events file"""
+    path = str(tmp_path / 'events.ndjson')
+    publisher, subscriber = StationEventBus(), StationEventBus()
+    publisher.configure(path=path, poll_seconds=0.01)
+    subscriber.configure(path=path, poll_seconds=0.01)
+    
+    cursor, missed = subscriber.cursor()
+    assert not missed
+    publisher.publish({'type': 'arrive', 'station_id': 7, 'tenant_id': 'acme', 'document': {'public_id': 'x'}})
+    events, cursor, missed = subscriber.wait(cursor, timeout=5)
+    assert not missed
+    [(event_id, event)] = events
+    assert event['document'] == {'public_id': 'x'}
+    # Ids are the file's generation and the event's offset, so every worker gives the event the same id
+    content = open(path, 'rb').read()
+    generation = json.loads(content.splitlines()[0])['generation']
+    assert event_id == f'{generation}:{len(content)}'
+    
+    subscriber.configure()
+    publisher.configure()
+
+def test_file_backed_ids_are_unique_across_rotations(tmp_path):
+    """Test an event after a rotation does not reuse the id of one before it"""
+    path = str(tmp_path / 'events.ndjson')
+    publisher, subscriber = StationEventBus(), StationEventBus()
+    # Rotated after the second event
+    publisher.configure(path=path, max_bytes=150, poll_seconds=0.01)
+    subscriber.configure(path=path, poll_seconds=0.01)
+    
+    cursor, _ = subscriber.cursor()
+    ids = []
+    for n in range(3):
+        publisher.publish({'type': 'update', 'station_id': 7, 'tenant_id': None, 'document': {'n': n}})
+        events, cursor, _ = subscriber.wait(cursor, timeout=5)
+        ids.extend(event_id for event_id, _ in events)
+    assert len(ids) == 3
+    # The third event is the first of a new file: same offset as the first, new generation
+    assert ids[0].split(':')[1] == ids[2].split(':')[1]
+    assert ids[0] != ids[2] and ids[0].split(':')[0] == ids[1].split(':')[0]
+    
+    subscriber.configure()
+    publisher.configure()
+
+def test_publish_follows_a_rotation_made_before_it_locked(tmp_path, monkeypatch):
+    """Test an event is not appended to a file another publisher rotated after it was opened"""
+    path = str(tmp_path / 'events.ndjson')
+    publisher, subscriber = StationEventBus(), StationEventBus()
+    publisher.configure(path=path, poll_seconds=0.01)
+    subscriber.configure(path=path, poll_seconds=0.01)
+    
+    cursor, _ = subscriber.cursor()
+    publisher.publish({'type': 'update', 'station_id': 7, 'tenant_id': None, 'document': {'n': 0}})
+    events, cursor, _ = subscriber.wait(cursor, timeout=5)
+    assert len(events) == 1
+    
+    # Another publisher takes the lock first and rotates the file
+    real_flock = station_events_module.fcntl.flock
+    rotations = []
+    
+    def flock(fd, operation):
+        if not rotations:
+            os.replace(path, path + '.1')
+            rotations.append(fd)
+        return real_flock(fd, operation)
+    
+    monkeypatch.setattr(station_events_module.fcntl, 'flock', flock)
+    publisher.publish({'type': 'update', 'station_id': 7, 'tenant_id': None, 'document': {'n': 1}})
+    monkeypatch.undo()
+    
+    events, cursor, _ = subscriber.wait(cursor, timeout=5)
+    assert [event['document'] for _, event in events] == [{'n': 1}]
+    assert b'"n":1' not in open(path + '.1', 'rb').read()
+    
+    subscriber.configure()
+    publisher.configure()
+
+def test_streams_per_worker_are_capped(app, client, auth):
+    """Test streams beyond STATION_EVENTS_MAX_STREAMS get 503 and a closed stream frees its slot"""
+    station_events.max_streams = 1
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    _, [(_, intake), _] = create_fixtures(app)
+    path = f'/api/v1/stations/{intake}/events'
+    
+    first = client.get(path, headers=headers, buffered=False)
+    assert first.status_code == 200
+    refused = client.get(path, headers=headers, buffered=False)
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '3'
+    
+    first.close()
+    second = client.get(path, headers=headers, buffered=False)
+    assert second.status_code == 200
+    second.close()
+    station_events.configure()
@@ -0,0 +1,33 @@
+import time
+from app import jwt
+from app.security.token_cache import TokenCache
+
+def test_cache_drops_expired_claims():
+    """Test expired tokens are not served from the cache"""
+    cache = TokenCache(maxsize=2)
+    cache.put(b'live', {'exp': time.time() + 60})
+    cache.put(b'dead', {'exp': time.time() - 1})
+    
+    assert cache.get(b'live') is not None
+    assert cache.get(b'dead') is None
+
+def test_cache_is_bounded():
+    """Test the least recently used token is evicted"""
+    cache = TokenCache(maxsize=2)
+    cache.put(b'a', {})
+    cache.put(b'b', {})
+    cache.get(b'a')
+    cache.put(b'c', {})
+    
+    assert cache.get(b'b') is None
+    assert cache.get(b'a') is not None
+
+def test_repeat_requests_hit_cache(client, auth):
+    """Test a polling client's token is verified once"""
+    auth.register()
+    headers = {'Authorization': f'Bearer {auth.get_token()}'}
+    
+    client.get('/api/v1/auth/me', headers=headers)
+    hits = jwt.token_cache.hits
+    client.get('/api/v1/auth/me', headers=headers)
+    assert jwt.token_cache.hits == hits + 1